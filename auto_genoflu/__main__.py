@@ -1,68 +1,172 @@
-import os
 from glob import glob
 import argparse
-import json
 import datetime 
 import time
+import math
 import logging 
+from typing import Optional, Set
 
 
 DEFAULT_SCAN_INTERVAL_SECONDS = 300
 
-from auto_genoflu._analysis import find_genoflu_files_to_process, run_genoflu, prelim_checks
-from auto_genoflu._tools import load_config, make_summary_file, delete_files
-from auto_genoflu.operations import make_folder
-from auto_genoflu.slurm import init_slurm_executor, run_slurm_array
+from auto_genoflu._analysis import find_genoflu_work, run_genoflu, run_genoflu_batch, prelim_checks
+from auto_genoflu._tools import load_config, make_summary_file
+from auto_genoflu._config import CachedConfig
+from auto_genoflu.operations import make_folder, prime_folder_cache
+from auto_genoflu._transfer import configure_transfers
+from auto_genoflu.slurm import get_slurm_executor, map_slurm_array, wait_slurm_jobs, submit_slurm_array, poll_inflight_jobs, pack_samples, use_sample_packing, report_slurm_job, failed_job_outcomes, task_files, \
+    use_adaptive_sizing, sizing_estimator
+from auto_genoflu._sizing import build_sizing_model, resource_report
+from auto_genoflu._metrics import configure_metrics, export_metrics, STAGE_SECONDS, SCANS
+from auto_genoflu._profiling import CycleProfiler
+from auto_genoflu._provenance import maybe_compact_journal, import_provenance_files, export_provenance_files
+from auto_genoflu._result_cache import use_result_cache, evict_results
+from auto_genoflu._segment_cache import use_segment_cache, evict_segments
+from auto_genoflu._state import open_state_index
+from auto_genoflu._queue import plan_cycle
+from auto_genoflu._failures import use_failure_ledger, failure_report, release_failures, update_failure_ledger
+from auto_genoflu.local import run_local_pool, run_local_batches, make_batches, get_max_workers
+from auto_genoflu._watch import start_watcher, watch_key, DEFAULT_WATCH_DEBOUNCE_SECONDS, DEFAULT_RECONCILE_INTERVAL_SECONDS
+from auto_genoflu._logging import StructuredMessage
 
-def run_auto_analysis(config: dict) -> None:
+def run_auto_analysis(config: dict, verify_all: bool = False, sample_names: Optional[Set[str]] = None) -> Set[str]:
+    """Run one cycle: scan, start the work allowed by the queue budgets, and update the summary.
+
+    Returns:
+        Names of the samples that need work but were deferred to a later cycle
+    """
     # Ensure output directory exists
     use_nextcloud = config.get('use_nextcloud', False)
+    configure_transfers(config)
     make_folder(config['output_dir'], use_nextcloud=use_nextcloud)
     make_folder(config['provenance_dir'], use_nextcloud=use_nextcloud)
     
+    # Finalize Slurm jobs submitted by earlier cycles without waiting on the rest
+    use_slurm_async = config.get('use_slurm', False) and config.get('slurm_async', False)
+    n_finished = 0
+    if use_slurm_async:
+        state_index = open_state_index(config)
+        try:
+            n_finished = poll_inflight_jobs(config, state_index)
+        finally:
+            state_index.close()
+
     # Find files that need to be processed
     scan_start_timestamp = datetime.datetime.now()
 
-    input_files, output_files, files_to_process = find_genoflu_files_to_process(config)
+    input_files, output_files, work = find_genoflu_work(config, verify_all=verify_all, sample_names=sample_names)
 
     scan_complete_timestamp = datetime.datetime.now()
     scan_duration_delta = scan_complete_timestamp - scan_start_timestamp
     scan_duration_seconds = scan_duration_delta.total_seconds()
 
-    logging.info(json.dumps({"event_type": "scan_complete", "scan_duration_seconds": scan_duration_seconds, \
-                             "files_to_process": len(files_to_process), "inputs_detected": len(input_files), \
+    scan_mode = "full" if sample_names is None else "targeted"
+    STAGE_SECONDS.observe(scan_duration_seconds, stage="scan")
+    SCANS.inc(mode=scan_mode)
+
+    # New samples first, then oldest first, within the per-cycle and in-flight budgets
+    state_index = open_state_index(config)
+    try:
+        files_to_process, deferred_samples = plan_cycle(config, state_index, work, full_scan=sample_names is None)
+    finally:
+        state_index.close()
+
+    if sample_names is None:
+        maybe_compact_journal(config)
+        if use_result_cache(config):
+            evict_results(config)
+        if use_segment_cache(config):
+            evict_segments(config)
+
+    logging.info(StructuredMessage({"event_type": "scan_complete", "scan_mode": scan_mode, "scan_duration_seconds": scan_duration_seconds, \
+                             "files_to_process": len(work), "files_started": len(files_to_process), "inputs_detected": len(input_files), \
                              "outputs_detected": len(output_files)}))
 
 
     # Process each file
-    if len(files_to_process) > 0:
+    if use_slurm_async:
+        if len(files_to_process) > 0:
+            logging.info(StructuredMessage({"event_type": "initializing_slurm_executor"}))
+            executor = get_slurm_executor(config)
+            model = build_sizing_model(config) if use_adaptive_sizing(config) else None
+            state_index = open_state_index(config)
+            try:
+                if use_sample_packing(config):
+                    tasks = pack_samples(files_to_process, config, estimate_seconds=sizing_estimator(model, config) if model else None)
+                    submit_slurm_array(executor, run_genoflu_batch, tasks, config, state_index, model)
+                else:
+                    submit_slurm_array(executor, run_genoflu, files_to_process, config, state_index, model)
+            finally:
+                state_index.close()
+
+        # Outputs only change when earlier jobs finish
+        if n_finished > 0:
+            make_summary_file(config)
+
+    elif len(files_to_process) > 0:
         if config.get('use_slurm', False):
 
-            logging.info(json.dumps({"event_type": "initializing_slurm_executor"}))
-            executor = init_slurm_executor(config)
-            logging.info(json.dumps({"event_type": "submitting_slurm_array", "n_tasks": len(files_to_process)}))
-            job_list = run_slurm_array(
-                executor,
-                run_genoflu,
-                files_to_process,
-                [config]*len(files_to_process)
-            )
-            logging.info(json.dumps({"event_type": "slurm_analysis_completed", "n_tasks": len(files_to_process)}))
-
-            completed_jobs = [job for job in job_list if job.state == "COMPLETED"]
-
-            for job in completed_jobs:
-                delete_files(os.path.join(config['slurm_params'].get("log_dir", "slurm_logs"), f"{job.job_id}*"))
-            logging.info(json.dumps({"event_type": "slurm_logs_deleted"}))
+            logging.info(StructuredMessage({"event_type": "initializing_slurm_executor"}))
+            executor = get_slurm_executor(config)
+            # Size mem/time per task from the runtime and memory of earlier runs
+            model = build_sizing_model(config) if use_adaptive_sizing(config) else None
+            if use_sample_packing(config):
+                # Several samples per array task, each run through one GenoFLU session
+                tasks = pack_samples(files_to_process, config, estimate_seconds=sizing_estimator(model, config) if model else None)
+                function = run_genoflu_batch
+            else:
+                tasks = files_to_process
+                function = run_genoflu
+
+            logging.info(StructuredMessage({"event_type": "submitting_slurm_array", "n_tasks": len(tasks), "n_samples": len(files_to_process)}))
+            job_list = wait_slurm_jobs(map_slurm_array(executor, function, tasks, config, model))
+            logging.info(StructuredMessage({"event_type": "slurm_analysis_completed", "n_tasks": len(tasks)}))
+
+            log_dir = config['slurm_params'].get("log_dir", "slurm_logs")
+            outcomes = {}
+            for task, job in zip(tasks, job_list):
+                if job.state == "COMPLETED":
+                    outcomes.update(report_slurm_job(job, job.state, task_files(task), log_dir))
+                else:
+                    outcomes.update(failed_job_outcomes(job, job.state, task_files(task)))
+            logging.info(StructuredMessage({"event_type": "slurm_logs_deleted"}))
         else:
-            logging.info(json.dumps({"event_type": "using_local_processing_for_analysis"}))
-            for fasta_file in files_to_process:
-                run_genoflu(fasta_file, config)
-                logging.info(json.dumps({"event_type": "analysis_complete",  "fasta_file": fasta_file }))    
+            max_workers = get_max_workers(config)
+            logging.info(StructuredMessage({"event_type": "using_local_processing_for_analysis", "max_workers": max_workers}))
+            batch_size = int(config.get('genoflu_batch_size', 1))
+            if batch_size > 1:
+                # Several samples per long-lived GenoFLU session, but never so few batches that workers sit idle
+                batch_size = min(batch_size, math.ceil(len(files_to_process) / max_workers))
+                batches = make_batches(files_to_process, batch_size)
+                failed_files = run_local_batches(run_genoflu_batch, batches, config, max_workers=max_workers)
+            else:
+                failed_files = run_local_pool(run_genoflu, files_to_process, config, max_workers=max_workers)
+            outcomes = {fasta_file: failed_files.get(fasta_file) for fasta_file in files_to_process}
+            logging.info(StructuredMessage({"event_type": "local_analysis_completed", "n_tasks": len(files_to_process), "n_failed": len(failed_files)}))
+
+        # Workers only return their results; the ledger is written here, by the daemon alone
+        if use_failure_ledger(config):
+            state_index = open_state_index(config)
+            try:
+                update_failure_ledger(config, state_index, outcomes)
+            finally:
+                state_index.close()
 
         
         make_summary_file(config)
 
+    export_metrics(config)
+
+    return deferred_samples
+
+def drain_backlog(config: dict, deferred_samples: Set[str]) -> bool:
+    """Whether to start the next cycle straight away instead of waiting for the scan interval.
+
+    With a backlog, blocking modes go on as soon as a cycle's work is done; with
+    slurm_async, the backlog waits for in-flight jobs, which only the regular polling observes.
+    """
+    return bool(deferred_samples) and not (config.get('use_slurm', False) and config.get('slurm_async', False))
+
 def main() -> None:
     """Main function to parse arguments and process files."""
     args = get_args()
@@ -72,35 +176,117 @@ def main() -> None:
         datefmt='%Y-%m-%dT%H:%M:%S',
         level=args.log_level,
     )
-    logging.getLogger().addHandler(logging.StreamHandler())
-    logging.debug(json.dumps({"event_type": "debug_logging_enabled"}))
+    logging.debug(StructuredMessage({"event_type": "debug_logging_enabled"}))
+
+    if args.resource_report:
+        report = resource_report(load_config(args.config))
+        print(report.to_string(index=False) if len(report) > 0 else "No Slurm runs with recorded resource usage")
+        return
+
+    if args.list_failures:
+        state_index = open_state_index(load_config(args.config))
+        try:
+            report = failure_report(state_index)
+        finally:
+            state_index.close()
+        print(report.to_string(index=False) if len(report) > 0 else "No recorded failures")
+        return
+
+    if args.release_failures is not None:
+        state_index = open_state_index(load_config(args.config))
+        try:
+            print(f"Released {release_failures(state_index, args.release_failures)} samples")
+        finally:
+            state_index.close()
+        return
+
+    if args.import_provenance:
+        print(f"Imported {import_provenance_files(load_config(args.config))} provenance records")
+        return
+
+    if args.export_provenance:
+        print(f"Exported {export_provenance_files(load_config(args.config), args.export_provenance)} provenance files")
+        return
     
+    # --verify-all only applies to the first scan; later scans trust the state index
+    verify_all = args.verify_all
+
+    profiler = CycleProfiler(enabled=args.profile)
+    watcher = None
+    primed_folder_paths = None
+    last_full_scan = None
+    scan_interval = DEFAULT_SCAN_INTERVAL_SECONDS
+    # Samples held over by the queue budgets, checked again on the next cycle
+    deferred_samples = set()
+
+    # Only re-read when the file changes; an invalid edit keeps the last valid config
+    cached_config = CachedConfig(args.config)
 
     while(True):
-        try:
-            config = load_config(args.config)
-            logging.info(json.dumps({"event_type": "config_loaded", "config_file": os.path.abspath(args.config)}))
-        except json.decoder.JSONDecodeError as e:
-            # If we fail to load the config file, we continue on with the
-            # last valid config that was loaded.
-            logging.error(json.dumps({"event_type": "load_config_failed", "config_file": os.path.abspath(args.config)}))
+        config = cached_config.load()
 
-        prelim_checks(config)
+        configure_metrics(config)
 
-        run_auto_analysis(config)
+        if config.get('use_nextcloud', False):
+            # One PROPFIND up front instead of an MKCOL per folder per cycle
+            folder_paths = [config[key] for key in ['output_dir', 'provenance_dir', 'summary_dir'] if key in config]
+            if folder_paths != primed_folder_paths:
+                prime_folder_cache(folder_paths)
+                primed_folder_paths = folder_paths
+
+        # A few stat calls; also recreates directories removed while the daemon runs
+        prelim_checks(config)
 
         if "scan_interval_seconds" in config:
             try:
                 scan_interval = float(str(config['scan_interval_seconds']))
             except ValueError as e:
                 scan_interval = DEFAULT_SCAN_INTERVAL_SECONDS
-        time.sleep(scan_interval)
+
+        # (Re)start or stop the directory watcher to match the current config
+        if watcher is not None and (not config.get('watch_mode', False) or watcher.watch_key != watch_key(config)):
+            watcher.stop()
+            watcher = None
+            last_full_scan = None
+        if watcher is None and config.get('watch_mode', False):
+            watcher = start_watcher(config)
+
+        if watcher is not None and last_full_scan is not None:
+            # Between reconciliation scans, only check samples that filesystem events point at
+            reconcile_interval = float(config.get('reconcile_interval_seconds', DEFAULT_RECONCILE_INTERVAL_SECONDS))
+            remaining = reconcile_interval - (time.monotonic() - last_full_scan)
+            if remaining > 0:
+                debounce = float(config.get('watch_debounce_seconds', DEFAULT_WATCH_DEBOUNCE_SECONDS))
+                # Wake up at least every scan interval so config changes are still picked up
+                timeout = 0 if drain_backlog(config, deferred_samples) else min(remaining, scan_interval)
+                sample_names = watcher.wait_for_samples(timeout=timeout, debounce=debounce) | deferred_samples
+                if sample_names:
+                    with profiler.profile(config):
+                        deferred_samples = run_auto_analysis(config, sample_names=sample_names)
+                continue
+
+        # Full scan: always in polling mode, and as a periodic safety net in watch mode
+        # for filesystems (e.g. NFS) where events are unreliable
+        with profiler.profile(config):
+            deferred_samples = run_auto_analysis(config, verify_all=verify_all)
+        verify_all = False
+        last_full_scan = time.monotonic()
+
+        if watcher is None and not drain_backlog(config, deferred_samples):
+            time.sleep(scan_interval)
 
 def get_args():
     """Main function to parse arguments and process files."""
     parser = argparse.ArgumentParser(description="Process FASTA files and run analysis")
     parser.add_argument('-c', "--config", required=True, help="JSON config file")
     parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], type=str.upper, default='info')
+    parser.add_argument('--verify-all', action='store_true', help="Ignore the state index and rehash every file on the first scan")
+    parser.add_argument('--profile', action='store_true', help="Profile analysis cycles with cProfile (see the profile_* config keys)")
+    parser.add_argument('--import-provenance', action='store_true', help="Import the per-sample provenance JSONs in provenance_dir into the provenance journal and exit")
+    parser.add_argument('--export-provenance', metavar="DIR", help="Write a per-sample provenance JSON for every journal record to DIR and exit")
+    parser.add_argument('--resource-report', action='store_true', help="Print requested versus used Slurm resources per task and exit")
+    parser.add_argument('--list-failures', action='store_true', help="Print the failure ledger (failed and quarantined samples) and exit")
+    parser.add_argument('--release-failures', nargs='*', metavar="SAMPLE", help="Clear the failure ledger entries of the given samples, or of every quarantined sample if none are given, and exit")
     return parser.parse_args()    
 
 
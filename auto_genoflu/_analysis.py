@@ -1,98 +1,244 @@
 import os 
-from glob import glob 
-from typing import List, Tuple
+from glob import glob, escape as glob_escape
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
 import subprocess
 import datetime
-import json
 import logging
 import shutil
+import tempfile
+import time
 
-from auto_genoflu._tools import get_input_name, get_output_name, make_symlink, compute_hash, load_config, glob_single
+from auto_genoflu._tools import get_input_name, get_output_name, make_symlink, compute_hash, glob_single
 from auto_genoflu.operations import move_file, make_folder
+from auto_genoflu._transfer import configure_transfers
 from auto_genoflu._rename import rename_fasta_headers
+from auto_genoflu._state import open_state_index, get_file_hashes, list_inflight_jobs
+from auto_genoflu._genoflu_session import GenoFLUSession
+from auto_genoflu._metrics import stage_timer, SAMPLES_PROCESSED
+from auto_genoflu._logging import StructuredMessage
+from auto_genoflu._scan import compile_patterns, index_by_sample, scan_sample_files
+from auto_genoflu._provenance import load_provenance, provenance_location, write_provenance, provenance_file_name
+from auto_genoflu._result_cache import use_result_cache, result_cache_key, lookup_result, store_result, materialise_result
+from auto_genoflu._failures import use_failure_ledger, load_failures, reset_changed_inputs, held_back_samples, AnalysisFailure
+from auto_genoflu._segment_cache import use_segment_cache, get_segment_cache_dir, segment_cache_env, read_segment_cache_log
 
 def get_genoflu_env_path():
     try:
-        logging.debug(json.dumps({"event_type": "locating_genoflu_env_path"}))
+        logging.debug(StructuredMessage({"event_type": "locating_genoflu_env_path"}))
         genoflu_bin_path = subprocess.check_output(['which', 'genoflu.py']).decode('utf-8').strip()
         genoflu_env_path = os.path.dirname(os.path.dirname(genoflu_bin_path))
 
     except subprocess.CalledProcessError:
-        logging.error(json.dumps({"event_type": "genoflu_not_found", "error": "genoflu.py not found in PATH"}))
+        logging.error(StructuredMessage({"event_type": "genoflu_not_found", "error": "genoflu.py not found in PATH"}))
         raise FileNotFoundError("genoflu.py not found in PATH")
 
-    logging.debug(json.dumps({"event_type": "genoflu_env_path_found", "genoflu_env_path": genoflu_env_path}))
+    logging.debug(StructuredMessage({"event_type": "genoflu_env_path_found", "genoflu_env_path": genoflu_env_path}))
 
     return genoflu_env_path
 
+# Directories prelim_checks makes sure exist
+PRELIM_CHECK_DIRS = ['input_dir', 'work_dir', 'output_dir', 'provenance_dir']
+
 def prelim_checks(config: dict) -> None:
     """Perform preliminary checks on the configuration."""
     use_nextcloud = config.get('use_nextcloud', False)
     
-    for dir_name in ['input_dir', 'work_dir', 'output_dir', 'provenance_dir']:
+    for dir_name in PRELIM_CHECK_DIRS:
         if not os.path.exists(config[dir_name]):
-            logging.info(json.dumps({"event_type": f"{dir_name}_not_found", "dir_path": config[dir_name]}))
+            logging.info(StructuredMessage({"event_type": f"{dir_name}_not_found", "dir_path": config[dir_name]}))
             make_folder(config[dir_name], use_nextcloud)
 
-def find_genoflu_files_to_process(config: dict) -> Tuple[List[str], List[str], List[str]]:
-    """Find FASTA files in input_dir that haven't been processed in output_dir."""
-    logging.debug(json.dumps({"event_type": "find_genoflu_files_to_process_start", "input_dir": config['input_dir'], "output_dir": config['output_dir']}))
-    
-    # Get all FASTA files from input directory
-
+def _glob_sample_files(config: dict, sample_names: Iterable[str]) -> Tuple[List[str], List[str]]:
+    """Glob only the input and output files belonging to the given samples."""
+    input_matches = compile_patterns(config['glob_expressions'])
     input_files = []
-    for expr in config['glob_expressions']:
-        input_files += glob(os.path.join(config['input_dir'], expr))
+    output_files = []
+    for name in sample_names:
+        candidates = glob(os.path.join(config['input_dir'], f"{glob_escape(name)}.*"))
+        input_files += [f for f in candidates if input_matches(os.path.basename(f))]
+        output_files += glob(os.path.join(config['output_dir'], f"{glob_escape(name)}__*.tsv"))
+    return input_files, output_files
+
+def find_genoflu_files_to_process(config: dict, verify_all: bool = False, sample_names: Optional[Iterable[str]] = None) -> Tuple[List[str], List[str], List[str]]:
+    """Find FASTA files in input_dir that haven't been processed in output_dir.
 
+    Same as `find_genoflu_work`, with only the files to process.
+    """
+    input_files, output_files, work = find_genoflu_work(config, verify_all=verify_all, sample_names=sample_names)
+    return input_files, output_files, list(work)
+
+def find_genoflu_work(config: dict, verify_all: bool = False, sample_names: Optional[Iterable[str]] = None) -> Tuple[List[str], List[str], Dict[str, str]]:
+    """Find FASTA files in input_dir that haven't been processed in output_dir, and why.
+
+    Hashes are resolved through the persistent state index, so only files whose
+    (size, mtime_ns, inode) changed since the last scan are reread. Pass
+    verify_all=True to force every file to be rehashed, or sample_names to only
+    check the given samples instead of scanning the whole directory.
+
+    Returns:
+        (input files, output files, work class by input file to process), with work classes
+        "new", "input_changed", "output_changed", "missing_provenance" or "retry" (failed before)
+    """
+    logging.debug(StructuredMessage({"event_type": "find_genoflu_files_to_process_start", "input_dir": config['input_dir'], "output_dir": config['output_dir'], "verify_all": verify_all}))
     
-    # Get all TSV output files from output directory
-    output_files = glob(os.path.join(config['output_dir'], "*.tsv"))
+    if sample_names is not None and not config.get('recursive_scan', False):
+        # A few cheap globs instead of listing the whole directory
+        input_files, output_files = _glob_sample_files(config, sample_names)
+        file_stats = None
+    else:
+        # One pass over each directory, keeping the stat results for the state index
+        input_stats, output_stats = scan_sample_files(config, sample_names)
+        input_files, output_files = list(input_stats), list(output_stats)
+        file_stats = {**input_stats, **output_stats}
     
-    logging.debug(json.dumps({"event_type": "file_discovery", "input_files_count": len(input_files), "output_files_count": len(output_files)}))
+    logging.debug(StructuredMessage({"event_type": "file_discovery", "input_files_count": len(input_files), "output_files_count": len(output_files)}))
     
-    # Extract sample names
-    inputs_dict = {get_input_name(f): f for f in input_files}
-    outputs_dict = {get_output_name(f): f for f in output_files}
+    # Extract sample names, reporting any name claimed by more than one file
+    inputs_dict = index_by_sample(input_files, get_input_name, "input")
+    outputs_dict = index_by_sample(output_files, get_output_name, "output")
 
     existing_samples = set(inputs_dict.keys()) & set(outputs_dict.keys())
     
-    logging.debug(json.dumps({"event_type": "existing_samples", "existing_samples_count": len(existing_samples)}))
+    logging.debug(StructuredMessage({"event_type": "existing_samples", "existing_samples_count": len(existing_samples)}))
 
-    # Find samples that need to be processed
+    # Find samples that need to be processed, and why
     samples_to_process = set()
+    work_classes = {}
 
-    for name in existing_samples:
-        # Check if provenance file exists
-        provenance_path = os.path.join(config['provenance_dir'], f"{name}__genoflu_complete.json")
-        if not os.path.exists(provenance_path):
-            logging.warning(json.dumps({"event_type": "provenance_file_missing", "provenance_file": provenance_path}))
-            samples_to_process.add(name)
-            continue
-        
-        # Load provenance
-        provenance = load_config(provenance_path)
+    # Load provenance in bulk from the configured backend
+    provenance_dict = load_provenance(config, existing_samples)
+
+    for name in existing_samples - provenance_dict.keys():
+        logging.warning(StructuredMessage({"event_type": "provenance_file_missing", "sample_name": name, "provenance_file": provenance_location(config, name)}))
+        samples_to_process.add(name)
+        work_classes[name] = "missing_provenance"
+
+    # Resolve hashes for every sample with provenance, rehashing only changed files
+    state_index = open_state_index(config)
+    try:
+        # Samples that failed before are checked against the input version that failed
+        failures = load_failures(state_index) if use_failure_ledger(config) else {}
+        failed_inputs = [inputs_dict[name] for name in failures if name in inputs_dict]
 
+        hashes = get_file_hashes(
+            state_index,
+            [f for name in provenance_dict for f in (inputs_dict[name], outputs_dict[name])] + failed_inputs,
+            verify_all=verify_all,
+            # a targeted scan only sees some samples, so it must not prune the others
+            prune=sample_names is None,
+            max_workers=config.get('hash_workers'),
+            stats=file_stats,
+        )
+        inflight_samples = {row[0] for row in list_inflight_jobs(state_index)}
+        failures = reset_changed_inputs(state_index, failures, {name: hashes[inputs_dict[name]] for name in failures if name in inputs_dict})
+    finally:
+        state_index.close()
+
+    for name, provenance in provenance_dict.items():
         # Check if input or output files have changed
-        if provenance['input_hash'] != compute_hash(inputs_dict[name]):
-            logging.warning(json.dumps({"event_type": "input_file_changed_hash_mismatch", "provenance_file": provenance['input_file'], "provenance_hash": provenance['input_hash'], "input_file": inputs_dict[name], "input_hash": compute_hash(inputs_dict[name])}))
+        if provenance['input_hash'] != hashes[inputs_dict[name]]:
+            logging.warning(StructuredMessage({"event_type": "input_file_changed_hash_mismatch", "provenance_file": provenance['input_file'], "provenance_hash": provenance['input_hash'], "input_file": inputs_dict[name], "input_hash": hashes[inputs_dict[name]]}))
             samples_to_process.add(name)
-        elif provenance['output_hash'] != compute_hash(outputs_dict[name]):
-            logging.warning(json.dumps({"event_type": "output_file_changed_hash_mismatch", "provenance_file": provenance['output_file'], "provenance_hash": provenance['output_hash'], "output_file": outputs_dict[name], "output_hash": compute_hash(outputs_dict[name])}))
+            work_classes[name] = "input_changed"
+        elif provenance['output_hash'] != hashes[outputs_dict[name]]:
+            logging.warning(StructuredMessage({"event_type": "output_file_changed_hash_mismatch", "provenance_file": provenance['output_file'], "provenance_hash": provenance['output_hash'], "output_file": outputs_dict[name], "output_hash": hashes[outputs_dict[name]]}))
             samples_to_process.add(name)
+            work_classes[name] = "output_changed"
 
     # Find samples that haven't been processed
-    samples_to_process |= set(inputs_dict.keys()) - set(outputs_dict.keys())
+    new_samples = set(inputs_dict.keys()) - set(outputs_dict.keys())
+    samples_to_process |= new_samples
+    work_classes.update({name: "new" for name in new_samples})
+    # Samples that failed before are retried behind fresh work
+    work_classes.update({name: "retry" for name in failures.keys() & samples_to_process})
+
+    # Samples already submitted to Slurm are finalized by poll_inflight_jobs, never resubmitted
+    inflight_to_skip = samples_to_process & inflight_samples
+    if inflight_to_skip:
+        logging.debug(StructuredMessage({"event_type": "inflight_samples_skipped", "inflight_samples_count": len(inflight_to_skip)}))
+        samples_to_process -= inflight_to_skip
+
+    # Samples that keep failing wait out their backoff, or stay quarantined until released
+    held_back = {name: reason for name, reason in held_back_samples(failures).items() if name in samples_to_process}
+    if held_back:
+        reasons = list(held_back.values())
+        logging.info(StructuredMessage({"event_type": "failed_samples_held_back", "quarantined_count": reasons.count("quarantined"), "backoff_count": reasons.count("backoff")}))
+        samples_to_process -= held_back.keys()
     
     # Get the full file paths of the input files to process
-    files_to_process = [inputs_dict[sample] for sample in samples_to_process]
+    work = {inputs_dict[sample]: work_classes[sample] for sample in samples_to_process}
     
-    return input_files, output_files, files_to_process
+    return input_files, output_files, work
+
+def _run_subprocess(cmd: List[str], cwd: str, env: Optional[Dict[str, str]] = None) -> subprocess.CompletedProcess:
+    """Like `subprocess.run(cmd, check=True, capture_output=True, cwd=cwd)`, but reaps the
+    child with wait4 so its peak RSS can be recorded as `peak_rss_kb` on the result.
+    env holds variables to set on top of this process's environment.
+    """
+    with tempfile.TemporaryFile() as stdout_file, tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(cmd, stdout=stdout_file, stderr=stderr_file, cwd=cwd, env={**os.environ, **env} if env else None)
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+
+        stdout_file.seek(0)
+        stderr_file.seek(0)
+        stdout, stderr = stdout_file.read(), stderr_file.read()
+
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, output=stdout, stderr=stderr)
+
+    result = subprocess.CompletedProcess(cmd, process.returncode, stdout=stdout, stderr=stderr)
+    result.peak_rss_kb = rusage.ru_maxrss
+    return result
+
+def _slurm_provenance(config: dict) -> dict:
+    """The Slurm job this run belongs to and the resources it requested, if running under Slurm."""
+    if 'SLURM_JOB_ID' not in os.environ:
+        return {}
+
+    if 'SLURM_ARRAY_JOB_ID' in os.environ and 'SLURM_ARRAY_TASK_ID' in os.environ:
+        job_id = f"{os.environ['SLURM_ARRAY_JOB_ID']}_{os.environ['SLURM_ARRAY_TASK_ID']}"
+    else:
+        job_id = os.environ['SLURM_JOB_ID']
+
+    slurm_params = config.get('slurm_params', {})
+    return {
+        "slurm_job_id": job_id,
+        "slurm_requested_mem": slurm_params.get("mem", "4G"),
+        "slurm_requested_time": slurm_params.get("time", "01:00:00"),
+    }
+
+class MissingOutputError(FileNotFoundError):
+    """GenoFLU exited cleanly but didn't write its stats TSV."""
+
+
+def run_genoflu(fasta_file: str, config: dict, runner: Optional[Callable] = None) -> Union[bool, AnalysisFailure]:
+    """Run the analysis on a FASTA file and save result to results_dir.
+
+    GenoFLU runs with its own working directory as cwd rather than changing the
+    process-wide directory, so several samples can safely run concurrently.
+
+    Args:
+        fasta_file: Path to the input FASTA file
+        config: Configuration dictionary
+        runner: Callable `runner(cmd, cwd, env=None)` used to run GenoFLU, with the same contract
+            as `subprocess.run(cmd, check=True, capture_output=True, cwd=cwd)`; env holds
+            extra environment variables. Defaults to a fresh subprocess per sample.
+
+    Returns:
+        True if the analysis completed, else a (falsy) AnalysisFailure saying why it failed
+    """
+    if runner is None:
+        runner = _run_subprocess
+    configure_transfers(config)
 
-def run_genoflu(fasta_file: str, config: dict) -> None:
-    """Run the analysis on a FASTA file and save result to results_dir."""
     # Extract sample name
     sample_name = get_input_name(fasta_file)
     working_dir = os.path.join(config.get('work_dir', os.getcwd()), sample_name)
+
+    # Start from a clean working directory so leftovers from a failed run can't be picked up
+    if os.path.exists(working_dir):
+        shutil.rmtree(working_dir)
     make_folder(working_dir, use_nextcloud=False)  # work directory is not allowed to be on nextcloud
     
     # Construct output filename
@@ -100,26 +246,13 @@ def run_genoflu(fasta_file: str, config: dict) -> None:
     input_filepath = os.path.join(working_dir, input_filename)
     output_tsv_path = os.path.join(config['output_dir'], f"{sample_name}__genoflu.tsv")
     
-    # Get working directory from config, default to current directory
-    
-    # Save the original working directory to restore later
-    original_dir = os.getcwd()
-    
     # Build and run the command
     try:
-        # Change to working directory if specified
-        
-        os.chdir(working_dir)
-        logging.debug(json.dumps({
-            "event_type": "working_directory_changed",
-            "from": original_dir,
-            "to": working_dir
-        }))
-
         genoflu_env_path = get_genoflu_env_path()
 
         # need this because genoflu is stupid 
-        rename_fasta_headers(fasta_file, input_filepath)
+        with stage_timer("rename"):
+            segment_count = rename_fasta_headers(fasta_file, input_filepath)
         # make_symlink(input_filepath, symlink_path)
 
         # Replace this with your actual command
@@ -131,34 +264,67 @@ def run_genoflu(fasta_file: str, config: dict) -> None:
             "-n", sample_name
         ]
         
-        # Run the subprocess
-        result = subprocess.run(cmd, check=True, capture_output=True)
-        
-        logging.debug(json.dumps({
-            "event_type": "subprocess_output",
-            "sample_name": sample_name,
-            "stdout": result.stdout.decode('utf-8')[:500],  # First 500 chars to avoid overwhelming logs
-            "stderr": result.stderr.decode('utf-8')[:500] if result.stderr else ""
-        }))
+        # Identical input already analysed with the same settings, GenoFLU and reference data
+        cache_key = None
+        cached = None
+        if use_result_cache(config):
+            cache_key = result_cache_key(input_filepath, config, genoflu_env_path)
+            cached = lookup_result(config, cache_key)
 
-        tsv_filename = glob_single(f'./{sample_name}*stats.tsv')
-        xlsx_filename = glob_single(f'./{sample_name}*stats.xlsx')
-        
-        logging.debug(json.dumps({
-            "event_type": "output_files_discovered",
-            "sample_name": sample_name,
-            "tsv_filename": tsv_filename,
-            "xlsx_filename": xlsx_filename
-        }))
+        if cached is not None:
+            cached_tsv, cached_sample_name = cached
+            logging.info(StructuredMessage({"event_type": "result_cache_hit", "sample_name": sample_name, "cache_key": cache_key, "cached_sample_name": cached_sample_name}))
+            result = None
+            runtime_seconds = None
+            segment_cache_stats = {}
+            tsv_filename = os.path.join(working_dir, f"{sample_name}_cached_stats.tsv")
+            materialise_result(cached_tsv, cached_sample_name, tsv_filename, sample_name)
+        else:
+            # Reuse BLAST hits for segments already seen in other samples
+            env = segment_cache_env(config, working_dir) if use_segment_cache(config) else None
+
+            # Run the subprocess inside the sample's working directory
+            run_start = time.perf_counter()
+            with stage_timer("genoflu"):
+                result = runner(cmd, cwd=working_dir, env=env) if env else runner(cmd, cwd=working_dir)
+            runtime_seconds = time.perf_counter() - run_start
+
+            segment_cache_stats = read_segment_cache_log(working_dir) if env else {}
+            if segment_cache_stats.get("segment_cache_verified") is False:
+                logging.error(StructuredMessage({"event_type": "segment_cache_verify_mismatch", "sample_name": sample_name, "segment_cache_dir": get_segment_cache_dir(config)}))
+
+            logging.debug(StructuredMessage({
+                "event_type": "subprocess_output",
+                "sample_name": sample_name,
+                "stdout": result.stdout.decode('utf-8')[:500],  # First 500 chars to avoid overwhelming logs
+                "stderr": result.stderr.decode('utf-8')[:500] if result.stderr else ""
+            }))
+
+            tsv_filename = glob_single(os.path.join(glob_escape(working_dir), f'{sample_name}*stats.tsv'))
+            xlsx_filename = glob_single(os.path.join(glob_escape(working_dir), f'{sample_name}*stats.xlsx'))
+            if tsv_filename is None:
+                raise MissingOutputError(f"GenoFLU wrote no stats TSV for {sample_name} in {working_dir}")
+
+            logging.debug(StructuredMessage({
+                "event_type": "output_files_discovered",
+                "sample_name": sample_name,
+                "tsv_filename": tsv_filename,
+                "xlsx_filename": xlsx_filename
+            }))
+
+            if cache_key is not None:
+                store_result(config, cache_key, tsv_filename, sample_name)
 
         # Upload or move the TSV file based on configuration
         use_nextcloud = config.get('use_nextcloud', False)
-        move_file(tsv_filename, output_tsv_path, use_nextcloud=use_nextcloud)
+        with stage_timer("move_upload"):
+            move_file(tsv_filename, output_tsv_path, use_nextcloud=use_nextcloud)
 
-        input_hash = compute_hash(fasta_file)
-        output_hash = compute_hash(output_tsv_path)
+        with stage_timer("hash"):
+            input_hash = compute_hash(fasta_file)
+            output_hash = compute_hash(output_tsv_path)
         
-        logging.debug(json.dumps({
+        logging.debug(StructuredMessage({
             "event_type": "file_hashes_computed",
             "sample_name": sample_name,
             "input_hash": input_hash,
@@ -170,40 +336,73 @@ def run_genoflu(fasta_file: str, config: dict) -> None:
             "input_file": fasta_file,
             "input_hash": input_hash,
             "output_file": output_tsv_path,
-            "output_hash": output_hash
+            "output_hash": output_hash,
+            "runtime_seconds": round(runtime_seconds, 3) if runtime_seconds is not None else None,
+            "peak_rss_kb": getattr(result, 'peak_rss_kb', None),
+            "input_size_bytes": os.path.getsize(fasta_file),
+            "segment_count": segment_count,
+            "result_cache_hit": cached is not None,
+            "result_cache_key": cache_key,
+            **segment_cache_stats,
+            **_slurm_provenance(config)
         }
 
-        with open(f"{sample_name}__genoflu_complete.json", "w") as f:
-            json.dump(genoflu_complete, f)
+        logging.debug(StructuredMessage({"event_type": "uploading_files", "sample_name": sample_name, "tsv_filename": tsv_filename, "provenance_filename": provenance_file_name(sample_name)}))
 
-        provenance_filename = f"{sample_name}__genoflu_complete.json"
-        provenance_path = os.path.join(config['provenance_dir'], provenance_filename)
-
-        logging.debug(json.dumps({"event_type": "uploading_files", "sample_name": sample_name, "tsv_filename": tsv_filename, "provenance_filename": provenance_filename}))
-        
-        # Upload or move the provenance file based on configuration
-        move_file(provenance_filename, provenance_path, use_nextcloud=use_nextcloud)
+        # Write, upload or journal the provenance based on configuration
+        with stage_timer("provenance_write"):
+            write_provenance(config, sample_name, genoflu_complete, working_dir)
 
         # Remove the temporary files
-        logging.debug(json.dumps({"event_type": "removing_temporary_files", "sample_name": sample_name}))
+        logging.debug(StructuredMessage({"event_type": "removing_temporary_files", "sample_name": sample_name}))
         shutil.rmtree(working_dir)
         
-        logging.debug(json.dumps({"event_type": "run_genoflu_complete", "sample_name": sample_name}))
+        logging.debug(StructuredMessage({"event_type": "run_genoflu_complete", "sample_name": sample_name}))
+        SAMPLES_PROCESSED.inc(result="success")
 
+        return True
         
     except subprocess.CalledProcessError as e:
-        logging.error(json.dumps({"event_name": "genoflu_failed", "sample_name": sample_name, "error": str(e), "command": " ".join(cmd), "stderr": e.stderr.decode('utf-8') if e.stderr else ""}))
+        stderr = e.stderr.decode('utf-8') if e.stderr else ""
+        logging.error(StructuredMessage({"event_name": "genoflu_failed", "sample_name": sample_name, "error": str(e), "command": " ".join(cmd), "stderr": stderr}))
+        failure = AnalysisFailure(fasta_file, "genoflu_failed", f"{e}\n{stderr[-500:]}")
+
+    except MissingOutputError as e:
+        logging.error(StructuredMessage({"event_name": "genoflu_failed_missing_output", "sample_name": sample_name, "error": str(e)}))
+        failure = AnalysisFailure(fasta_file, "missing_stats_tsv", str(e))
 
     except (IOError, FileNotFoundError) as e:
-        logging.error(json.dumps({"event_name": "genoflu_failed_file_error", "sample_name": sample_name, "error": str(e), "files": [input_filepath, input_filename, output_tsv_path]}))
+        logging.error(StructuredMessage({"event_name": "genoflu_failed_file_error", "sample_name": sample_name, "error": str(e), "files": [input_filepath, input_filename, output_tsv_path]}))
+        failure = AnalysisFailure(fasta_file, "file_error", str(e))
 
     except (KeyError) as e:
-        logging.error(json.dumps({"event_name": "genoflu_failed_key_error", "sample_name": sample_name, "error": str(e)}))
-    
-    finally:
-        # Always restore the original working directory
-        os.chdir(original_dir)
-        logging.debug(json.dumps({
-            "event_type": "working_directory_restored",
-            "to": original_dir
-        }))
+        logging.error(StructuredMessage({"event_name": "genoflu_failed_key_error", "sample_name": sample_name, "error": str(e)}))
+        failure = AnalysisFailure(fasta_file, "key_error", str(e))
+
+    SAMPLES_PROCESSED.inc(result="failure")
+    return failure
+
+def run_genoflu_batch(fasta_files: List[str], config: dict) -> List[AnalysisFailure]:
+    """Run several samples through a single long-lived GenoFLU session.
+
+    Produces the same per-sample TSVs and provenance as calling run_genoflu on
+    each file, without paying interpreter startup and reference loading per sample.
+
+    Returns:
+        The failure of each FASTA file whose analysis failed
+    """
+    failed_files = []
+    with GenoFLUSession(max_runs=config.get('genoflu_session_max_runs')) as session:
+        for fasta_file in fasta_files:
+            try:
+                succeeded = run_genoflu(fasta_file, config, runner=session.run)
+            except Exception as e:
+                logging.error(StructuredMessage({"event_type": "genoflu_batch_sample_failed", "fasta_file": fasta_file, "error": str(e)}))
+                succeeded = AnalysisFailure(fasta_file, "task_error", str(e))
+
+            if not succeeded:
+                failed_files.append(succeeded)
+
+    logging.debug(StructuredMessage({"event_type": "run_genoflu_batch_complete", "n_samples": len(fasta_files), "n_failed": len(failed_files)}))
+
+    return failed_files
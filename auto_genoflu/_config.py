@@ -0,0 +1,76 @@
+import os
+import copy
+import json
+import hashlib
+import logging
+from typing import Dict, Optional
+
+from auto_genoflu._hashing import HASH_ALGORITHM
+from auto_genoflu._logging import StructuredMessage
+from auto_genoflu._state import stat_key
+
+
+def config_diff(old: dict, new: dict) -> Dict[str, dict]:
+    """Top-level keys that were added, removed or changed, with their old and new values."""
+    return {
+        key: {"old": old.get(key), "new": new.get(key)}
+        for key in sorted(set(old) | set(new))
+        if old.get(key) != new.get(key) or (key in old) != (key in new)
+    }
+
+
+class CachedConfig:
+    """The daemon's config file, only re-read when it changes.
+
+    Each `load` stats the file; the file is only read when its (size, mtime_ns,
+    inode) changed, and only re-parsed when its content hash changed too.
+    Components that hold state across cycles (metrics endpoint, Slurm executor,
+    watcher, Nextcloud folder cache) compare their own settings on each cycle.
+    """
+
+    def __init__(self, config_file: str):
+        self.config_file = config_file
+        self.config: Optional[dict] = None
+        self.file_key = None
+        self.content_hash = None
+
+    def load(self) -> dict:
+        """The current config, as a copy callers are free to modify.
+
+        If the file can't be parsed, the last valid config is kept; if there is
+        none yet, the error is raised.
+        """
+        file_key = stat_key(os.stat(self.config_file))
+        if self.config is not None and file_key == self.file_key:
+            return copy.deepcopy(self.config)
+
+        with open(self.config_file, "rb") as f:
+            content = f.read()
+        content_hash = hashlib.new(HASH_ALGORITHM, content).hexdigest()
+        if self.config is not None and content_hash == self.content_hash:
+            # touched but not changed
+            self.file_key = file_key
+            return copy.deepcopy(self.config)
+
+        try:
+            config = json.loads(content)
+        except json.JSONDecodeError as e:
+            if self.config is None:
+                raise
+            # remembered so the bad file isn't re-read (and reported) every cycle until it changes
+            self.file_key = file_key
+            self.content_hash = content_hash
+            logging.error(StructuredMessage({"event_type": "load_config_failed", "config_file": os.path.abspath(self.config_file), "error": str(e)}))
+            return copy.deepcopy(self.config)
+
+        if self.config is None:
+            logging.info(StructuredMessage({"event_type": "config_loaded", "config_file": os.path.abspath(self.config_file), "config_keys": list(config.keys())}))
+        else:
+            changes = config_diff(self.config, config)
+            if changes:
+                logging.info(StructuredMessage({"event_type": "config_changed", "config_file": os.path.abspath(self.config_file), "changes": changes}))
+
+        self.config = config
+        self.file_key = file_key
+        self.content_hash = content_hash
+        return copy.deepcopy(config)
@@ -0,0 +1,206 @@
+import os
+import time
+import sqlite3
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Union
+
+import pandas as pd
+
+from auto_genoflu._logging import StructuredMessage
+from auto_genoflu._state import get_file_hashes
+from auto_genoflu._tools import get_input_name
+
+DEFAULT_FAILURE_BACKOFF_SECONDS = 600
+DEFAULT_FAILURE_BACKOFF_MAX_SECONDS = 86400
+DEFAULT_FAILURE_MAX_ATTEMPTS = 5
+
+_COLUMNS = ["sample_name", "input_file", "input_hash", "failure_class", "attempts", "first_failed_at", "last_failed_at", "retry_after", "quarantined", "error"]
+
+
+def use_failure_ledger(config: dict) -> bool:
+    return config.get('use_failure_ledger', False)
+
+
+class AnalysisFailure:
+    """Why the analysis of one FASTA file failed.
+
+    Returned by the workers in place of False (it is falsy), so the daemon can
+    update the failure ledger when it collects the results.
+    """
+
+    def __init__(self, fasta_file: str, failure_class: str, error: str = ""):
+        self.fasta_file = fasta_file
+        self.failure_class = failure_class
+        self.error = error
+
+    def __bool__(self) -> bool:
+        return False
+
+    def __repr__(self) -> str:
+        return f"AnalysisFailure({self.fasta_file!r}, {self.failure_class!r})"
+
+
+def task_outcomes(fasta_files: List[str], result: Union[bool, AnalysisFailure, List[Union[str, AnalysisFailure]]]) -> Dict[str, Optional[AnalysisFailure]]:
+    """Per-file outcome of a task: None if the file was analysed, else its failure.
+
+    A task returns either the result of `run_genoflu` (one sample), or the failures
+    of a packed bin, as failures or as the paths of the files that failed.
+    """
+    if isinstance(result, list):
+        failures = {f.fasta_file: f for f in result if isinstance(f, AnalysisFailure)}
+        failures.update({f: AnalysisFailure(f, "task_failed") for f in result if isinstance(f, str)})
+    elif isinstance(result, AnalysisFailure):
+        failures = {f: result if f == result.fasta_file else AnalysisFailure(f, result.failure_class, result.error) for f in fasta_files}
+    elif result is False:
+        failures = {f: AnalysisFailure(f, "task_failed") for f in fasta_files}
+    else:
+        failures = {}
+    return {f: failures.get(f) for f in fasta_files}
+
+
+def backoff_seconds(config: dict, attempts: int) -> float:
+    """Wait before the next attempt: doubles with every failure, up to `failure_backoff_max_seconds`."""
+    base = float(config.get('failure_backoff_seconds', DEFAULT_FAILURE_BACKOFF_SECONDS))
+    cap = float(config.get('failure_backoff_max_seconds', DEFAULT_FAILURE_BACKOFF_MAX_SECONDS))
+    return min(base * 2 ** (attempts - 1), cap)
+
+
+def load_failures(conn: sqlite3.Connection) -> Dict[str, dict]:
+    """Failure ledger entry by sample name."""
+    return {row[0]: dict(zip(_COLUMNS, row)) for row in conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM failures")}
+
+
+def record_failure(conn: sqlite3.Connection, config: dict, sample_name: str, input_file: str, input_hash: str, failure_class: str, error: str) -> dict:
+    """Count a failed analysis against the sample and schedule the next attempt.
+
+    Failures are counted per version of the sample's input: if input_hash differs
+    from the one recorded, the count starts again from the first attempt. After
+    `failure_max_attempts` failures the sample is quarantined until released.
+
+    Returns:
+        The updated entry
+    """
+    now = time.time()
+    max_attempts = int(config.get('failure_max_attempts', DEFAULT_FAILURE_MAX_ATTEMPTS))
+
+    with conn:
+        row = conn.execute("SELECT attempts, first_failed_at FROM failures WHERE sample_name = ? AND input_hash = ?", (sample_name, input_hash)).fetchone()
+        attempts, first_failed_at = (row[0] + 1, row[1]) if row else (1, now)
+        entry = {
+            "sample_name": sample_name,
+            "input_file": input_file,
+            "input_hash": input_hash,
+            "failure_class": failure_class,
+            "attempts": attempts,
+            "first_failed_at": first_failed_at,
+            "last_failed_at": now,
+            "retry_after": now + backoff_seconds(config, attempts),
+            "quarantined": int(attempts >= max_attempts),
+            "error": error[:1000],
+        }
+        conn.execute(f"INSERT OR REPLACE INTO failures ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})", [entry[c] for c in _COLUMNS])
+
+    if entry['quarantined']:
+        logging.warning(StructuredMessage({"event_type": "sample_quarantined", "sample_name": sample_name, "failure_class": failure_class, "attempts": attempts, "input_hash": input_hash}))
+    else:
+        logging.info(StructuredMessage({"event_type": "sample_failure_recorded", "sample_name": sample_name, "failure_class": failure_class, "attempts": attempts,
+                                        "retry_after": datetime.fromtimestamp(entry['retry_after']).isoformat()}))
+
+    return entry
+
+
+def clear_failures(conn: sqlite3.Connection, sample_names: Iterable[str]) -> None:
+    """Forget the failures of samples that have been analysed successfully."""
+    with conn:
+        conn.executemany("DELETE FROM failures WHERE sample_name = ?", [(name,) for name in sample_names])
+
+
+def update_failure_ledger(config: dict, conn: sqlite3.Connection, outcomes: Dict[str, Optional[AnalysisFailure]]) -> None:
+    """Record the failures and clear the successes of finished analyses.
+
+    Called by the daemon as it collects results, so workers never write to the
+    state index. Errors are logged rather than raised: the ledger must not change
+    the outcome of a run that already finished.
+
+    Args:
+        outcomes: Output of `task_outcomes`, for every file the cycle finished
+    """
+    if not use_failure_ledger(config) or not outcomes:
+        return
+
+    try:
+        failed = {f: failure for f, failure in outcomes.items() if failure is not None and os.path.exists(f)}
+        hashes = get_file_hashes(conn, failed, max_workers=config.get('hash_workers'))
+        for fasta_file, failure in failed.items():
+            record_failure(conn, config, get_input_name(fasta_file), fasta_file, hashes[fasta_file], failure.failure_class, failure.error)
+        clear_failures(conn, [get_input_name(f) for f, failure in outcomes.items() if failure is None])
+    except (sqlite3.Error, OSError) as e:
+        logging.error(StructuredMessage({"event_type": "failure_ledger_update_failed", "n_outcomes": len(outcomes), "error": str(e)}))
+
+
+def reset_changed_inputs(conn: sqlite3.Connection, failures: Dict[str, dict], input_hashes: Dict[str, str]) -> Dict[str, dict]:
+    """Drop entries recorded against an earlier version of a sample's input.
+
+    Args:
+        failures: Output of `load_failures`
+        input_hashes: Current input hash by sample name, for the samples whose input exists
+
+    Returns:
+        The entries that still apply
+    """
+    stale = sorted(name for name, entry in failures.items() if name in input_hashes and entry['input_hash'] != input_hashes[name])
+
+    if stale:
+        with conn:
+            conn.executemany("DELETE FROM failures WHERE sample_name = ?", [(name,) for name in stale])
+        logging.info(StructuredMessage({"event_type": "failure_ledger_reset", "reason": "input_changed", "sample_names": stale}))
+
+    return {name: entry for name, entry in failures.items() if name not in stale}
+
+
+def held_back_samples(failures: Dict[str, dict], now: Optional[float] = None) -> Dict[str, str]:
+    """Samples that must not be analysed yet, with the reason: quarantined, or backing off."""
+    now = time.time() if now is None else now
+    held = {}
+    for sample_name, entry in failures.items():
+        if entry['quarantined']:
+            held[sample_name] = "quarantined"
+        elif now < entry['retry_after']:
+            held[sample_name] = "backoff"
+    return held
+
+
+def failure_report(conn: sqlite3.Connection) -> pd.DataFrame:
+    """Every failure ledger entry, quarantined ones first."""
+    entries = list(load_failures(conn).values())
+    if len(entries) == 0:
+        return pd.DataFrame()
+
+    report = pd.DataFrame(entries)
+    for column in ["first_failed_at", "last_failed_at", "retry_after"]:
+        report[column] = pd.to_datetime(report[column], unit="s").dt.strftime('%Y-%m-%d %H:%M:%S')
+    report["quarantined"] = report["quarantined"].astype(bool)
+    report["input_hash"] = report["input_hash"].str[:12]
+    columns = ["sample_name", "failure_class", "attempts", "quarantined", "last_failed_at", "retry_after", "input_hash", "error"]
+    return report.sort_values(["quarantined", "sample_name"], ascending=[False, True])[columns]
+
+
+def release_failures(conn: sqlite3.Connection, sample_names: Optional[Iterable[str]] = None) -> int:
+    """Delete the ledger entries of the given samples, or of every quarantined sample,
+    so they are retried on the next scan.
+
+    Returns:
+        Number of samples released
+    """
+    with conn:
+        if sample_names:
+            sample_names = sorted(set(sample_names))
+        else:
+            sample_names = [row[0] for row in conn.execute("SELECT sample_name FROM failures WHERE quarantined = 1")]
+        released = [name for name in sample_names if conn.execute("SELECT 1 FROM failures WHERE sample_name = ?", (name,)).fetchone()]
+        conn.executemany("DELETE FROM failures WHERE sample_name = ?", [(name,) for name in released])
+
+    logging.info(StructuredMessage({"event_type": "failures_released", "sample_names": released}))
+
+    return len(released)
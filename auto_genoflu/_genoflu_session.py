@@ -0,0 +1,200 @@
+import os
+import sys
+import logging
+import multiprocessing
+import resource
+import runpy
+import subprocess
+import tempfile
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+from auto_genoflu._logging import StructuredMessage
+
+DEFAULT_SESSION_MAX_RUNS = 100
+
+
+def _init_worker(script_path: str) -> None:
+    """Prepare a long-lived interpreter for running genoflu.py repeatedly."""
+    # runpy.run_path doesn't add the script's directory to sys.path like `python script.py` does
+    sys.path.insert(0, os.path.dirname(script_path))
+
+    try:
+        import pandas as pd
+    except ImportError:
+        return
+
+    # GenoFLU re-reads genotype_key.xlsx on every run; parse it once per session and
+    # hand out copies so a run can't affect the next one
+    read_excel = pd.read_excel
+    cache = {}
+
+    def cached_read_excel(io, *args, **kwargs):
+        if not isinstance(io, (str, os.PathLike)):
+            return read_excel(io, *args, **kwargs)
+
+        stat_result = os.stat(io)
+        key = (os.path.abspath(io), stat_result.st_size, stat_result.st_mtime_ns, repr(args), repr(sorted(kwargs.items())))
+        if key not in cache:
+            cache[key] = read_excel(io, *args, **kwargs)
+
+        result = cache[key]
+        if isinstance(result, dict):
+            return {sheet: df.copy() for sheet, df in result.items()}
+        return result.copy()
+
+    pd.read_excel = cached_read_excel
+
+
+def _reset_peak_rss() -> bool:
+    """Reset this worker's high-water RSS to its current RSS (Linux 4.0+), so the next reading covers one run only."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _run_peak_rss_kb(children_before_kb: int) -> Optional[int]:
+    """Peak RSS of the run since `_reset_peak_rss`, in KB.
+
+    ru_maxrss only ever grows over the worker's life, so the worker's own peak is
+    read from VmHWM. Subprocesses (e.g. blastn) only count if one of them set a
+    new high-water mark during this run; one that stayed below an earlier run's
+    can't be seen, which is fine as long as GenoFLU itself is the larger process.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            worker_kb = next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+    except (OSError, StopIteration, ValueError):
+        return None
+
+    children_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(worker_kb, children_kb if children_kb > children_before_kb else 0)
+
+
+def _run_in_worker(script_path: str, argv: List[str], cwd: str, env: Optional[Dict[str, str]] = None) -> Tuple[int, bytes, bytes, Optional[int]]:
+    """Run genoflu.py as __main__ inside the worker, as if it were a fresh process.
+
+    The worker is single-threaded, so changing its cwd and environment is safe
+    here; env overrides are undone after the run. stdout and stderr are captured
+    at the file-descriptor level so output from any subprocesses GenoFLU starts
+    is captured too. The peak RSS returned is this run's, or None where it can't be measured.
+    """
+    original_dir = os.getcwd()
+    original_argv = sys.argv
+    original_env = {name: os.environ.get(name) for name in (env or {})}
+    saved_fds = (os.dup(1), os.dup(2))
+    returncode = 0
+    peak_rss_reset = _reset_peak_rss()
+    children_before_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    with tempfile.TemporaryFile() as stdout_file, tempfile.TemporaryFile() as stderr_file:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(stdout_file.fileno(), 1)
+            os.dup2(stderr_file.fileno(), 2)
+            os.chdir(cwd)
+            os.environ.update(env or {})
+            sys.argv = [script_path] + list(argv)
+
+            runpy.run_path(script_path, run_name="__main__")
+
+        except SystemExit as e:
+            if e.code is None:
+                returncode = 0
+            elif isinstance(e.code, int):
+                returncode = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                returncode = 1
+        except BaseException:
+            traceback.print_exc()
+            returncode = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved_fds[0], 1)
+            os.dup2(saved_fds[1], 2)
+            os.close(saved_fds[0])
+            os.close(saved_fds[1])
+            os.chdir(original_dir)
+            for name, value in original_env.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+            sys.argv = original_argv
+
+        stdout_file.seek(0)
+        stderr_file.seek(0)
+        peak_rss_kb = _run_peak_rss_kb(children_before_kb) if peak_rss_reset else None
+        return returncode, stdout_file.read(), stderr_file.read(), peak_rss_kb
+
+
+class GenoFLUSession:
+    """A long-lived worker process that runs many GenoFLU analyses.
+
+    Each run pays for argument parsing and the analysis itself, but not for
+    interpreter startup, module imports or parsing the genotype key. The worker
+    is recycled after `max_runs` analyses to bound memory growth.
+
+    `run` has the same contract as `subprocess.run(cmd, check=True, capture_output=True, cwd=cwd)`,
+    with `env` holding variables to set on top of the worker's environment, and also sets `peak_rss_kb` on the result:
+    the run's own peak RSS, or None where it can't be told apart from earlier runs in the session.
+    """
+
+    def __init__(self, max_runs: Optional[int] = None):
+        self.max_runs = max_runs or DEFAULT_SESSION_MAX_RUNS
+        self.pool = None
+        self.script_path = None
+        self.runs = 0
+
+    def _start(self, script_path: str) -> None:
+        self.close()
+        # spawn rather than fork: sessions are started from worker threads
+        self.pool = ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(script_path,),
+        )
+        self.script_path = script_path
+        self.runs = 0
+        logging.debug(StructuredMessage({"event_type": "genoflu_session_started", "script_path": script_path}))
+
+    def run(self, cmd: List[str], cwd: str, env: Optional[Dict[str, str]] = None) -> subprocess.CompletedProcess:
+        script_path = cmd[0]
+        if self.pool is None or script_path != self.script_path or self.runs >= self.max_runs:
+            self._start(script_path)
+
+        self.runs += 1
+        try:
+            returncode, stdout, stderr, peak_rss_kb = self.pool.submit(_run_in_worker, script_path, cmd[1:], cwd, env).result()
+        except BrokenProcessPool as e:
+            # the worker died mid-run; start a fresh one for the next sample
+            logging.error(StructuredMessage({"event_type": "genoflu_session_worker_died", "cwd": cwd, "error": str(e)}))
+            self.close()
+            raise subprocess.CalledProcessError(-1, cmd, output=b"", stderr=str(e).encode("utf-8"))
+
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd, output=stdout, stderr=stderr)
+        result = subprocess.CompletedProcess(cmd, returncode, stdout=stdout, stderr=stderr)
+        result.peak_rss_kb = peak_rss_kb
+        return result
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+            logging.debug(StructuredMessage({"event_type": "genoflu_session_closed", "runs": self.runs}))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
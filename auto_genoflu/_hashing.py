@@ -0,0 +1,59 @@
+import os
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional
+
+from auto_genoflu._logging import StructuredMessage
+
+# shasum defaults to SHA-1, so keep it here to stay compatible with existing provenance files
+HASH_ALGORITHM = "sha1"
+HASH_BUFFER_SIZE = 1024 * 1024
+DEFAULT_HASH_WORKERS = min(8, os.cpu_count() or 1)
+
+
+def hash_file(file_path: str, buffer_size: int = HASH_BUFFER_SIZE) -> str:
+    """Stream a file through hashlib and return its hex digest.
+
+    Reads into a single reusable buffer, so memory stays flat regardless of file size.
+    """
+    digest = hashlib.new(HASH_ALGORITHM)
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+
+    with open(file_path, "rb") as f:
+        while True:
+            n_bytes = f.readinto(buffer)
+            if not n_bytes:
+                break
+            digest.update(view[:n_bytes])
+
+    return digest.hexdigest()
+
+
+def hash_files(file_paths: Iterable[str], max_workers: Optional[int] = None) -> Dict[str, str]:
+    """Hash many files at once using a bounded thread pool.
+
+    hashlib releases the GIL while digesting large buffers, so threads give real
+    parallelism here without the cost of forking a process per file.
+
+    Args:
+        file_paths: Paths of the files to hash
+        max_workers: Maximum number of hashing threads (default: min(8, cpu count))
+
+    Returns:
+        Dictionary mapping each path to its hex digest
+    """
+    file_paths = list(dict.fromkeys(file_paths))
+    if max_workers is None:
+        max_workers = DEFAULT_HASH_WORKERS
+
+    if len(file_paths) <= 1 or max_workers <= 1:
+        hashes = {file_path: hash_file(file_path) for file_path in file_paths}
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            hashes = dict(zip(file_paths, pool.map(hash_file, file_paths)))
+
+    logging.debug(StructuredMessage({"event_type": "hash_files_complete", "files_hashed": len(file_paths), "max_workers": max_workers}))
+
+    return hashes
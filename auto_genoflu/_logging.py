@@ -0,0 +1,22 @@
+import json
+
+
+class StructuredMessage:
+    """A log message that is serialised to JSON only if a handler formats it.
+
+    `logging.debug(StructuredMessage({...}))` costs almost nothing when DEBUG is
+    disabled, unlike `logging.debug(json.dumps({...}))`, which serialises the
+    payload before logging decides to drop it.
+    """
+
+    __slots__ = ("fields", "_text")
+
+    def __init__(self, fields: dict):
+        self.fields = fields
+        self._text = None
+
+    def __str__(self) -> str:
+        # several handlers may format the same record
+        if self._text is None:
+            self._text = json.dumps(self.fields)
+        return self._text
@@ -0,0 +1,217 @@
+import os
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from auto_genoflu._logging import StructuredMessage
+
+# Seconds; spans sub-millisecond hashing up to long scans and Slurm waits
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(labelnames: Tuple[str, ...], labelvalues: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(labelnames, labelvalues))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for name, value in pairs]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self.lock:
+            values = sorted(self.values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count per bucket (last is +Inf), sum]
+        self.values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def _samples(self) -> List[str]:
+        with self.lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self.values.items())
+
+        lines = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for upper, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', _format_value(upper)))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("auto_genoflu_stage_duration_seconds", "Time spent in each pipeline stage.", ("stage",))
+STAGE_FAILURES = Counter("auto_genoflu_stage_failures_total", "Pipeline stages that raised an error.", ("stage",))
+SAMPLES_PROCESSED = Counter("auto_genoflu_samples_processed_total", "Samples analysed, by result.", ("result",))
+FILES_HASHED = Counter("auto_genoflu_files_hashed_total", "Files hashed because they were new or changed.")
+SCANS = Counter("auto_genoflu_scans_total", "Input scans, by mode.", ("mode",))
+QUEUE_DEPTH = Gauge("auto_genoflu_queue_depth", "Samples waiting to be processed after the last scan.")
+QUEUE_CLASS_DEPTH = Gauge("auto_genoflu_queue_samples", "Samples waiting to be processed after the last scan, by work class.", ("work_class",))
+QUEUE_OLDEST_WAIT = Gauge("auto_genoflu_queue_oldest_wait_seconds", "How long the oldest waiting sample has been queued, by work class.", ("work_class",))
+QUEUE_WAIT_SECONDS = Histogram("auto_genoflu_queue_wait_seconds", "Time samples were queued before being started, by work class.", ("work_class",),
+                               buckets=(10.0, 60.0, 300.0, 900.0, 1800.0, 3600.0, 7200.0, 14400.0, 43200.0, 86400.0))
+SAMPLES_DEFERRED = Gauge("auto_genoflu_queue_deferred_samples", "Samples left for a later cycle by the queue budgets.")
+SLURM_INFLIGHT = Gauge("auto_genoflu_slurm_inflight_samples", "Samples with a submitted Slurm job that has not finished.")
+LAST_CYCLE_TIMESTAMP = Gauge("auto_genoflu_last_cycle_timestamp_seconds", "Unix time the last analysis cycle finished.")
+
+REGISTRY = [STAGE_SECONDS, STAGE_FAILURES, SAMPLES_PROCESSED, FILES_HASHED, SCANS, QUEUE_DEPTH, QUEUE_CLASS_DEPTH, QUEUE_OLDEST_WAIT, QUEUE_WAIT_SECONDS, SAMPLES_DEFERRED, SLURM_INFLIGHT, LAST_CYCLE_TIMESTAMP]
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """Record how long the enclosed block takes under `stage`, and count it as failed if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_FAILURES.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path: str) -> None:
+    """Write the metrics for node_exporter's textfile collector.
+
+    The file is replaced atomically so the collector never reads a partial write.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(render_metrics())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_address = None
+
+
+def configure_metrics(config: dict) -> None:
+    """Start, move or stop the /metrics HTTP endpoint to match `metrics_port`/`metrics_host`."""
+    global _server, _server_address
+
+    address = (config.get('metrics_host', "0.0.0.0"), int(config['metrics_port'])) if config.get('metrics_port') else None
+    if address == _server_address:
+        return
+
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
+        _server_address = None
+
+    if address is not None:
+        try:
+            _server = ThreadingHTTPServer(address, _MetricsHandler)
+        except OSError as e:
+            logging.error(StructuredMessage({"event_type": "metrics_server_failed", "host": address[0], "port": address[1], "error": str(e)}))
+            return
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        _server_address = address
+        logging.info(StructuredMessage({"event_type": "metrics_server_started", "host": address[0], "port": address[1]}))
+
+
+def export_metrics(config: dict) -> None:
+    """Called once per cycle: update the textfile, if configured."""
+    LAST_CYCLE_TIMESTAMP.set(time.time())
+    textfile = config.get('metrics_textfile')
+    if textfile:
+        try:
+            write_textfile(textfile)
+        except OSError as e:
+            logging.error(StructuredMessage({"event_type": "metrics_textfile_write_failed", "path": textfile, "error": str(e)}))
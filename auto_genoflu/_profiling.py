@@ -0,0 +1,114 @@
+import os
+import logging
+import cProfile
+import pstats
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from glob import glob
+from typing import Iterator, List
+
+from auto_genoflu._logging import StructuredMessage
+
+DEFAULT_PROFILE_EVERY_N_CYCLES = 1
+DEFAULT_PROFILE_TOP_N = 20
+DEFAULT_PROFILE_KEEP = 20
+
+
+def get_profile_dir(config: dict) -> str:
+    return config.get('profile_dir') or os.path.join(config['work_dir'], "profiles")
+
+
+def top_functions(profiler: cProfile.Profile, top_n: int) -> List[dict]:
+    """The top_n functions by time spent in the function itself."""
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:top_n]
+    return [
+        {"function": f"{os.path.basename(file_name)}:{line}({function_name})", "ncalls": ncalls, "tottime": round(tottime, 4), "cumtime": round(cumtime, 4)}
+        for (file_name, line, function_name), (_, ncalls, tottime, cumtime, _) in rows
+    ]
+
+
+def top_allocations(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, top_n: int) -> List[dict]:
+    """The top_n source lines by memory allocated during the cycle and still held at its end."""
+    return [
+        {"location": str(stat.traceback), "size_diff_kb": round(stat.size_diff / 1024, 1), "count_diff": stat.count_diff}
+        for stat in after.compare_to(before, "lineno")[:top_n]
+    ]
+
+
+def prune_profiles(profile_dir: str, keep: int) -> None:
+    """Delete all but the `keep` most recent cycles' dumps."""
+    dumps = sorted(glob(os.path.join(profile_dir, "cycle_*")), key=os.path.getmtime, reverse=True)
+    cycles = []
+    for dump in dumps:
+        cycle = os.path.basename(dump).split(".")[0]
+        if cycle not in cycles:
+            cycles.append(cycle)
+        if cycles.index(cycle) >= keep:
+            os.remove(dump)
+
+
+class CycleProfiler:
+    """Profiles every Nth analysis cycle with cProfile and, optionally, tracemalloc.
+
+    Each profiled cycle writes `cycle_<timestamp>_<n>.prof` (open with pstats or
+    snakeviz) and, with memory profiling, a `.tracemalloc` snapshot to the profile
+    directory, and logs its top hotspots as a `cycle_profile` event.
+
+    cProfile only sees the thread that runs the cycle; time spent in worker
+    threads shows up as time waiting on them.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.cycle = 0
+
+    @contextmanager
+    def profile(self, config: dict) -> Iterator[None]:
+        self.cycle += 1
+        every_n_cycles = max(1, int(config.get('profile_every_n_cycles', DEFAULT_PROFILE_EVERY_N_CYCLES)))
+        if not (self.enabled or config.get('profile', False)) or (self.cycle - 1) % every_n_cycles != 0:
+            yield
+            return
+
+        top_n = int(config.get('profile_top_n', DEFAULT_PROFILE_TOP_N))
+        profile_memory = config.get('profile_memory', False)
+
+        if profile_memory:
+            tracemalloc.start()
+            before = tracemalloc.take_snapshot()
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+
+            if profile_memory:
+                after = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+
+            self._save(config, profiler, top_n, (before, after) if profile_memory else None)
+
+    def _save(self, config: dict, profiler: cProfile.Profile, top_n: int, snapshots) -> None:
+        profile_dir = get_profile_dir(config)
+        name = f"cycle_{datetime.now().strftime('%Y%m%d-%H%M%S')}_{self.cycle}"
+        event = {"event_type": "cycle_profile", "cycle": self.cycle, "total_seconds": round(pstats.Stats(profiler).total_tt, 4), "top_functions": top_functions(profiler, top_n)}
+        if snapshots is not None:
+            event["top_allocations"] = top_allocations(snapshots[0], snapshots[1], top_n)
+
+        try:
+            os.makedirs(profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(profile_dir, f"{name}.prof"))
+            event["profile_file"] = os.path.join(profile_dir, f"{name}.prof")
+
+            if snapshots is not None:
+                snapshots[1].dump(os.path.join(profile_dir, f"{name}.tracemalloc"))
+
+            prune_profiles(profile_dir, int(config.get('profile_keep', DEFAULT_PROFILE_KEEP)))
+        except OSError as e:
+            logging.error(StructuredMessage({"event_type": "cycle_profile_write_failed", "profile_dir": profile_dir, "error": str(e)}))
+
+        logging.info(StructuredMessage(event))
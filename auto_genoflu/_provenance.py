@@ -0,0 +1,254 @@
+import os
+import json
+import fcntl
+import logging
+import threading
+from glob import glob, escape as glob_escape
+from typing import Dict, Iterable, List, Optional
+
+from auto_genoflu._logging import StructuredMessage
+from auto_genoflu.operations import move_file
+
+PROVENANCE_SUFFIX = "__genoflu_complete.json"
+PROVENANCE_JOURNAL_FILENAME = "auto_genoflu_provenance.jsonl"
+# Compact once the journal holds this many times more lines than samples
+JOURNAL_COMPACTION_RATIO = 2
+JOURNAL_COMPACTION_MIN_LINES = 1000
+
+
+def use_provenance_journal(config: dict) -> bool:
+    return config.get('provenance_backend', "json") == "journal"
+
+
+def get_journal_path(config: dict) -> str:
+    return config.get('provenance_journal_path') or os.path.join(config['work_dir'], PROVENANCE_JOURNAL_FILENAME)
+
+
+def provenance_file_name(sample_name: str) -> str:
+    return f"{sample_name}{PROVENANCE_SUFFIX}"
+
+
+class ProvenanceJournal:
+    """Append-only JSONL journal holding the provenance of every sample, one record per line.
+
+    Writers append whole records under an exclusive lock, so local workers and
+    Slurm jobs on other nodes can share one journal on a shared filesystem. The
+    latest record for a sample wins. Readers keep their place in the file and
+    only parse lines appended since the last load; a compaction (which replaces
+    the file) triggers a full reload.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records: Dict[str, dict] = {}
+        self.lines = 0
+        self.offset = 0
+        self.inode = None
+        self.lock = threading.Lock()
+        # file locks don't exclude threads of the same process from each other
+        self.write_lock = threading.Lock()
+
+    def _open_for_append(self) -> int:
+        """Open and lock the journal, retrying if it was replaced by a compaction meanwhile."""
+        while True:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_ino == os.stat(self.path).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def append(self, records: List[dict]) -> None:
+        if not records:
+            return
+        data = "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+
+        with self.write_lock:
+            fd = self._open_for_append()
+            try:
+                view = memoryview(data)
+                while view:
+                    written = os.write(fd, view)
+                    view = view[written:]
+                os.fsync(fd)
+            finally:
+                # closing releases the lock
+                os.close(fd)
+
+    def load(self) -> Dict[str, dict]:
+        """Bring the in-memory records up to date with the journal, reading only new lines."""
+        with self.lock:
+            try:
+                f = open(self.path, "rb")
+            except FileNotFoundError:
+                self.records, self.lines, self.offset, self.inode = {}, 0, 0, None
+                return self.records
+
+            with f:
+                stat_result = os.fstat(f.fileno())
+                if stat_result.st_ino != self.inode or stat_result.st_size < self.offset:
+                    self.records, self.lines, self.offset, self.inode = {}, 0, 0, stat_result.st_ino
+                f.seek(self.offset)
+                data = f.read()
+
+            # a line without its newline is still being written; pick it up next time
+            complete = data[:data.rfind(b"\n") + 1]
+            for line in complete.splitlines():
+                self.lines += 1
+                try:
+                    record = json.loads(line)
+                    self.records[record['sample_name']] = record
+                except (ValueError, KeyError, TypeError) as e:
+                    logging.warning(StructuredMessage({"event_type": "provenance_journal_bad_line", "journal_path": self.path, "error": str(e)}))
+            self.offset += len(complete)
+
+            return self.records
+
+    def compact(self) -> None:
+        """Rewrite the journal with only the latest record for each sample."""
+        with self.write_lock:
+            fd = self._open_for_append()
+            try:
+                self.load()
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    for record in self.records.values():
+                        f.write(json.dumps(record) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                lines_before = self.lines
+                os.replace(tmp_path, self.path)
+            finally:
+                os.close(fd)
+
+        self.load()
+        logging.info(StructuredMessage({"event_type": "provenance_journal_compacted", "journal_path": self.path, "lines_before": lines_before, "lines_after": self.lines}))
+
+
+_journals: Dict[str, ProvenanceJournal] = {}
+_journals_lock = threading.Lock()
+
+
+def get_journal(config: dict) -> ProvenanceJournal:
+    """The journal for this config, shared so its records stay loaded between cycles."""
+    path = get_journal_path(config)
+    with _journals_lock:
+        if path not in _journals:
+            _journals[path] = ProvenanceJournal(path)
+        return _journals[path]
+
+
+def provenance_location(config: dict, sample_name: str) -> str:
+    """Where a sample's provenance is looked up, for log messages."""
+    if use_provenance_journal(config):
+        return get_journal_path(config)
+    return os.path.join(config['provenance_dir'], provenance_file_name(sample_name))
+
+
+def write_provenance(config: dict, sample_name: str, record: dict, working_dir: str) -> None:
+    """Record a sample's provenance in the configured backend.
+
+    The per-sample JSON is written to working_dir first and then moved (or uploaded)
+    into provenance_dir, so readers never see a partial file. With the journal
+    backend the record is appended to the journal instead, plus the per-sample
+    JSON if `provenance_export_per_file` is set.
+    """
+    if use_provenance_journal(config):
+        get_journal(config).append([{"sample_name": sample_name, **record}])
+        if not config.get('provenance_export_per_file', False):
+            return
+
+    tmp_path = os.path.join(working_dir, provenance_file_name(sample_name))
+    with open(tmp_path, "w") as f:
+        json.dump(record, f)
+    move_file(tmp_path, os.path.join(config['provenance_dir'], provenance_file_name(sample_name)), use_nextcloud=config.get('use_nextcloud', False))
+
+
+def _load_provenance_file(path: str) -> Optional[dict]:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def load_provenance(config: dict, sample_names: Optional[Iterable[str]] = None) -> Dict[str, dict]:
+    """Provenance records by sample name, for sample_names or for every sample.
+
+    Samples without provenance are left out.
+    """
+    if use_provenance_journal(config):
+        records = get_journal(config).load()
+        if sample_names is None:
+            return dict(records)
+        return {name: records[name] for name in sample_names if name in records}
+
+    if sample_names is None:
+        paths = glob(os.path.join(glob_escape(config['provenance_dir']), f"*{PROVENANCE_SUFFIX}"))
+        sample_names = [os.path.basename(path)[:-len(PROVENANCE_SUFFIX)] for path in paths]
+
+    provenance = {}
+    for name in sample_names:
+        record = _load_provenance_file(os.path.join(config['provenance_dir'], provenance_file_name(name)))
+        if record is not None:
+            provenance[name] = record
+    return provenance
+
+
+def maybe_compact_journal(config: dict) -> None:
+    """Compact the journal once superseded records make up most of it."""
+    if not use_provenance_journal(config):
+        return
+    journal = get_journal(config)
+    journal.load()
+    if journal.lines > JOURNAL_COMPACTION_MIN_LINES and journal.lines > JOURNAL_COMPACTION_RATIO * len(journal.records):
+        journal.compact()
+
+
+def import_provenance_files(config: dict) -> int:
+    """Append every per-sample JSON in provenance_dir to the journal, skipping records it already has.
+
+    Returns:
+        Number of records imported
+    """
+    journal = get_journal(config)
+    existing = journal.load()
+
+    records = []
+    for path in sorted(glob(os.path.join(glob_escape(config['provenance_dir']), f"*{PROVENANCE_SUFFIX}"))):
+        sample_name = os.path.basename(path)[:-len(PROVENANCE_SUFFIX)]
+        try:
+            record = {"sample_name": sample_name, **_load_provenance_file(path)}
+        except (TypeError, ValueError) as e:
+            logging.warning(StructuredMessage({"event_type": "provenance_import_skipped", "provenance_file": path, "error": str(e)}))
+            continue
+        if existing.get(sample_name) != record:
+            records.append(record)
+
+    journal.append(records)
+
+    logging.info(StructuredMessage({"event_type": "provenance_imported", "journal_path": journal.path, "records_imported": len(records)}))
+
+    return len(records)
+
+
+def export_provenance_files(config: dict, out_dir: str) -> int:
+    """Write a `<sample>__genoflu_complete.json` file for every sample in the journal.
+
+    Returns:
+        Number of files written
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    records = get_journal(config).load()
+    for sample_name, record in records.items():
+        path = os.path.join(out_dir, provenance_file_name(sample_name))
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({key: value for key, value in record.items() if key != "sample_name"}, f)
+        os.replace(tmp_path, path)
+
+    logging.info(StructuredMessage({"event_type": "provenance_exported", "out_dir": out_dir, "files_written": len(records)}))
+
+    return len(records)
@@ -0,0 +1,125 @@
+import time
+import sqlite3
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+from auto_genoflu._logging import StructuredMessage
+from auto_genoflu._metrics import QUEUE_DEPTH, QUEUE_CLASS_DEPTH, QUEUE_OLDEST_WAIT, QUEUE_WAIT_SECONDS, SAMPLES_DEFERRED
+from auto_genoflu._state import list_inflight_jobs
+from auto_genoflu._tools import get_input_name
+
+# Why a sample needs to be (re)analysed
+WORK_CLASSES = ["new", "input_changed", "retry", "missing_provenance", "output_changed"]
+
+
+def class_priority(config: dict) -> Dict[str, int]:
+    """Rank of each work class, lowest first. Classes missing from `queue_class_priority` go last, in default order."""
+    order = list(config.get('queue_class_priority', WORK_CLASSES))
+    order += [work_class for work_class in WORK_CLASSES if work_class not in order]
+    return {work_class: rank for rank, work_class in enumerate(order)}
+
+
+def _budget(config: dict, key: str) -> Optional[int]:
+    value = config.get(key)
+    return None if value is None else max(1, int(value))
+
+
+def enqueue_work(conn: sqlite3.Connection, work: Dict[str, str], full_scan: bool, now: Optional[float] = None) -> Dict[str, Tuple[str, float]]:
+    """Record when each sample was first seen needing work.
+
+    A sample keeps its place while its work class is unchanged; on a full scan,
+    samples that no longer need work are dropped from the queue.
+
+    Args:
+        work: Work class by input file
+        full_scan: Whether work covers every sample, rather than a targeted scan
+
+    Returns:
+        (work class, enqueued_at) by input file
+    """
+    now = time.time() if now is None else now
+    names = {get_input_name(input_file): input_file for input_file in work}
+    queued = {row[0]: (row[1], row[2]) for row in conn.execute("SELECT sample_name, work_class, enqueued_at FROM work_queue")}
+
+    entries = {}
+    for name, input_file in names.items():
+        previous = queued.get(name)
+        enqueued_at = previous[1] if previous is not None and previous[0] == work[input_file] else now
+        entries[input_file] = (work[input_file], enqueued_at)
+
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO work_queue (sample_name, work_class, enqueued_at) VALUES (?, ?, ?)",
+                         [(name, *entries[input_file]) for name, input_file in names.items() if queued.get(name) != entries[input_file]])
+        if full_scan:
+            conn.executemany("DELETE FROM work_queue WHERE sample_name = ?", [(name,) for name in queued.keys() - names.keys()])
+
+    return entries
+
+
+def plan_cycle(config: dict, conn: sqlite3.Connection, work: Dict[str, str], full_scan: bool = True) -> Tuple[List[str], Set[str]]:
+    """Order the work found by a scan and choose what to start this cycle.
+
+    Samples are ordered by work class (`queue_class_priority`), then oldest first;
+    samples queued for longer than `queue_max_wait_seconds` go ahead of every class
+    so a steady stream of new samples can't starve the rest. At most
+    `queue_max_samples_per_cycle` samples are started, and no more than
+    `queue_max_inflight_samples` minus the samples already in flight on Slurm.
+    Started samples leave the queue; the rest keep their place for the next cycle.
+
+    Returns:
+        (input files to start, in order; names of the samples deferred to a later cycle)
+    """
+    now = time.time()
+    entries = enqueue_work(conn, work, full_scan, now)
+    priority = class_priority(config)
+    max_wait = config.get('queue_max_wait_seconds')
+
+    def sort_key(input_file: str) -> tuple:
+        work_class, enqueued_at = entries[input_file]
+        overdue = max_wait is not None and now - enqueued_at > float(max_wait)
+        return (not overdue, priority[work_class], enqueued_at, input_file)
+
+    ordered = sorted(entries, key=sort_key)
+
+    budget = len(ordered)
+    per_cycle = _budget(config, 'queue_max_samples_per_cycle')
+    if per_cycle is not None:
+        budget = min(budget, per_cycle)
+    max_inflight = _budget(config, 'queue_max_inflight_samples')
+    inflight_count = 0
+    if max_inflight is not None:
+        inflight_count = len(list_inflight_jobs(conn))
+        budget = min(budget, max(0, max_inflight - inflight_count))
+
+    started, deferred = ordered[:budget], ordered[budget:]
+    deferred_names = {get_input_name(input_file) for input_file in deferred}
+
+    with conn:
+        conn.executemany("DELETE FROM work_queue WHERE sample_name = ?", [(get_input_name(input_file),) for input_file in started])
+
+    # Queue depth and wait per class, including classes that just emptied
+    depth = {work_class: 0 for work_class in priority}
+    oldest_wait = {work_class: 0.0 for work_class in priority}
+    for work_class, enqueued_at in entries.values():
+        depth[work_class] += 1
+        oldest_wait[work_class] = max(oldest_wait[work_class], now - enqueued_at)
+    for work_class in priority:
+        QUEUE_CLASS_DEPTH.set(depth[work_class], work_class=work_class)
+        QUEUE_OLDEST_WAIT.set(oldest_wait[work_class], work_class=work_class)
+    for input_file in started:
+        work_class, enqueued_at = entries[input_file]
+        QUEUE_WAIT_SECONDS.observe(now - enqueued_at, work_class=work_class)
+    QUEUE_DEPTH.set(len(entries))
+    SAMPLES_DEFERRED.set(len(deferred))
+
+    if entries:
+        logging.info(StructuredMessage({
+            "event_type": "work_queue_planned",
+            "queued_by_class": {work_class: count for work_class, count in depth.items() if count},
+            "oldest_wait_seconds": {work_class: round(wait, 1) for work_class, wait in oldest_wait.items() if depth[work_class]},
+            "samples_started": len(started),
+            "samples_deferred": len(deferred),
+            "inflight_samples": inflight_count,
+        }))
+
+    return started, deferred_names
@@ -3,11 +3,41 @@ from glob import glob
 from typing import List
 import re
 import logging
-import json
-from typing import Callable
+import gzip
+from typing import BinaryIO, Callable
 
-def _rename_seqs(rename_fn: Callable, input_path: str, output_path: str) -> None:
-    logging.debug(json.dumps({
+from auto_genoflu._logging import StructuredMessage
+
+# Sequence data is copied in blocks of this size; only header lines are decoded
+RENAME_BLOCK_SIZE = 1024 * 1024
+COMPRESSED_SUFFIXES = ('.gz', '.bgz')
+GZIP_MAGIC = b"\x1f\x8b"
+
+def _open_fasta(input_path: str) -> BinaryIO:
+    """Open a FASTA file for binary reading, transparently decompressing gzip and BGZF."""
+    with open(input_path, "rb") as f:
+        magic = f.read(2)
+
+    if magic == GZIP_MAGIC:
+        # BGZF is a series of gzip members, which gzip reads as one stream
+        return gzip.open(input_path, "rb")
+    return open(input_path, "rb")
+
+def count_fasta_records(input_path: str) -> int:
+    """Count the sequences in a (optionally compressed) FASTA file without parsing it."""
+    count = 0
+    previous = b"\n"
+    with _open_fasta(input_path) as infile:
+        while True:
+            block = infile.read(RENAME_BLOCK_SIZE)
+            if not block:
+                break
+            count += (previous + block).count(b"\n>")
+            previous = block[-1:]
+    return count
+
+def _rename_seqs(rename_fn: Callable, input_path: str, output_path: str) -> int:
+    logging.debug(StructuredMessage({
         "event_type": "rename_sequences_start",
         "input_path": input_path,
         "output_path": output_path,
@@ -15,18 +45,57 @@ def _rename_seqs(rename_fn: Callable, input_path: str, output_path: str) -> None
     }))
 
     header_count = 0
-    with open(input_path, "r") as infile, open(output_path, "w") as outfile:
-        
-        for line in infile.readlines():
-            if line.startswith(">"):
-                original_header = line.rstrip().lstrip(">")
-                new_header = rename_fn(original_header)
-                outfile.write(f">{new_header}\n")
-                header_count += 1
-            else:
-                outfile.write(line)
+    at_line_start = True
+    carry = b""
+
+    with _open_fasta(input_path) as infile, open(output_path, "wb") as outfile:
+        while True:
+            block = infile.read(RENAME_BLOCK_SIZE)
+            eof = not block
+            buffer = carry + block
+            carry = b""
+
+            # Universal newlines, as in text mode: \r\n and a lone \r both become \n. A trailing \r
+            # is held back so a \r\n split across blocks still becomes a single \n
+            if not eof and buffer.endswith(b"\r"):
+                carry = b"\r"
+                buffer = buffer[:-1]
+            buffer = buffer.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+            view = memoryview(buffer)
+
+            pos = 0
+            while pos < len(buffer):
+                if at_line_start and buffer[pos:pos + 1] == b">":
+                    eol = buffer.find(b"\n", pos)
+                    if eol == -1 and not eof:
+                        # header continues in the next block
+                        carry = buffer[pos:] + carry
+                        break
+                    line_end = len(buffer) if eol == -1 else eol
+
+                    original_header = buffer[pos:line_end].rstrip().lstrip(b">").decode("utf-8", "surrogateescape")
+                    new_header = rename_fn(original_header)
+                    outfile.write(b">" + new_header.encode("utf-8", "surrogateescape") + b"\n")
+                    header_count += 1
+                    pos = line_end + 1
+                    continue
+
+                # Copy everything up to the next header line in one write
+                next_header = buffer.find(b"\n>", pos)
+                if next_header == -1:
+                    outfile.write(view[pos:])
+                    at_line_start = buffer.endswith(b"\n")
+                    pos = len(buffer)
+                else:
+                    outfile.write(view[pos:next_header + 1])
+                    at_line_start = True
+                    pos = next_header + 1
+
+            view.release()
+            if eof:
+                break
     
-    logging.debug(json.dumps({
+    logging.debug(StructuredMessage({
         "event_type": "rename_sequences_complete",
         "input_path": input_path,
         "output_path": output_path,
@@ -34,6 +103,8 @@ def _rename_seqs(rename_fn: Callable, input_path: str, output_path: str) -> None
         "headers_renamed": header_count
     }))
 
+    return header_count
+
 def _rename_cfia(fasta_header: str) -> str: 
     new_header = fasta_header
     if "_" in fasta_header: 
@@ -55,16 +126,19 @@ def _rename_nf_flu(fasta_header: str) -> str:
         new_header = "_".join(fields)
     return new_header
 
-def rename_fasta_headers(input_path: str, output_path: str) -> None:
+def rename_fasta_headers(input_path: str, output_path: str) -> int:
     """
     Rename the headers of a FASTA file.
 
+    The input is streamed in large blocks, so memory use does not depend on its
+    size, and may be gzip or BGZF compressed.
+
     Args:
-        input_path (str): Path to the input FASTA file.
+        input_path (str): Path to the input FASTA file (optionally .gz/.bgz).
         output_path (str): Path to the output FASTA file.
 
     Returns:
-        None
+        int: Number of sequences (segments) written
     """
     fn_dict = {
         'cfia': _rename_cfia, 
@@ -73,21 +147,26 @@ def rename_fasta_headers(input_path: str, output_path: str) -> None:
     }
 
     file_name = os.path.basename(input_path)
+    # Compressed inputs are recognised by the name of the FASTA inside them
+    for suffix in COMPRESSED_SUFFIXES:
+        if file_name.endswith(suffix):
+            file_name = file_name[:-len(suffix)]
+            break
     count = file_name.count("_") + file_name.count("-")
 
     if count > 6 and file_name.endswith('.consensus.fasta'):
-        logging.debug(json.dumps({"event_type": "renaming_cfia_headers", "file_name": file_name}))
-        _rename_seqs(fn_dict['cfia'], input_path, output_path)
+        logging.debug(StructuredMessage({"event_type": "renaming_cfia_headers", "file_name": file_name}))
+        return _rename_seqs(fn_dict['cfia'], input_path, output_path)
     
     elif re.search("EPI[-_]ISL", file_name, flags=re.IGNORECASE):
-        logging.debug(json.dumps({"event_type": "renaming_gisaid_headers", "file_name": file_name}))
-        _rename_seqs(fn_dict['gisaid'], input_path, output_path)
+        logging.debug(StructuredMessage({"event_type": "renaming_gisaid_headers", "file_name": file_name}))
+        return _rename_seqs(fn_dict['gisaid'], input_path, output_path)
     elif re.match("[A-Za-z0-9]+-[0-9]+-.-[A-z0-9]+.consensus.fasta", file_name, flags=re.IGNORECASE):
-        logging.debug(json.dumps({"event_type": "renaming_nf_flu_headers", "file_name": file_name}))
-        _rename_seqs(fn_dict['nf-flu'], input_path, output_path)
+        logging.debug(StructuredMessage({"event_type": "renaming_nf_flu_headers", "file_name": file_name}))
+        return _rename_seqs(fn_dict['nf-flu'], input_path, output_path)
     else:
-        logging.warning(json.dumps({"event_type": "unknown_file_type_detected", "file_name": file_name}))
-        _rename_seqs(fn_dict['cfia'], input_path, output_path)
+        logging.warning(StructuredMessage({"event_type": "unknown_file_type_detected", "file_name": file_name}))
+        return _rename_seqs(fn_dict['cfia'], input_path, output_path)
     
     
 
@@ -0,0 +1,169 @@
+import os
+import csv
+import json
+import time
+import hashlib
+import logging
+import shutil
+import threading
+from glob import glob, escape as glob_escape
+from typing import Dict, List, Optional, Tuple
+
+from auto_genoflu._hashing import hash_file, HASH_ALGORITHM
+from auto_genoflu._logging import StructuredMessage
+
+DEFAULT_RESULT_CACHE_MAX_MB = 1024
+DEFAULT_RESULT_CACHE_MAX_AGE_DAYS = 90
+
+# Hashes of GenoFLU's script and reference data, keyed on the files' (path, size, mtime)
+_environment_hashes: Dict[tuple, str] = {}
+_environment_hashes_lock = threading.Lock()
+
+
+def use_result_cache(config: dict) -> bool:
+    return config.get('use_result_cache', False)
+
+
+def get_result_cache_dir(config: dict) -> str:
+    return config.get('result_cache_dir') or os.path.join(config['work_dir'], "result_cache")
+
+
+def _hash_files_once(paths: List[str]) -> str:
+    """Combined hash of several files, only recomputed when one of them changes."""
+    fingerprint = tuple((path, os.stat(path).st_size, os.stat(path).st_mtime_ns) for path in paths)
+    with _environment_hashes_lock:
+        if fingerprint in _environment_hashes:
+            return _environment_hashes[fingerprint]
+
+    digest = hashlib.new(HASH_ALGORITHM)
+    for path in paths:
+        digest.update(f"{os.path.basename(path)}\0{hash_file(path)}\0".encode("utf-8"))
+
+    with _environment_hashes_lock:
+        _environment_hashes[fingerprint] = digest.hexdigest()
+    return digest.hexdigest()
+
+
+def genoflu_version_hash(genoflu_env_path: str) -> str:
+    """Identifies the GenoFLU version by the content of genoflu.py."""
+    return _hash_files_once([os.path.join(genoflu_env_path, "bin", "genoflu.py")])
+
+
+def reference_data_hash(genoflu_env_path: str) -> str:
+    """Identifies the reference segments and genotype key GenoFLU compares against."""
+    dependencies = os.path.join(genoflu_env_path, "dependencies")
+    paths = sorted(glob(os.path.join(glob_escape(dependencies), "fastas", "*")))
+    return _hash_files_once(paths + [os.path.join(dependencies, "genotype_key.xlsx")])
+
+
+def result_cache_key(renamed_fasta_path: str, config: dict, genoflu_env_path: str) -> str:
+    """Key for a GenoFLU result: anything that changes the output changes the key."""
+    parts = [
+        hash_file(renamed_fasta_path),
+        str(float(config.get('id_threshold', 98.0))),
+        genoflu_version_hash(genoflu_env_path),
+        reference_data_hash(genoflu_env_path),
+    ]
+    return hashlib.new(HASH_ALGORITHM, "\0".join(parts).encode("utf-8")).hexdigest()
+
+
+def lookup_result(config: dict, key: str) -> Optional[Tuple[str, str]]:
+    """Find a cached result.
+
+    Returns:
+        (path of the cached TSV, sample name it was produced for), or None on a miss
+    """
+    tsv_path = os.path.join(get_result_cache_dir(config), f"{key}.tsv")
+    try:
+        with open(os.path.join(get_result_cache_dir(config), f"{key}.json"), "r") as f:
+            metadata = json.load(f)
+        # mark as recently used, for eviction
+        os.utime(tsv_path)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    return tsv_path, metadata['sample_name']
+
+
+def store_result(config: dict, key: str, tsv_path: str, sample_name: str) -> None:
+    """Add a GenoFLU result to the cache. Entries appear atomically, TSV first."""
+    cache_dir = get_result_cache_dir(config)
+    os.makedirs(cache_dir, exist_ok=True)
+    suffix = f"{os.getpid()}.{threading.get_ident()}.tmp"
+
+    shutil.copyfile(tsv_path, os.path.join(cache_dir, f"{key}.tsv.{suffix}"))
+    os.replace(os.path.join(cache_dir, f"{key}.tsv.{suffix}"), os.path.join(cache_dir, f"{key}.tsv"))
+
+    with open(os.path.join(cache_dir, f"{key}.json.{suffix}"), "w") as f:
+        json.dump({"sample_name": sample_name, "created": time.time()}, f)
+    os.replace(os.path.join(cache_dir, f"{key}.json.{suffix}"), os.path.join(cache_dir, f"{key}.json"))
+
+
+def materialise_result(cached_tsv: str, cached_sample_name: str, dest_tsv: str, sample_name: str) -> None:
+    """Write a cached TSV under a new sample name, replacing the name in its Strain column."""
+    with open(cached_tsv, "r", newline="") as src, open(dest_tsv, "w", newline="") as dest:
+        reader = csv.reader(src, delimiter="\t")
+        writer = csv.writer(dest, delimiter="\t", lineterminator="\n")
+        header = next(reader)
+        writer.writerow(header)
+        strain_column = header.index("Strain") if "Strain" in header else 0
+        for row in reader:
+            if len(row) > strain_column and row[strain_column] == cached_sample_name:
+                row[strain_column] = sample_name
+            writer.writerow(row)
+
+
+def evict_cache_entries(cache_dir: str, suffix: str, max_bytes: float, max_age_seconds: float, companion_suffixes: Tuple[str, ...] = ()) -> Tuple[int, int, int]:
+    """Drop `*<suffix>` entries older than max_age_seconds, then the least recently used
+    ones until the rest fit in max_bytes. Companion files of an entry go with it.
+
+    Returns:
+        (entries removed, entries kept, bytes kept)
+    """
+    oldest_allowed = time.time() - max_age_seconds
+
+    entries = []
+    for path in glob(os.path.join(glob_escape(cache_dir), f"*{suffix}")):
+        try:
+            stat_result = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat_result.st_mtime, stat_result.st_size, path))
+    entries.sort()
+
+    total_bytes = sum(size for _, size, _ in entries)
+    removed = 0
+    for mtime, size, path in entries:
+        if mtime >= oldest_allowed and total_bytes <= max_bytes:
+            break
+        stem = path[:-len(suffix)]
+        for entry_path in (path, *(stem + companion for companion in companion_suffixes)):
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+        total_bytes -= size
+        removed += 1
+
+    return removed, len(entries) - removed, total_bytes
+
+
+def evict_results(config: dict) -> int:
+    """Drop entries older than `result_cache_max_age_days`, then the least recently used
+    ones until the cache fits in `result_cache_max_mb`.
+
+    Returns:
+        Number of entries removed
+    """
+    removed, kept, total_bytes = evict_cache_entries(
+        get_result_cache_dir(config),
+        ".tsv",
+        float(config.get('result_cache_max_mb', DEFAULT_RESULT_CACHE_MAX_MB)) * 1024 * 1024,
+        float(config.get('result_cache_max_age_days', DEFAULT_RESULT_CACHE_MAX_AGE_DAYS)) * 86400,
+        companion_suffixes=(".json",),
+    )
+
+    if removed:
+        logging.info(StructuredMessage({"event_type": "result_cache_evicted", "entries_removed": removed, "entries_kept": kept, "cache_mb": round(total_bytes / 1024 / 1024, 2)}))
+
+    return removed
@@ -0,0 +1,104 @@
+import os
+import re
+import logging
+from fnmatch import translate
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from auto_genoflu._logging import StructuredMessage
+from auto_genoflu._tools import get_input_name, get_output_name
+
+OUTPUT_GLOB_EXPRESSIONS = ["*.tsv"]
+
+
+@lru_cache(maxsize=32)
+def _compile_patterns(glob_expressions: Tuple[str, ...]) -> Callable[[str], bool]:
+    regex = re.compile("|".join(f"(?:{translate(expr)})" for expr in glob_expressions))
+    return lambda file_name: regex.match(file_name) is not None
+
+
+def compile_patterns(glob_expressions: Iterable[str]) -> Callable[[str], bool]:
+    """Combine glob patterns into one precompiled matcher for file names.
+
+    Matches exactly like `fnmatch.fnmatchcase` against any of the patterns. The
+    matcher is built once per distinct list of patterns and reused across scans.
+    """
+    return _compile_patterns(tuple(glob_expressions))
+
+
+def scan_directory(root: str, matches: Callable[[str], bool], recursive: bool = False) -> Dict[str, os.stat_result]:
+    """Walk root once, returning the stat result of every regular file whose name matches.
+
+    Each file appears once however many patterns it matches. Subdirectories are
+    only entered when recursive is True. As with glob, hidden files and folders
+    (starting with '.') are skipped. Symlinks are followed for files but not for directories.
+
+    Returns:
+        Dictionary mapping each file path to its stat result
+    """
+    found = {}
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    # like glob, hidden files and folders are never matched
+                    if entry.name.startswith("."):
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive:
+                                pending.append(entry.path)
+                        elif matches(entry.name) and entry.is_file():
+                            found[entry.path] = entry.stat()
+                    except FileNotFoundError:
+                        # removed between listing and stat
+                        continue
+        except (FileNotFoundError, NotADirectoryError, PermissionError) as e:
+            logging.warning(StructuredMessage({"event_type": "scan_directory_unreadable", "directory": directory, "error": str(e)}))
+
+    logging.debug(StructuredMessage({"event_type": "scan_directory_complete", "root": root, "recursive": recursive, "files_found": len(found)}))
+
+    return found
+
+
+def index_by_sample(file_paths: Iterable[str], name_function: Callable[[str], str], kind: str) -> Dict[str, str]:
+    """Map each sample name to its file, reporting names claimed by more than one file.
+
+    For a collision the first path in sorted order is used, so the choice does not
+    depend on directory listing order.
+    """
+    by_name: Dict[str, List[str]] = {}
+    for file_path in sorted(file_paths):
+        by_name.setdefault(name_function(file_path), []).append(file_path)
+
+    index = {}
+    for name, paths in by_name.items():
+        index[name] = paths[0]
+        if len(paths) > 1:
+            logging.warning(StructuredMessage({"event_type": "sample_name_collision", "kind": kind, "sample_name": name, "files": paths, "file_used": paths[0]}))
+
+    return index
+
+
+def scan_sample_files(config: dict, sample_names: Optional[Iterable[str]] = None) -> Tuple[Dict[str, os.stat_result], Dict[str, os.stat_result]]:
+    """Scan input_dir and output_dir once each.
+
+    With `recursive_scan` set in the config, inputs in subdirectories of input_dir
+    are found too. If sample_names is given, only files belonging to those samples
+    are returned.
+
+    Returns:
+        (input file stats, output file stats), each mapping path to stat result
+    """
+    recursive = config.get('recursive_scan', False)
+    inputs = scan_directory(config['input_dir'], compile_patterns(config['glob_expressions']), recursive=recursive)
+    outputs = scan_directory(config['output_dir'], compile_patterns(OUTPUT_GLOB_EXPRESSIONS))
+
+    if sample_names is not None:
+        sample_names = set(sample_names)
+        inputs = {path: st for path, st in inputs.items() if get_input_name(path) in sample_names}
+        outputs = {path: st for path, st in outputs.items() if get_output_name(path) in sample_names}
+
+    return inputs, outputs
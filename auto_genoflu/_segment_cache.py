@@ -0,0 +1,299 @@
+"""Per-segment memoization of GenoFLU's BLAST searches.
+
+GenoFLU calls each segment by BLASTing the sample's FASTA against its reference
+segments. BLAST treats every query sequence independently, so the tabular hits
+for one segment depend only on that segment's sequence, the search options and
+the reference database. A `blastn` shim placed first on PATH for the GenoFLU run
+looks each query sequence up by its normalised sequence hash, only runs the real
+blastn on sequences it has not seen, and writes the combined output in query
+order. GenoFLU then composes the genotype from these hits exactly as it would
+from a full search.
+
+Only tabular output (-outfmt 6 or 10) is memoized; any other invocation is
+handed straight to the real blastn.
+"""
+import os
+import sys
+import json
+import logging
+import hashlib
+import shutil
+import subprocess
+import tempfile
+from glob import glob, escape as glob_escape
+from typing import Dict, List, Optional, Tuple
+
+from auto_genoflu._hashing import hash_file, HASH_ALGORITHM
+from auto_genoflu._logging import StructuredMessage
+from auto_genoflu._result_cache import evict_cache_entries
+
+DEFAULT_SEGMENT_CACHE_MAX_MB = 256
+DEFAULT_SEGMENT_CACHE_MAX_AGE_DAYS = 90
+SEGMENT_CACHE_SUFFIX = ".blast"
+SEGMENT_CACHE_LOG_FILENAME = "segment_cache_log.jsonl"
+
+# Environment passed from run_genoflu to the shim
+ENV_CACHE_DIR = "AUTO_GENOFLU_SEGMENT_CACHE_DIR"
+ENV_REAL_BLASTN = "AUTO_GENOFLU_REAL_BLASTN"
+ENV_VERIFY = "AUTO_GENOFLU_SEGMENT_CACHE_VERIFY"
+ENV_LOG = "AUTO_GENOFLU_SEGMENT_CACHE_LOG"
+
+# Options that change where output goes or how fast it's produced, but not what it contains
+_NEUTRAL_OPTIONS = {"-query", "-out", "-num_threads"}
+_TABULAR_FORMATS = {"6": "\t", "10": ","}
+
+
+def use_segment_cache(config: dict) -> bool:
+    return config.get('use_segment_cache', False)
+
+
+def get_segment_cache_dir(config: dict) -> str:
+    return config.get('segment_cache_dir') or os.path.join(config['work_dir'], "segment_cache")
+
+
+def install_blastn_shim(cache_dir: str) -> str:
+    """Write the `blastn` shim to `<cache_dir>/bin`, returning that directory."""
+    bin_dir = os.path.join(cache_dir, "bin")
+    shim_path = os.path.join(bin_dir, "blastn")
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = f"#!{sys.executable}\nimport sys\nsys.path.insert(0, {package_dir!r})\nfrom auto_genoflu._segment_cache import blastn_main\nsys.exit(blastn_main(sys.argv[1:]))\n"
+
+    try:
+        with open(shim_path, "r") as f:
+            if f.read() == script:
+                return bin_dir
+    except FileNotFoundError:
+        pass
+
+    os.makedirs(bin_dir, exist_ok=True)
+    tmp_path = f"{shim_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(script)
+    os.chmod(tmp_path, 0o755)
+    os.replace(tmp_path, shim_path)
+    return bin_dir
+
+
+def segment_cache_env(config: dict, working_dir: str) -> Optional[Dict[str, str]]:
+    """Environment for a GenoFLU run that puts the shim in front of the real blastn.
+
+    Returns None if blastn can't be found, in which case GenoFLU runs unchanged.
+    """
+    real_blastn = shutil.which("blastn")
+    if real_blastn is None:
+        return None
+
+    cache_dir = get_segment_cache_dir(config)
+    bin_dir = install_blastn_shim(cache_dir)
+    if os.path.dirname(os.path.abspath(real_blastn)) == bin_dir:
+        return None
+
+    return {
+        "PATH": bin_dir + os.pathsep + os.environ.get("PATH", ""),
+        ENV_CACHE_DIR: cache_dir,
+        ENV_REAL_BLASTN: real_blastn,
+        ENV_VERIFY: "1" if config.get('segment_cache_verify', False) else "0",
+        ENV_LOG: os.path.join(working_dir, SEGMENT_CACHE_LOG_FILENAME),
+    }
+
+
+def read_segment_cache_log(working_dir: str) -> dict:
+    """Summarise what the shim did during one GenoFLU run, for provenance."""
+    summary = {"segment_cache_hits": 0, "segment_cache_misses": 0}
+    verified = []
+    try:
+        with open(os.path.join(working_dir, SEGMENT_CACHE_LOG_FILENAME), "r") as f:
+            for line in f:
+                entry = json.loads(line)
+                summary["segment_cache_hits"] += entry.get("hits", 0)
+                summary["segment_cache_misses"] += entry.get("misses", 0)
+                if "identical" in entry:
+                    verified.append(entry["identical"])
+    except FileNotFoundError:
+        return {}
+
+    if verified:
+        summary["segment_cache_verified"] = all(verified)
+    return summary
+
+
+def evict_segments(config: dict) -> int:
+    """Drop cached segments older than `segment_cache_max_age_days`, then the least
+    recently used ones until the cache fits in `segment_cache_max_mb`.
+
+    Returns:
+        Number of segments removed
+    """
+    removed, kept, total_bytes = evict_cache_entries(
+        get_segment_cache_dir(config),
+        SEGMENT_CACHE_SUFFIX,
+        float(config.get('segment_cache_max_mb', DEFAULT_SEGMENT_CACHE_MAX_MB)) * 1024 * 1024,
+        float(config.get('segment_cache_max_age_days', DEFAULT_SEGMENT_CACHE_MAX_AGE_DAYS)) * 86400,
+    )
+
+    if removed:
+        logging.info(StructuredMessage({"event_type": "segment_cache_evicted", "entries_removed": removed, "entries_kept": kept, "cache_mb": round(total_bytes / 1024 / 1024, 2)}))
+
+    return removed
+
+
+def _read_fasta(path: str) -> List[Tuple[str, str]]:
+    """(header, sequence) pairs, with the sequence as it appears (line breaks removed)."""
+    records = []
+    header = None
+    sequence = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if line.startswith(">"):
+                if header is not None:
+                    records.append((header, "".join(sequence)))
+                header = line[1:]
+                sequence = []
+            elif header is not None:
+                sequence.append(line.strip())
+    if header is not None:
+        records.append((header, "".join(sequence)))
+    return records
+
+
+def _database_fingerprint(options: Dict[str, str]) -> str:
+    """Hash of the reference the queries are searched against (-db files or -subject file)."""
+    if "-subject" in options:
+        paths = [options["-subject"]]
+    elif "-db" in options:
+        paths = sorted(glob(glob_escape(options["-db"]) + ".*")) or [options["-db"]]
+    else:
+        paths = []
+    return ";".join(f"{os.path.basename(path)}:{hash_file(path)}" for path in paths if os.path.isfile(path))
+
+
+def _segment_key(sequence: str, search_signature: str) -> str:
+    normalised = "".join(sequence.split()).upper()
+    return hashlib.new(HASH_ALGORITHM, f"{normalised}\0{search_signature}".encode("utf-8")).hexdigest()
+
+
+def _parse_args(argv: List[str]) -> Optional[Dict[str, str]]:
+    """blastn options as a dict, or None for anything the shim doesn't handle."""
+    options = {}
+    i = 0
+    while i < len(argv):
+        name = argv[i]
+        if not name.startswith("-"):
+            return None
+        if i + 1 < len(argv) and not argv[i + 1].startswith("-"):
+            options[name] = argv[i + 1]
+            i += 2
+        else:
+            options[name] = ""
+            i += 1
+    return options
+
+
+def _run_real_blastn(real_blastn: str, argv: List[str], query: str, out: str) -> None:
+    options = []
+    i = 0
+    while i < len(argv):
+        if argv[i] in ("-query", "-out"):
+            i += 2
+            continue
+        options.append(argv[i])
+        i += 1
+    subprocess.run([real_blastn, *options, "-query", query, "-out", out], check=True)
+
+
+def _write_entry(cache_dir: str, key: str, rest_of_lines: List[str]) -> None:
+    path = os.path.join(cache_dir, key + SEGMENT_CACHE_SUFFIX)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.writelines(line + "\n" for line in rest_of_lines)
+    os.replace(tmp_path, path)
+
+
+def _read_entry(cache_dir: str, key: str) -> Optional[List[str]]:
+    path = os.path.join(cache_dir, key + SEGMENT_CACHE_SUFFIX)
+    try:
+        with open(path, "r") as f:
+            lines = f.read().splitlines()
+        # mark as recently used, for eviction
+        os.utime(path)
+        return lines
+    except FileNotFoundError:
+        return None
+
+
+def blastn_main(argv: List[str]) -> int:
+    """Entry point of the `blastn` shim."""
+    real_blastn = os.environ[ENV_REAL_BLASTN]
+    options = _parse_args(argv)
+
+    outfmt = (options or {}).get("-outfmt", "").split()
+    # output is split per query on its first column, which must be the query ID
+    if (options is None or not outfmt or outfmt[0] not in _TABULAR_FORMATS or (len(outfmt) > 1 and outfmt[1] != "qseqid")
+            or options.get("-query", "-") == "-" or "-out" not in options):
+        os.execv(real_blastn, [real_blastn, *argv])
+
+    separator = _TABULAR_FORMATS[outfmt[0]]
+    cache_dir = os.environ[ENV_CACHE_DIR]
+    records = _read_fasta(options["-query"])
+    search_signature = json.dumps([sorted((k, v) for k, v in options.items() if k not in _NEUTRAL_OPTIONS), _database_fingerprint(options)])
+
+    query_ids = [header.split()[0] if header.split() else "" for header, _ in records]
+    if len(set(query_ids)) < len(query_ids):
+        # hits are merged per query ID, so duplicate IDs can't be rebuilt into the real output
+        os.execv(real_blastn, [real_blastn, *argv])
+
+    keys = [_segment_key(sequence, search_signature) for _, sequence in records]
+    cached = [_read_entry(cache_dir, key) for key in keys]
+    missing = [i for i, entry in enumerate(cached) if entry is None]
+
+    with tempfile.TemporaryDirectory(dir=cache_dir) as tmp_dir:
+        if missing:
+            query_path = os.path.join(tmp_dir, "query.fasta")
+            with open(query_path, "w") as f:
+                for i in missing:
+                    f.write(f">{records[i][0]}\n{records[i][1]}\n")
+            out_path = os.path.join(tmp_dir, "out.tsv")
+            _run_real_blastn(real_blastn, argv, query_path, out_path)
+
+            hits: Dict[str, List[str]] = {}
+            with open(out_path, "r") as f:
+                for line in f.read().splitlines():
+                    query_id, _, rest = line.partition(separator)
+                    hits.setdefault(query_id, []).append(rest)
+
+            if not set(hits) <= set(query_ids):
+                # blastn reported IDs that aren't the headers' first words, so hits can't be
+                # attributed to sequences: cache nothing and fall back to a full search
+                _run_real_blastn(real_blastn, argv, options["-query"], out_path)
+                cached = [None] * len(records)
+            else:
+                for i in missing:
+                    cached[i] = hits.get(query_ids[i], [])
+                    _write_entry(cache_dir, keys[i], cached[i])
+
+        if None in cached:
+            with open(os.path.join(tmp_dir, "out.tsv"), "r") as f:
+                output = f.read()
+        else:
+            output = "".join(f"{query_id}{separator}{rest}\n" for query_id, entry in zip(query_ids, cached) for rest in entry)
+
+        log_entry = {"query": options["-query"], "hits": len(records) - len(missing), "misses": len(missing)}
+        if os.environ.get(ENV_VERIFY) == "1":
+            full_path = os.path.join(tmp_dir, "full.tsv")
+            _run_real_blastn(real_blastn, argv, options["-query"], full_path)
+            with open(full_path, "r") as f:
+                full_output = f.read()
+            log_entry["identical"] = full_output == output
+            # never hand GenoFLU anything but the real search result when verifying
+            output = full_output
+
+    with open(options["-out"], "w") as f:
+        f.write(output)
+
+    log_path = os.environ.get(ENV_LOG)
+    if log_path:
+        with open(log_path, "a") as f:
+            f.write(json.dumps(log_entry) + "\n")
+
+    return 0
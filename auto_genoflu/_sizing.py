@@ -0,0 +1,285 @@
+import os
+import re
+import math
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from auto_genoflu._rename import count_fasta_records
+from auto_genoflu._provenance import load_provenance, use_provenance_journal, get_journal, PROVENANCE_SUFFIX
+from auto_genoflu._state import stat_key
+from auto_genoflu._logging import StructuredMessage
+
+DEFAULT_SIZING_PARAMS = {
+    "sizing_safety_margin": 1.5,
+    "sizing_min_history": 5,
+    "sizing_overhead_seconds": 60,
+    "min_mem": "1G",
+    "max_mem": "32G",
+    "min_time": "00:05:00",
+    "max_time": "04:00:00",
+}
+
+# Requests are rounded up to these steps so tasks share as few distinct arrays as possible
+MEM_STEPS_MB = [512 * 2 ** i for i in range(12)]
+TIME_STEPS_SECONDS = [m * 60 for m in (5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 240, 360, 480, 720, 1440)]
+
+
+def parse_mem_mb(mem: str) -> int:
+    """Parse a Slurm memory string such as '4G', '512M' or '4000' (MB) into MB."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*", str(mem), flags=re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Invalid memory value: {mem}")
+    factor = {"K": 1 / 1024, "": 1, "M": 1, "G": 1024, "T": 1024 * 1024}[match.group(2).upper()]
+    return int(math.ceil(float(match.group(1)) * factor))
+
+
+def format_mem(mem_mb: int) -> str:
+    return f"{mem_mb // 1024}G" if mem_mb % 1024 == 0 else f"{mem_mb}M"
+
+
+def parse_time_seconds(value: str) -> int:
+    """Parse a Slurm time string ('MM', 'MM:SS', 'HH:MM:SS' or 'D-HH:MM:SS') into seconds."""
+    value = str(value).strip()
+    days = 0
+    if "-" in value:
+        day_part, value = value.split("-", 1)
+        days = int(day_part)
+    fields = [int(x) for x in value.split(":")]
+    if len(fields) == 1:
+        seconds = fields[0] * 60
+    elif len(fields) == 2:
+        seconds = fields[0] * 60 + fields[1]
+    else:
+        seconds = fields[0] * 3600 + fields[1] * 60 + fields[2]
+    return days * 86400 + seconds
+
+
+def format_time(seconds: int) -> str:
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def _round_up(value: float, steps: List[int]) -> int:
+    for step in steps:
+        if value <= step:
+            return step
+    return steps[-1]
+
+
+def size_bucket(input_size_bytes: int) -> int:
+    """Inputs are grouped into power-of-two size buckets."""
+    return int(math.log2(max(1, input_size_bytes)))
+
+
+def _has_resources(record: Optional[dict]) -> bool:
+    return record is not None and record.get("runtime_seconds") is not None and record.get("peak_rss_kb") is not None
+
+
+def load_resource_history(config: dict) -> List[dict]:
+    """Provenance records that include measured runtime and peak RSS.
+
+    Runs in a GenoFLU session record no peak RSS where the platform can't measure
+    it per run, and are left out rather than skew the memory estimates.
+    """
+    return [record for record in load_provenance(config).values() if _has_resources(record)]
+
+
+class SizingModel:
+    """Per-sample runtime and memory estimates, keyed on (segment count, input size bucket).
+
+    Each key uses the 95th percentile runtime and the maximum peak RSS seen for it.
+    Keys with too little history fall back to the nearest size bucket with the same
+    segment count, then to all history.
+    """
+
+    def __init__(self, records: List[dict], min_history: int):
+        self.min_history = min_history
+        self.file_estimates: Dict[str, Optional[Tuple[float, float]]] = {}
+        self.estimates: Dict[Tuple[int, int], Tuple[float, float]] = {}
+        self.overall = None
+
+        if len(records) == 0:
+            return
+
+        df = pd.DataFrame({
+            "segment_count": [r.get("segment_count") or 0 for r in records],
+            "bucket": [size_bucket(r.get("input_size_bytes") or 0) for r in records],
+            "runtime_seconds": [float(r["runtime_seconds"]) for r in records],
+            "peak_rss_mb": [float(r["peak_rss_kb"]) / 1024 for r in records],
+        })
+
+        grouped = df.groupby(["segment_count", "bucket"]).agg(
+            n=("runtime_seconds", "size"),
+            runtime_seconds=("runtime_seconds", lambda x: x.quantile(0.95)),
+            peak_rss_mb=("peak_rss_mb", "max"),
+        )
+        for (segment_count, bucket), row in grouped.iterrows():
+            if row["n"] >= min_history:
+                self.estimates[(int(segment_count), int(bucket))] = (float(row["runtime_seconds"]), float(row["peak_rss_mb"]))
+
+        if len(df) >= min_history:
+            self.overall = (float(df["runtime_seconds"].quantile(0.95)), float(df["peak_rss_mb"].max()))
+
+    def estimate(self, segment_count: int, input_size_bytes: int) -> Optional[Tuple[float, float]]:
+        """Estimated (runtime_seconds, peak_rss_mb) for one sample, or None without enough history."""
+        bucket = size_bucket(input_size_bytes)
+        if (segment_count, bucket) in self.estimates:
+            return self.estimates[(segment_count, bucket)]
+
+        same_segments = [key for key in self.estimates if key[0] == segment_count]
+        if same_segments:
+            nearest = min(same_segments, key=lambda key: abs(key[1] - bucket))
+            return self.estimates[nearest]
+
+        return self.overall
+
+    def estimate_file(self, fasta_file: str) -> Optional[Tuple[float, float]]:
+        if fasta_file not in self.file_estimates:
+            self.file_estimates[fasta_file] = self.estimate(count_fasta_records(fasta_file), os.path.getsize(fasta_file))
+        return self.file_estimates[fasta_file]
+
+
+class ResourceHistory:
+    """Resource history and sizing model, kept between cycles.
+
+    Per-sample provenance files are keyed on their path and (size, mtime_ns, inode),
+    so only new or changed files are read, and records of removed files are dropped;
+    the journal backend already reads only the lines appended since the last load.
+    The model is only rebuilt when the history changed.
+    """
+
+    def __init__(self):
+        self.source = None
+        self.files: Dict[str, Tuple[Tuple[int, int, int], Optional[dict]]] = {}
+        self.model_key = None
+        self.model: Optional[SizingModel] = None
+
+    def update(self, config: dict) -> tuple:
+        """Bring the history up to date with the provenance, returning a fingerprint of it."""
+        if use_provenance_journal(config):
+            journal = get_journal(config)
+            journal.load()
+            self.source, self.files = journal.path, {}
+            return ("journal", journal.path, journal.inode, journal.offset)
+
+        provenance_dir = config['provenance_dir']
+        if self.source != provenance_dir:
+            self.source, self.files = provenance_dir, {}
+
+        current = {}
+        try:
+            with os.scandir(provenance_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith(PROVENANCE_SUFFIX):
+                        try:
+                            current[entry.path] = stat_key(entry.stat())
+                        except FileNotFoundError:
+                            pass
+        except FileNotFoundError:
+            pass
+
+        changed = [path for path, key in current.items() if path not in self.files or self.files[path][0] != key]
+        records = load_provenance(config, [os.path.basename(path)[:-len(PROVENANCE_SUFFIX)] for path in changed])
+        for path in changed:
+            self.files[path] = (current[path], records.get(os.path.basename(path)[:-len(PROVENANCE_SUFFIX)]))
+        for path in self.files.keys() - current.keys():
+            del self.files[path]
+
+        logging.debug(StructuredMessage({"event_type": "resource_history_updated", "files_read": len(changed), "files_cached": len(self.files)}))
+
+        return ("json", provenance_dir, tuple(sorted(current.items())))
+
+    def records(self, config: dict) -> List[dict]:
+        if use_provenance_journal(config):
+            return load_resource_history(config)
+        return [record for _, record in self.files.values() if _has_resources(record)]
+
+
+def get_sizing_params(config: dict) -> dict:
+    return {**DEFAULT_SIZING_PARAMS, **config.get('slurm_params', {})}
+
+
+_RESOURCE_HISTORY = ResourceHistory()
+
+
+def build_sizing_model(config: dict) -> SizingModel:
+    """The sizing model for this cycle, rebuilt only when the resource history changed."""
+    params = get_sizing_params(config)
+    min_history = int(params['sizing_min_history'])
+    model_key = (_RESOURCE_HISTORY.update(config), min_history)
+
+    if _RESOURCE_HISTORY.model is not None and _RESOURCE_HISTORY.model_key == model_key:
+        # inputs may have changed since the last cycle
+        _RESOURCE_HISTORY.model.file_estimates = {}
+        logging.debug(StructuredMessage({"event_type": "sizing_model_reused", "keys_estimated": len(_RESOURCE_HISTORY.model.estimates)}))
+        return _RESOURCE_HISTORY.model
+
+    records = _RESOURCE_HISTORY.records(config)
+    model = SizingModel(records, min_history)
+    _RESOURCE_HISTORY.model, _RESOURCE_HISTORY.model_key = model, model_key
+
+    logging.info(StructuredMessage({"event_type": "sizing_model_built", "history_records": len(records), "keys_estimated": len(model.estimates)}))
+
+    return model
+
+
+def size_task(fasta_files: List[str], config: dict, model: SizingModel) -> Tuple[str, str]:
+    """Choose (mem, time) for one array task running fasta_files one after another.
+
+    Uses the summed estimated runtime and the largest estimated peak RSS, times
+    the safety margin, clamped to [min, max] and rounded up to standard steps.
+    Samples without an estimate fall back to the static `mem`/`time`.
+    """
+    params = get_sizing_params(config)
+    margin = float(params['sizing_safety_margin'])
+    static_mem_mb = parse_mem_mb(params.get("mem", "4G"))
+    static_seconds = parse_time_seconds(params.get("time", "01:00:00"))
+
+    total_seconds = float(params['sizing_overhead_seconds'])
+    mem_mb = 0.0
+    for fasta_file in fasta_files:
+        estimate = model.estimate_file(fasta_file)
+        if estimate is None:
+            return format_mem(static_mem_mb), format_time(static_seconds)
+        total_seconds += estimate[0] * margin
+        mem_mb = max(mem_mb, estimate[1] * margin)
+
+    min_mem, max_mem = parse_mem_mb(params['min_mem']), parse_mem_mb(params['max_mem'])
+    min_time, max_time = parse_time_seconds(params['min_time']), parse_time_seconds(params['max_time'])
+
+    mem_mb = min(max_mem, max(min_mem, _round_up(mem_mb, MEM_STEPS_MB)))
+    seconds = min(max_time, max(min_time, _round_up(total_seconds, TIME_STEPS_SECONDS)))
+
+    return format_mem(mem_mb), format_time(seconds)
+
+
+def resource_report(config: dict) -> pd.DataFrame:
+    """Requested versus used resources for every Slurm task with recorded history.
+
+    Samples packed into one task share its request: their runtimes are summed and
+    their peak RSS is the maximum.
+    """
+    records = [r for r in load_resource_history(config) if r.get("slurm_job_id")]
+    if len(records) == 0:
+        return pd.DataFrame()
+
+    df = pd.DataFrame({
+        "slurm_job_id": [r["slurm_job_id"] for r in records],
+        "requested_mem_mb": [parse_mem_mb(r["slurm_requested_mem"]) for r in records],
+        "requested_time_seconds": [parse_time_seconds(r["slurm_requested_time"]) for r in records],
+        "runtime_seconds": [float(r["runtime_seconds"]) for r in records],
+        "peak_rss_mb": [float(r["peak_rss_kb"]) / 1024 for r in records],
+    })
+
+    report = df.groupby("slurm_job_id").agg(
+        n_samples=("runtime_seconds", "size"),
+        requested_mem_mb=("requested_mem_mb", "max"),
+        peak_rss_mb=("peak_rss_mb", "max"),
+        requested_time_seconds=("requested_time_seconds", "max"),
+        runtime_seconds=("runtime_seconds", "sum"),
+    ).reset_index()
+    report["mem_utilisation"] = (report["peak_rss_mb"] / report["requested_mem_mb"]).round(3)
+    report["time_utilisation"] = (report["runtime_seconds"] / report["requested_time_seconds"]).round(3)
+
+    return report
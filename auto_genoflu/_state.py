@@ -0,0 +1,159 @@
+import os
+import sqlite3
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from auto_genoflu._hashing import hash_files
+from auto_genoflu._metrics import stage_timer, FILES_HASHED
+from auto_genoflu._logging import StructuredMessage
+
+STATE_INDEX_FILENAME = "auto_genoflu_state.sqlite"
+# Paths per `WHERE path IN (...)` lookup, under SQLite's default limit of 999 bound parameters
+LOOKUP_CHUNK_SIZE = 500
+
+
+def get_state_index_path(config: dict) -> str:
+    """Location of the persistent state index.
+
+    Defaults to the work directory, which is always local (never on Nextcloud),
+    since SQLite does not behave well inside synced folders.
+    """
+    return config.get('state_index_path', os.path.join(config['work_dir'], STATE_INDEX_FILENAME))
+
+
+def open_state_index(config: dict) -> sqlite3.Connection:
+    """Open (and create if needed) the SQLite state index."""
+    index_path = get_state_index_path(config)
+    index_dir = os.path.dirname(index_path)
+    if index_dir:
+        os.makedirs(index_dir, exist_ok=True)
+
+    conn = sqlite3.connect(index_path, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS file_hashes ("
+        " path TEXT PRIMARY KEY,"
+        " size INTEGER NOT NULL,"
+        " mtime_ns INTEGER NOT NULL,"
+        " inode INTEGER NOT NULL,"
+        " hash TEXT NOT NULL)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS inflight_jobs ("
+        " sample_name TEXT PRIMARY KEY,"
+        " input_file TEXT NOT NULL,"
+        " job_id TEXT NOT NULL,"
+        " submitted_at REAL NOT NULL)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS failures ("
+        " sample_name TEXT PRIMARY KEY,"
+        " input_file TEXT NOT NULL,"
+        " input_hash TEXT NOT NULL,"
+        " failure_class TEXT NOT NULL,"
+        " attempts INTEGER NOT NULL,"
+        " first_failed_at REAL NOT NULL,"
+        " last_failed_at REAL NOT NULL,"
+        " retry_after REAL NOT NULL,"
+        " quarantined INTEGER NOT NULL,"
+        " error TEXT)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS work_queue ("
+        " sample_name TEXT PRIMARY KEY,"
+        " work_class TEXT NOT NULL,"
+        " enqueued_at REAL NOT NULL)"
+    )
+    conn.commit()
+
+    logging.debug(StructuredMessage({"event_type": "state_index_opened", "state_index_path": index_path}))
+
+    return conn
+
+
+def stat_key(stat_result: os.stat_result) -> Tuple[int, int, int]:
+    """The tuple used to decide whether a file has changed since it was last hashed."""
+    return (stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino)
+
+
+def _indexed_entries(conn: sqlite3.Connection, file_paths: Optional[List[str]] = None) -> Dict[str, Tuple[Tuple[int, int, int], str]]:
+    """Index entries as path -> ((size, mtime_ns, inode), hash), for file_paths only, or every entry if None."""
+    query = "SELECT path, size, mtime_ns, inode, hash FROM file_hashes"
+    if file_paths is None:
+        return {row[0]: (tuple(row[1:4]), row[4]) for row in conn.execute(query)}
+
+    indexed = {}
+    for i in range(0, len(file_paths), LOOKUP_CHUNK_SIZE):
+        chunk = file_paths[i:i + LOOKUP_CHUNK_SIZE]
+        for row in conn.execute(f"{query} WHERE path IN ({', '.join('?' * len(chunk))})", chunk):
+            indexed[row[0]] = (tuple(row[1:4]), row[4])
+    return indexed
+
+
+def get_file_hashes(conn: sqlite3.Connection, file_paths: Iterable[str], verify_all: bool = False, prune: bool = False, max_workers: Optional[int] = None,
+                    stats: Optional[Dict[str, os.stat_result]] = None) -> Dict[str, str]:
+    """Return the hash of every file in file_paths, only rehashing files whose
+    (size, mtime_ns, inode) changed since the last time they were indexed.
+
+    Args:
+        conn: Open state index connection
+        file_paths: Paths of the files to hash
+        verify_all: If True, ignore the index and rehash every file
+        prune: If True, drop index entries for paths not in file_paths
+        max_workers: Maximum number of hashing threads used for changed files
+        stats: Stat results already collected by the scan, so those files aren't stat'ed again
+
+    Returns:
+        Dictionary mapping each path to its hash
+    """
+    file_paths = list(dict.fromkeys(file_paths))
+    # Only a pruning (full) scan needs the whole index; otherwise look up just the requested paths
+    indexed = _indexed_entries(conn, None if prune else file_paths)
+
+    if stats is None:
+        stats = {}
+
+    hashes = {}
+    changed_keys = {}
+    for file_path in file_paths:
+        # stat before hashing, so a write that races with the hash is picked up next scan
+        stat_result = stats.get(file_path)
+        current_key = stat_key(stat_result if stat_result is not None else os.stat(file_path))
+        cached = indexed.get(file_path)
+
+        if not verify_all and cached is not None and cached[0] == current_key:
+            hashes[file_path] = cached[1]
+        else:
+            changed_keys[file_path] = current_key
+
+    # Hash every changed file in one parallel batch
+    with stage_timer("hash"):
+        new_hashes = hash_files(changed_keys.keys(), max_workers=max_workers)
+    FILES_HASHED.inc(len(new_hashes))
+    hashes.update(new_hashes)
+    updates = [(file_path, *changed_keys[file_path], file_hash) for file_path, file_hash in new_hashes.items()]
+
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, inode, hash) VALUES (?, ?, ?, ?, ?)", updates)
+        if prune:
+            stale_paths = set(indexed.keys()) - set(file_paths)
+            conn.executemany("DELETE FROM file_hashes WHERE path = ?", [(p,) for p in stale_paths])
+
+    logging.debug(StructuredMessage({"event_type": "state_index_hashes_resolved", "files_checked": len(file_paths), "files_rehashed": len(updates), "verify_all": verify_all}))
+
+    return hashes
+
+
+def record_inflight_jobs(conn: sqlite3.Connection, jobs: Iterable[Tuple[str, str, str, float]]) -> None:
+    """Record submitted samples as (sample_name, input_file, job_id, submitted_at)."""
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO inflight_jobs (sample_name, input_file, job_id, submitted_at) VALUES (?, ?, ?, ?)", jobs)
+
+
+def list_inflight_jobs(conn: sqlite3.Connection) -> List[Tuple[str, str, str, float]]:
+    """All in-flight samples as (sample_name, input_file, job_id, submitted_at)."""
+    return conn.execute("SELECT sample_name, input_file, job_id, submitted_at FROM inflight_jobs ORDER BY submitted_at").fetchall()
+
+
+def remove_inflight_jobs(conn: sqlite3.Connection, sample_names: Iterable[str]) -> None:
+    with conn:
+        conn.executemany("DELETE FROM inflight_jobs WHERE sample_name = ?", [(name,) for name in sample_names])
@@ -0,0 +1,198 @@
+import os
+import re
+import logging
+import warnings
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from auto_genoflu._state import stat_key
+from auto_genoflu._logging import StructuredMessage
+
+
+class SummaryCache:
+    """Parsed per-sample GenoFLU results, kept between summary builds.
+
+    Each output TSV is keyed on its path and (size, mtime_ns, inode), so only new
+    or changed outputs are parsed, and rows for removed outputs are dropped.
+    """
+
+    def __init__(self):
+        self.frames: Dict[str, Tuple[Tuple[int, int, int], pd.DataFrame]] = {}
+        self.last_written_state = None
+
+    def update(self, input_files: List[str]) -> None:
+        """Parse new or changed outputs and drop removed ones."""
+        parsed = 0
+        for file_path in input_files:
+            current_key = stat_key(os.stat(file_path))
+            cached = self.frames.get(file_path)
+            if cached is None or cached[0] != current_key:
+                self.frames[file_path] = (current_key, pd.read_csv(file_path, sep='\t'))
+                parsed += 1
+
+        removed = set(self.frames.keys()) - set(input_files)
+        for file_path in removed:
+            del self.frames[file_path]
+
+        logging.debug(StructuredMessage({"event_type": "summary_cache_updated", "files_parsed": parsed, "files_removed": len(removed), "files_cached": len(self.frames)}))
+
+    def state(self, input_files: List[str]) -> tuple:
+        """Fingerprint of the cached inputs, in the order they will be combined."""
+        return tuple((file_path, self.frames[file_path][0]) for file_path in input_files)
+
+    def months(self, input_files: List[str]) -> np.ndarray:
+        """'YYYY-MM' month each output was written, for every row of `collect_df(input_files)`."""
+        months = [datetime.fromtimestamp(self.frames[file_path][0][1] / 1e9).strftime('%Y-%m') for file_path in input_files]
+        lengths = [len(self.frames[file_path][1]) for file_path in input_files]
+        return np.repeat(np.array(months, dtype=object), lengths)
+
+    def collect_df(self, input_files: List[str]) -> pd.DataFrame:
+        """Same result as `collect_df(input_files)`, served from the cache."""
+        if len(input_files) < 1:
+            logging.warning(StructuredMessage({"event_type": "collect_df_no_input_files", "input_files": input_files}))
+            return pd.DataFrame()
+
+        combined_df = pd.concat([self.frames[file_path][1] for file_path in input_files], ignore_index=True)
+
+        logging.info(StructuredMessage({"event_type": "collect_df_complete"}))
+
+        return combined_df
+
+
+CONFIDENCE_BINS = [0, 90, 95, 98, 100]
+CONFIDENCE_LEVELS = ['sub90', '90', '95', '98']
+# The ":value" part of "SEG:value" entries, and the "SEG:" part
+_SEGMENT_VALUES = re.compile(r":[^,]*")
+_SEGMENT_PREFIXES = re.compile(r"[^,:]*:")
+
+
+def _join_lists(lists: pd.Series) -> Tuple[np.ndarray, str]:
+    """Join a column of comma-separated lists into one comma-separated string.
+
+    Returns:
+        (number of entries in each list, joined string)
+    """
+    text = "\n".join(lists)
+    buffer = np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+    commas = np.flatnonzero(buffer == ord(","))
+    row_ends = np.append(np.flatnonzero(buffer == ord("\n")), len(buffer))
+    counts = np.diff(np.searchsorted(commas, row_ends), prepend=0) + 1
+    return counts, text.replace("\n", ",")
+
+
+def _segment_names(joined: str) -> np.ndarray:
+    """Segment of every "SEG:value" entry of a joined list."""
+    return np.array(_SEGMENT_VALUES.sub("", joined.replace(", ", ",")).strip().split(","), dtype=object)
+
+
+def _parse_floats(joined: str, expected: int) -> np.ndarray:
+    """Parse a comma-separated string of numbers, with NaN for entries that aren't numbers."""
+    # fromstring reads empty entries as -1 rather than failing, so those take the slow path
+    compact = joined.replace(" ", "")
+    if ",," not in compact and not compact.startswith(",") and not compact.endswith(","):
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", DeprecationWarning)
+                values = np.fromstring(joined, sep=",")
+            if len(values) == expected:
+                return values
+        except ValueError:
+            pass
+    return pd.to_numeric(pd.Series(joined.split(",")).str.strip(), errors="coerce").to_numpy(dtype=float)
+
+
+def _segment_list_column(df: pd.DataFrame) -> Optional[str]:
+    """The "Genotype List Used, >=<threshold>%" column, which names the segment behind each percent match."""
+    for column in df.columns:
+        if str(column).startswith("Genotype List Used"):
+            return column
+    return None
+
+
+def _parse_percent_lists(df: pd.DataFrame, with_segments: bool) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+    """Parse every 'Genotype Percent Match List' at once.
+
+    Returns:
+        (positions of the rows with a list, number of entries in each, segment of
+        every entry (empty without with_segments), percent of every entry), or None
+        if no row has a list
+    """
+    if 'Genotype Percent Match List' not in df.columns:
+        return None
+
+    lists = df['Genotype Percent Match List'].to_numpy(dtype=object)
+    rows = np.flatnonzero(pd.notna(lists))
+    if len(rows) == 0:
+        return None
+
+    counts, joined = _join_lists(pd.Series(lists[rows]).astype(str))
+    joined = joined.replace("%", "")
+    total = int(counts.sum())
+
+    segments = np.full(total if with_segments else 0, None, dtype=object)
+    if ":" in joined:
+        if with_segments and joined.count(":") == total:
+            segments = _segment_names(joined)
+        joined = _SEGMENT_PREFIXES.sub("", joined)
+
+    segment_column = _segment_list_column(df)
+    if with_segments and segment_column is not None and pd.isna(segments).all():
+        used = pd.Series(df[segment_column].to_numpy(dtype=object)[rows]).fillna("").astype(str)
+        used_counts, used_joined = _join_lists(used)
+        # only lists whose every entry is "SEG:genotype", with as many entries as the percent list, are used
+        if used_joined.count(":") == used_counts.sum():
+            used_segments = _segment_names(used_joined)
+            aligned = used_counts == counts
+            segments[np.repeat(aligned, counts)] = used_segments[np.repeat(aligned, used_counts)]
+    if with_segments:
+        segments[segments == ""] = None
+
+    return rows, counts, segments, _parse_floats(joined, total)
+
+
+def parse_percent_matches(df: pd.DataFrame) -> pd.DataFrame:
+    """Split every 'Genotype Percent Match List' into one row per segment.
+
+    The whole column is joined into one string and parsed in bulk by NumPy, with
+    no Python callback per row. Segments come from a "SEG:" prefix on the entries
+    if GenoFLU wrote them, and otherwise from the entry at the same position of
+    the "Genotype List Used" column.
+
+    Returns:
+        DataFrame with columns row (position of the sample's row in df), segment and percent
+    """
+    parsed = _parse_percent_lists(df, with_segments=True)
+    if parsed is None:
+        return pd.DataFrame({"row": pd.Series(dtype=int), "segment": pd.Series(dtype=object), "percent": pd.Series(dtype=float)})
+
+    rows, counts, segments, percents = parsed
+    return pd.DataFrame({"row": np.repeat(rows, counts), "segment": segments, "percent": percents})
+
+
+def add_confidence_column(df: pd.DataFrame) -> pd.DataFrame:
+    """Add a Confidence column based on Genotype Percent Match List values.
+    
+    Args:
+        df: DataFrame containing the 'Genotype Percent Match List' column
+        
+    Returns:
+        DataFrame with added 'Confidence' column
+    """
+    logging.debug(StructuredMessage({"event_type": "add_confidence_column_start"}))
+
+    min_percent = np.full(len(df), np.nan)
+    parsed = _parse_percent_lists(df, with_segments=False)
+    if parsed is not None:
+        rows, counts, _, percents = parsed
+        # every list has at least one entry, so each row's entries start where the previous row's end;
+        # an entry that doesn't parse makes its row NaN rather than being skipped
+        min_percent[rows] = np.minimum.reduceat(percents, np.cumsum(counts) - counts)
+    df['Min Percent Match'] = min_percent
+    df['Confidence Level'] = pd.cut(df['Min Percent Match'], bins=CONFIDENCE_BINS, labels=CONFIDENCE_LEVELS)
+    
+    logging.info(StructuredMessage({"event_type": "add_confidence_column_complete"}))
+    
+    return df
@@ -0,0 +1,111 @@
+import os
+import logging
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from auto_genoflu._logging import StructuredMessage
+from auto_genoflu._summary import parse_percent_matches
+from auto_genoflu.operations import move_file
+
+IDENTITY_BINS = [0, 90, 95, 98, 99, 99.5, 100]
+IDENTITY_BIN_LABELS = ['<=90', '90-95', '95-98', '98-99', '99-99.5', '99.5-100']
+AGGREGATE_TABLES = ["genotype_counts", "segment_identity", "below_threshold"]
+
+
+def use_summary_aggregates(config: dict) -> bool:
+    return config.get('use_summary_aggregates', False)
+
+
+class SummaryAggregates:
+    """Small precomputed tables over the summary, built up batch by batch.
+
+    - genotype_counts: samples per month and genotype
+    - segment_identity: per segment, samples in each percent identity band
+    - below_threshold: samples whose lowest segment identity is below id_threshold
+      (or unknown), with the segments responsible
+
+    Counts are additive across batches, so the summary can be fed in row groups
+    without holding all of it.
+    """
+
+    def __init__(self, id_threshold: float = 98.0):
+        self.id_threshold = float(id_threshold)
+        self.genotype_counts: List[pd.Series] = []
+        self.segment_identity: List[pd.Series] = []
+        self.below_threshold: List[pd.DataFrame] = []
+        self.rows = 0
+        self.batches = 0
+
+    def add(self, df: pd.DataFrame, months: np.ndarray) -> None:
+        """Add a batch of summary rows that already went through `add_confidence_column`.
+
+        Args:
+            df: Summary rows
+            months: 'YYYY-MM' month of each row
+        """
+        df = df.reset_index(drop=True)
+        genotypes = df['Genotype'].fillna("") if 'Genotype' in df.columns else pd.Series("", index=df.index)
+        months = pd.Series(np.asarray(months, dtype=object), index=df.index)
+        self.genotype_counts.append(pd.DataFrame({"month": months, "genotype": genotypes}).groupby(["month", "genotype"]).size())
+
+        matches = parse_percent_matches(df)
+        bands = pd.cut(matches['percent'], bins=IDENTITY_BINS, labels=IDENTITY_BIN_LABELS)
+        self.segment_identity.append(pd.DataFrame({"segment": matches['segment'].fillna("unknown"), "identity_bin": bands})
+                                     .groupby(["segment", "identity_bin"], observed=True).size())
+
+        below = df['Min Percent Match'].isna() | (df['Min Percent Match'] < self.id_threshold)
+        if below.any():
+            low_matches = matches[matches['percent'] < self.id_threshold].dropna(subset=["segment"])
+            segments_below = low_matches.groupby("row")['segment'].agg(", ".join)
+            strains = df['Strain'] if 'Strain' in df.columns else pd.Series(None, index=df.index, dtype=object)
+            self.below_threshold.append(pd.DataFrame({
+                "month": months[below],
+                "strain": strains[below],
+                "genotype": genotypes[below],
+                "min_percent_match": df.loc[below, 'Min Percent Match'],
+                "confidence_level": df.loc[below, 'Confidence Level'].astype(object),
+                "segments_below_threshold": segments_below.reindex(df.index[below]).fillna(""),
+            }))
+
+        self.rows += len(df)
+        self.batches += 1
+
+    def tables(self) -> Dict[str, pd.DataFrame]:
+        genotype_counts = pd.DataFrame(columns=["month", "genotype", "samples"])
+        if self.genotype_counts:
+            genotype_counts = pd.concat(self.genotype_counts).groupby(level=[0, 1]).sum().rename("samples").reset_index()
+
+        segment_identity = pd.DataFrame(columns=["segment", "identity_bin", "samples"])
+        if self.segment_identity:
+            segment_identity = (pd.concat(self.segment_identity).groupby(level=[0, 1], observed=True).sum()
+                                .rename("samples").reset_index().astype({"identity_bin": object}))
+
+        below_threshold = pd.DataFrame(columns=["month", "strain", "genotype", "min_percent_match", "confidence_level", "segments_below_threshold"])
+        if self.below_threshold:
+            below_threshold = pd.concat(self.below_threshold, ignore_index=True).sort_values(["month", "strain"], kind="stable")
+
+        return {"genotype_counts": genotype_counts, "segment_identity": segment_identity, "below_threshold": below_threshold}
+
+
+def write_summary_aggregates(config: dict, aggregates: SummaryAggregates, timestamp: str) -> List[str]:
+    """Write each aggregate table to summary_dir as `GenoFLU_<table>_<timestamp>.tsv`.
+
+    Returns:
+        Paths of the tables in summary_dir
+    """
+    written = []
+    for name, table in aggregates.tables().items():
+        file_name = f"GenoFLU_{name}_{timestamp}.tsv"
+        tmp_file = os.path.join(config['work_dir'], file_name)
+        output_file = os.path.join(config['summary_dir'], file_name)
+
+        table.to_csv(tmp_file, sep='\t', index=False)
+        move_file(tmp_file, output_file, use_nextcloud=config.get('use_nextcloud', False))
+        os.remove(tmp_file)
+        written.append(output_file)
+
+    logging.info(StructuredMessage({"event_type": "summary_aggregates_written", "tables": AGGREGATE_TABLES, "rows_aggregated": aggregates.rows, "output_dir": config['summary_dir']}))
+
+    return written
@@ -0,0 +1,198 @@
+import os
+import csv
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:  # the columnar summary is optional, the TSV summary works without pyarrow
+    pa = None
+
+from auto_genoflu._logging import StructuredMessage
+from auto_genoflu._state import stat_key
+from auto_genoflu._summary import add_confidence_column
+from auto_genoflu._summary_analytics import SummaryAggregates
+from auto_genoflu.operations import make_folder, move_file
+
+DEFAULT_ROW_GROUP_SIZE = 10000
+CONFIDENCE_LEVELS = ['sub90', '90', '95', '98']
+PARTITION_COLUMN = "analysis_month"
+FILE_EXTENSIONS = {"parquet": "parquet", "arrow": "arrow"}
+
+# Fingerprint of the outputs behind the last dataset written, per summary_dir
+_last_written_state: Dict[str, tuple] = {}
+
+
+def use_columnar_summary(config: dict) -> bool:
+    return config.get('use_columnar_summary', False)
+
+
+def summary_columns(input_files: Iterable[str]) -> List[str]:
+    """Union of the columns of every output, in order of first appearance, reading only the headers."""
+    columns = {}
+    for file_path in input_files:
+        with open(file_path, "r") as f:
+            for column in f.readline().rstrip("\r\n").split("\t"):
+                columns.setdefault(column, None)
+    return list(columns)
+
+
+def summary_schema(columns: List[str]) -> "pa.Schema":
+    """Every GenoFLU column as a string, so a column's type can't change with its contents,
+    plus the derived confidence columns."""
+    fields = [pa.field(column, pa.string()) for column in columns if column not in ('Min Percent Match', 'Confidence Level')]
+    fields.append(pa.field('Min Percent Match', pa.float64()))
+    fields.append(pa.field('Confidence Level', pa.dictionary(pa.int8(), pa.string(), ordered=True)))
+    return pa.schema(fields)
+
+
+def _read_output(file_path: str) -> List[Dict[str, Optional[str]]]:
+    """Rows of one output as dicts of raw strings, with empty cells as None."""
+    with open(file_path, "r", newline="") as f:
+        reader = csv.reader(f, delimiter="\t")
+        header = next(reader, [])
+        return [{column: value if value != "" else None for column, value in zip(header, row)} for row in reader]
+
+
+def _to_table(rows: List[Dict[str, Optional[str]]], schema: "pa.Schema", months: List[str], aggregates: Optional[SummaryAggregates]) -> "pa.Table":
+    columns = [name for name in schema.names if name not in ('Min Percent Match', 'Confidence Level')]
+    batch = pd.DataFrame.from_records(rows, columns=columns)
+    batch = add_confidence_column(batch)
+    if aggregates is not None:
+        aggregates.add(batch, months)
+    batch['Confidence Level'] = pd.Categorical(batch['Confidence Level'], categories=CONFIDENCE_LEVELS, ordered=True)
+    return pa.Table.from_pandas(batch, schema=schema, preserve_index=False)
+
+
+class _DatasetFileWriter:
+    """Writes row groups (Parquet) or record batches (Arrow IPC) to one file."""
+
+    def __init__(self, path: str, schema: "pa.Schema", file_format: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if file_format == "parquet":
+            self.writer = pq.ParquetWriter(path, schema)
+        else:
+            self.writer = ipc.new_file(path, schema)
+        self.path = path
+        self.file_format = file_format
+
+    def write(self, table: "pa.Table") -> None:
+        if self.file_format == "parquet":
+            self.writer.write_table(table, row_group_size=table.num_rows)
+        else:
+            self.writer.write_table(table, max_chunksize=table.num_rows)
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+def write_summary_dataset(input_files: List[str], out_path: str, file_format: str = "parquet", row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+                          partition_by_month: bool = False, file_stats: Optional[Dict[str, os.stat_result]] = None,
+                          aggregates: Optional[SummaryAggregates] = None) -> List[str]:
+    """Stream per-sample outputs into a Parquet or Arrow IPC dataset.
+
+    Outputs are read one at a time and written in row groups of at most
+    row_group_size rows, so memory use depends on the row group size rather than
+    the number of samples. With partition_by_month, rows are split by the month
+    their output was written into `<out_path>/analysis_month=YYYY-MM/part-0.<ext>`;
+    otherwise out_path is a single file. Each row group is also added to aggregates, if given.
+
+    Returns:
+        Paths of the files written
+    """
+    if pa is None:
+        raise ImportError("pyarrow is required for the columnar summary")
+
+    schema = summary_schema(summary_columns(input_files))
+    extension = FILE_EXTENSIONS[file_format]
+    writers: Dict[str, _DatasetFileWriter] = {}
+    pending: Dict[str, List[Dict[str, Optional[str]]]] = defaultdict(list)
+    pending_months: Dict[str, List[str]] = defaultdict(list)
+
+    def flush(partition: str) -> None:
+        if not pending[partition]:
+            return
+        if partition not in writers:
+            path = os.path.join(out_path, f"{PARTITION_COLUMN}={partition}", f"part-0.{extension}") if partition_by_month else out_path
+            writers[partition] = _DatasetFileWriter(path, schema, file_format)
+        writers[partition].write(_to_table(pending[partition], schema, pending_months[partition], aggregates))
+        pending[partition] = []
+        pending_months[partition] = []
+
+    try:
+        for file_path in input_files:
+            stat_result = (file_stats or {}).get(file_path) or os.stat(file_path)
+            month = datetime.fromtimestamp(stat_result.st_mtime).strftime('%Y-%m')
+            partition = month if partition_by_month else ""
+
+            rows = _read_output(file_path)
+            pending[partition].extend(rows)
+            pending_months[partition].extend([month] * len(rows))
+            if len(pending[partition]) >= row_group_size:
+                flush(partition)
+
+        for partition in list(pending):
+            flush(partition)
+
+        # an empty dataset still gets a file, so readers see the schema
+        if not writers and not partition_by_month:
+            writers[""] = _DatasetFileWriter(out_path, schema, file_format)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    return sorted(writer.path for writer in writers.values())
+
+
+def make_summary_dataset(config: dict, input_files: List[str], timestamp: str, aggregates: Optional[SummaryAggregates] = None) -> Optional[str]:
+    """Write the columnar summary for this cycle to summary_dir, unless no output changed since the last one.
+    Rows are also added to aggregates, if given.
+
+    Returns:
+        Path of the dataset in summary_dir, or None if nothing was written or
+        moving any of its files failed
+    """
+    file_format = config.get('columnar_summary_format', "parquet")
+    partition_by_month = config.get('columnar_summary_partition_by_month', False)
+    row_group_size = int(config.get('columnar_summary_row_group_size', DEFAULT_ROW_GROUP_SIZE))
+
+    file_stats = {file_path: os.stat(file_path) for file_path in input_files}
+    state = (file_format, partition_by_month, tuple((file_path, stat_key(file_stats[file_path])) for file_path in input_files))
+    if input_files and _last_written_state.get(config['summary_dir']) == state:
+        logging.info(StructuredMessage({"event_type": "summary_dataset_unchanged", "input_files_count": len(input_files)}))
+        return None
+
+    dataset_name = f"GenoFLU_summary_{timestamp}" if partition_by_month else f"GenoFLU_summary_{timestamp}.{FILE_EXTENSIONS[file_format]}"
+    tmp_path = os.path.join(config['work_dir'], dataset_name)
+    output_path = os.path.join(config['summary_dir'], dataset_name)
+
+    written = write_summary_dataset(input_files, tmp_path, file_format=file_format, row_group_size=row_group_size,
+                                    partition_by_month=partition_by_month, file_stats=file_stats, aggregates=aggregates)
+
+    use_nextcloud = config.get('use_nextcloud', False)
+    moved = True
+    for file_path in written:
+        dest_path = os.path.join(output_path, os.path.relpath(file_path, tmp_path)) if partition_by_month else output_path
+        if partition_by_month:
+            make_folder(os.path.dirname(dest_path), use_nextcloud=use_nextcloud)
+        moved = move_file(file_path, dest_path, use_nextcloud=use_nextcloud) and moved
+        os.remove(file_path)
+    if partition_by_month:
+        for dir_path in sorted({os.path.dirname(file_path) for file_path in written}, reverse=True) + [tmp_path]:
+            if os.path.isdir(dir_path):
+                os.rmdir(dir_path)
+
+    if not moved:
+        # Not recorded, so the next cycle writes the dataset again
+        return None
+    _last_written_state[config['summary_dir']] = state
+
+    logging.info(StructuredMessage({"event_type": "make_summary_dataset_complete", "output_path": output_path, "format": file_format, "files_written": len(written), "input_files_count": len(input_files)}))
+
+    return output_path
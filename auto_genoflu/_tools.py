@@ -1,12 +1,20 @@
 import os, sys
 from glob import glob
-import subprocess
-from typing import List, Set, Tuple, Dict
+from typing import List, Optional, Set, Tuple, Dict
 import json 
 import logging
 import pandas as pd
 from datetime import datetime
 from auto_genoflu.operations import make_folder, move_file
+from auto_genoflu._hashing import hash_file
+from auto_genoflu._summary import SummaryCache, add_confidence_column
+from auto_genoflu._summary_dataset import use_columnar_summary, make_summary_dataset
+from auto_genoflu._summary_analytics import SummaryAggregates, use_summary_aggregates, write_summary_aggregates
+from auto_genoflu._metrics import stage_timer
+from auto_genoflu._logging import StructuredMessage
+
+# Parsed per-sample results, reused across summary builds in the daemon
+_SUMMARY_CACHE = SummaryCache()
 
 def prelim_checks(config: dict) -> None:
     """Perform preliminary checks on the configuration."""
@@ -17,12 +25,12 @@ def prelim_checks(config: dict) -> None:
     dirs_to_create = [ 'output_dir', 'provenance_dir', 'summary_dir']
     for dir_key in dirs_to_create:
         if not os.path.exists(config[dir_key]):
-            logging.info(json.dumps({"event_type": f"{dir_key}_not_found", dir_key: config[dir_key]}))
+            logging.info(StructuredMessage({"event_type": f"{dir_key}_not_found", dir_key: config[dir_key]}))
             make_folder(config[dir_key], use_nextcloud=use_nextcloud)
 
 
 def load_config(config_file: str) -> Dict[str, str]:
-    logging.debug(json.dumps({
+    logging.debug(StructuredMessage({
         "event_type": "loading_config_file",
         "config_file": config_file
     }))
@@ -31,7 +39,7 @@ def load_config(config_file: str) -> Dict[str, str]:
         with open(config_file, "r") as f:
             config = json.load(f)
         
-        logging.debug(json.dumps({
+        logging.debug(StructuredMessage({
             "event_type": "config_file_loaded",
             "config_file": config_file,
             "config_keys": list(config.keys())
@@ -39,7 +47,7 @@ def load_config(config_file: str) -> Dict[str, str]:
         
         return config
     except (IOError, json.JSONDecodeError) as e:
-        logging.error(json.dumps({
+        logging.error(StructuredMessage({
             "event_type": "config_file_load_error",
             "config_file": config_file,
             "error": str(e)
@@ -47,7 +55,7 @@ def load_config(config_file: str) -> Dict[str, str]:
         raise
 
 def make_symlink(src: str, dst: str) -> None:
-    logging.debug(json.dumps({
+    logging.debug(StructuredMessage({
         "event_type": "creating_symlink",
         "src": src,
         "dst": dst
@@ -55,7 +63,7 @@ def make_symlink(src: str, dst: str) -> None:
     
     try:
         if os.path.exists(dst):
-            logging.debug(json.dumps({
+            logging.debug(StructuredMessage({
                 "event_type": "removing_existing_symlink",
                 "dst": dst
             }))
@@ -63,13 +71,13 @@ def make_symlink(src: str, dst: str) -> None:
         
         os.symlink(src, dst)
         
-        logging.debug(json.dumps({
+        logging.debug(StructuredMessage({
             "event_type": "symlink_created",
             "src": src,
             "dst": dst
         }))
     except Exception as e:
-        logging.error(json.dumps({
+        logging.error(StructuredMessage({
             "event_type": "symlink_creation_error",
             "src": src,
             "dst": dst,
@@ -83,7 +91,7 @@ def get_input_name(filepath: str) -> str:
     """
     input_name = os.path.basename(filepath).split(".")[0]
     
-    logging.debug(json.dumps({
+    logging.debug(StructuredMessage({
         "event_type": "extracting_input_name",
         "filepath": filepath,
         "extracted_name": input_name
@@ -94,7 +102,7 @@ def get_input_name(filepath: str) -> str:
 def get_output_name(filepath: str) -> str:
     output_name = os.path.basename(filepath).split("__")[0]
     
-    logging.debug(json.dumps({
+    logging.debug(StructuredMessage({
         "event_type": "extracting_output_name",
         "filepath": filepath,
         "extracted_name": output_name
@@ -106,13 +114,13 @@ def get_output_name(filepath: str) -> str:
 def compute_hash(file_path: str) -> str:
     """Compute a hash of a file."""
     if not os.path.exists(file_path):
-        logging.error(json.dumps({"event_type": "compute_hash_failed_file_not_found", "file_path": file_path}))
+        logging.error(StructuredMessage({"event_type": "compute_hash_failed_file_not_found", "file_path": file_path}))
         raise FileNotFoundError()
-    return subprocess.check_output(["shasum", file_path]).decode("utf-8").split()[0]
+    return hash_file(file_path)
 
 
 def glob_single(pattern: str):
-    logging.debug(json.dumps({
+    logging.debug(StructuredMessage({
         "event_type": "glob_single_search",
         "pattern": pattern
     }))
@@ -120,20 +128,20 @@ def glob_single(pattern: str):
     file_list = glob(pattern)
         
     if len(file_list) > 1:
-        logging.error(json.dumps({
+        logging.error(StructuredMessage({
             "event_type": "multiple_files_found",
             "pattern": pattern,
             "files_found": file_list
         }))
         raise ValueError(f"Multiple files found for pattern: {pattern}")
     elif len(file_list) == 0:
-        logging.warning(json.dumps({
+        logging.warning(StructuredMessage({
             "event_type": "no_files_found",
             "pattern": pattern
         }))
         return None
     
-    logging.debug(json.dumps({
+    logging.debug(StructuredMessage({
         "event_type": "glob_single_result",
         "pattern": pattern,
         "file_found": file_list[0]
@@ -141,30 +149,6 @@ def glob_single(pattern: str):
     
     return file_list[0]
 
-def add_confidence_column(df: pd.DataFrame) -> pd.DataFrame:
-    """Add a Confidence column based on Genotype Percent Match List values.
-    
-    Args:
-        df: DataFrame containing the 'Genotype Percent Match List' column
-        
-    Returns:
-        DataFrame with added 'Confidence' column
-    """
-    logging.debug(json.dumps({"event_type": "add_confidence_column_start"}))
-    
-    def process(string):
-        if not isinstance(string, str):
-            return None
-        fields = [float(x.strip("% ")) for x in string.split(",")]
-        return min(fields)
-    df['Min Percent Match'] = df['Genotype Percent Match List'].apply(process)
-    df['Confidence Level'] = pd.cut(df['Min Percent Match'], bins=[0, 90, 95, 98, 100], labels=['sub90','90','95','98'])
-    
-    logging.info(json.dumps({"event_type": "add_confidence_column_complete"}))
-    
-    return df
-
-
 def collect_df(input_files: List[str]) -> pd.DataFrame:
     """Combine multiple TSV files into a single file and return the combined dataframe.
     
@@ -177,48 +161,82 @@ def collect_df(input_files: List[str]) -> pd.DataFrame:
     """
     # Check argument count
     if len(input_files) < 1:
-        logging.warning(json.dumps({"event_type": "collect_df_no_input_files", "input_files": input_files}))
+        logging.warning(StructuredMessage({"event_type": "collect_df_no_input_files", "input_files": input_files}))
         return pd.DataFrame()
     
     # Read all TSV files and concatenate
     dataframes = [pd.read_csv(file, sep='\t') for file in input_files]
     combined_df = pd.concat(dataframes, ignore_index=True)
     
-    logging.info(json.dumps({"event_type": "collect_df_complete"}))
+    logging.info(StructuredMessage({"event_type": "collect_df_complete"}))
     
     return combined_df
 
-def make_summary_file(config: dict) -> None:
-    logging.info(json.dumps({"event_type": "make_summary_file_start"}))
-
-    timestamp = datetime.now().strftime('%y-%m-%d_%H-%M-%S')
-
+def _make_summary_tsv(config: dict, input_files: List[str], timestamp: str, aggregates: Optional[SummaryAggregates] = None) -> None:
     output_filename = f"GenoFLU_summary_{timestamp}.tsv"
 
     tmp_file = os.path.join(config['work_dir'], output_filename)
     output_file = os.path.join(config['summary_dir'], output_filename)  
-    input_files = glob(os.path.join(config['output_dir'], "*genoflu.tsv"))
 
     try:
-        output_df = collect_df(input_files)
+        # Only new or changed outputs are parsed, the rest come from the cache
+        _SUMMARY_CACHE.update(input_files)
+        summary_state = _SUMMARY_CACHE.state(input_files)
+        if input_files and summary_state == _SUMMARY_CACHE.last_written_state:
+            logging.info(StructuredMessage({"event_type": "summary_unchanged", "input_files_count": len(input_files)}))
+            return
+
+        output_df = _SUMMARY_CACHE.collect_df(input_files)
 
         output_df = add_confidence_column(output_df)
+        if aggregates is not None:
+            aggregates.add(output_df, _SUMMARY_CACHE.months(input_files))
 
         output_df.to_csv(tmp_file, sep='\t', index=False)
 
-        move_file(tmp_file, output_file, use_nextcloud=config.get('use_nextcloud', False))
+        moved = move_file(tmp_file, output_file, use_nextcloud=config.get('use_nextcloud', False))
 
         os.remove(tmp_file)
+        if not moved:
+            # Not recorded, so the next cycle writes the summary again
+            return
+        _SUMMARY_CACHE.last_written_state = summary_state
 
-        logging.info(json.dumps({"event_type": "make_summary_file_complete", "output_file": output_file}))
+        logging.info(StructuredMessage({"event_type": "make_summary_file_complete", "output_file": output_file}))
     except ValueError:
-        logging.info(json.dumps({"event_type": "no_input_files", "input_files_count": len(input_files)}))
+        logging.info(StructuredMessage({"event_type": "no_input_files", "input_files_count": len(input_files)}))
         pass
     except FileExistsError:
-        logging.info(json.dumps({"event_type": "output_file_exists", "output_file": output_file}))
+        logging.info(StructuredMessage({"event_type": "output_file_exists", "output_file": output_file}))
         pass
 
 
+def make_summary_file(config: dict) -> None:
+    """Write this cycle's summary of every output: the legacy TSV and, with
+    `use_columnar_summary`, a Parquet or Arrow IPC dataset streamed from the outputs.
+    With `use_summary_aggregates`, the aggregate tables are computed from whichever
+    of the two is built first."""
+    logging.info(StructuredMessage({"event_type": "make_summary_file_start"}))
+
+    with stage_timer("summary"):
+        timestamp = datetime.now().strftime('%y-%m-%d_%H-%M-%S')
+        input_files = glob(os.path.join(config['output_dir'], "*genoflu.tsv"))
+        aggregates = SummaryAggregates(config.get('id_threshold', 98.0)) if use_summary_aggregates(config) else None
+
+        if config.get('legacy_summary_tsv', True):
+            _make_summary_tsv(config, input_files, timestamp, aggregates)
+
+        if use_columnar_summary(config):
+            try:
+                make_summary_dataset(config, input_files, timestamp, aggregates if aggregates is not None and not aggregates.batches else None)
+            except ImportError as e:
+                logging.error(StructuredMessage({"event_type": "columnar_summary_unavailable", "error": str(e)}))
+
+        # nothing is aggregated when no output changed since the last summary
+        if aggregates is not None and aggregates.batches:
+            write_summary_aggregates(config, aggregates, timestamp)
+
+
 def delete_files(glob_expr: str) -> None:
     """Delete files matching the given glob expression."""
 
@@ -226,12 +244,12 @@ def delete_files(glob_expr: str) -> None:
         if os.path.isfile(file_path):
             try:
                 os.remove(file_path)
-                logging.debug(json.dumps({
+                logging.debug(StructuredMessage({
                     "event_type": "file_deleted",
                     "file_path": str(file_path)
                 }))
             except Exception as e:
-                logging.error(json.dumps({
+                logging.error(StructuredMessage({
                     "event_type": "file_deletion_error",
                     "file_path": str(file_path),
                     "error": str(e)
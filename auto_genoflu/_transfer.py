@@ -0,0 +1,250 @@
+import os
+import logging
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from typing import Callable, Optional, Set, Tuple
+from urllib.parse import unquote, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from auto_genoflu._logging import StructuredMessage
+
+MB = 1024 * 1024
+
+DEFAULT_TRANSFER_PARAMS = {
+    "max_retries": 5,
+    "backoff_seconds": 1.0,
+    "timeout_seconds": 120,
+    "max_concurrent_uploads": 4,
+    "chunked_upload_threshold_mb": 50,
+    "chunk_size_mb": 10,
+}
+
+_transfer_params = dict(DEFAULT_TRANSFER_PARAMS)
+_session = None
+_session_key = None
+_session_lock = threading.Lock()
+_upload_slots = None
+_upload_slots_size = None
+
+# Remote folders known to exist, as unquoted URL paths without a trailing slash
+_known_remote_dirs: Set[str] = set()
+_known_remote_dirs_lock = threading.Lock()
+
+
+class TransferError(Exception):
+    """A WebDAV request that still failed after all retries."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def configure_transfers(config: dict) -> None:
+    """Apply `nextcloud_params` from the config to all later transfers."""
+    global _transfer_params
+    _transfer_params = {**DEFAULT_TRANSFER_PARAMS, **config.get('nextcloud_params', {})}
+
+
+def get_session(credentials: dict) -> requests.Session:
+    """Shared session, so uploads and MKCOLs reuse pooled keep-alive connections."""
+    global _session, _session_key
+
+    key = (credentials['USERNAME'], credentials['PASSWORD'], credentials['URL'])
+    with _session_lock:
+        if _session is None or _session_key != key:
+            pool_size = max(10, int(_transfer_params['max_concurrent_uploads']) * 2)
+            session = requests.Session()
+            session.auth = (credentials['USERNAME'], credentials['PASSWORD'])
+            session.mount("http://", HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+            session.mount("https://", HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+            _session = session
+            _session_key = key
+        return _session
+
+
+def request_with_retries(session: requests.Session, method: str, url: str, body: Optional[Callable] = None, headers: Optional[dict] = None,
+                         ok_statuses: Tuple[int, ...] = (200, 201, 204)) -> requests.Response:
+    """Send a WebDAV request, retrying 5xx responses, timeouts and connection errors
+    with exponential backoff.
+
+    Args:
+        body: Callable returning a fresh request body, called once per attempt so
+            streamed file bodies can be reopened for a retry
+        ok_statuses: Status codes that count as success
+
+    Raises:
+        TransferError: If the request fails with a non-retryable status, or still fails after all retries
+    """
+    max_retries = int(_transfer_params['max_retries'])
+    timeout = float(_transfer_params['timeout_seconds'])
+
+    for attempt in range(max_retries + 1):
+        error = None
+        status_code = None
+        try:
+            data = body() if body else None
+            try:
+                response = session.request(method, url, data=data, headers=headers, timeout=timeout)
+            finally:
+                if hasattr(data, "close"):
+                    data.close()
+            status_code = response.status_code
+            if status_code in ok_statuses:
+                return response
+            if status_code < 500:
+                raise TransferError(f"{method} {url} failed with status {status_code}", status_code)
+            error = f"status {status_code}"
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            error = str(e)
+
+        if attempt < max_retries:
+            delay = float(_transfer_params['backoff_seconds']) * 2 ** attempt
+            logging.warning(StructuredMessage({"event_type": "webdav_request_retry", "method": method, "url": url, "attempt": attempt + 1, "delay_seconds": delay, "error": error}))
+            time.sleep(delay)
+
+    raise TransferError(f"{method} {url} failed after {max_retries + 1} attempts: {error}", status_code)
+
+
+def _read_chunk(source_path: str, offset: int, size: int) -> Callable:
+    def body():
+        with open(source_path, "rb") as f:
+            f.seek(offset)
+            return f.read(size)
+    return body
+
+
+def _uploads_url(credentials: dict) -> Optional[str]:
+    """Chunked uploads live under remote.php/dav/uploads/<user> next to remote.php/dav/files/<user>."""
+    files_suffix = f"/files/{credentials['USERNAME']}"
+    if not credentials['URL'].endswith(files_suffix):
+        return None
+    return credentials['URL'][:-len(files_suffix)] + f"/uploads/{credentials['USERNAME']}"
+
+
+def _chunked_upload(session: requests.Session, credentials: dict, source_path: str, url_dest: str, file_size: int) -> None:
+    """Upload a large file with Nextcloud's chunked upload (v2) protocol.
+
+    Each chunk is retried on its own, so a failure only re-sends one chunk.
+    """
+    upload_url = f"{_uploads_url(credentials)}/auto-genoflu-{uuid.uuid4().hex}"
+    headers = {"Destination": url_dest}
+    chunk_size = int(float(_transfer_params['chunk_size_mb']) * MB)
+
+    request_with_retries(session, "MKCOL", upload_url, headers=headers, ok_statuses=(201,))
+    try:
+        for index, offset in enumerate(range(0, file_size, chunk_size), start=1):
+            request_with_retries(session, "PUT", f"{upload_url}/{index:05d}", body=_read_chunk(source_path, offset, chunk_size), headers=headers)
+
+        request_with_retries(session, "MOVE", f"{upload_url}/.file", headers={**headers, "OC-Total-Length": str(file_size)})
+    except TransferError:
+        # best effort cleanup of the partial upload
+        try:
+            session.request("DELETE", upload_url, timeout=float(_transfer_params['timeout_seconds']))
+        except requests.exceptions.RequestException:
+            pass
+        raise
+
+
+def _get_upload_slots() -> threading.BoundedSemaphore:
+    global _upload_slots, _upload_slots_size
+
+    with _session_lock:
+        size = max(1, int(_transfer_params['max_concurrent_uploads']))
+        if _upload_slots is None or _upload_slots_size != size:
+            _upload_slots = threading.BoundedSemaphore(size)
+            _upload_slots_size = size
+        return _upload_slots
+
+
+def upload_file(credentials: dict, source_path: str, url_dest: str) -> None:
+    """Upload one file, using chunked upload for files above the configured threshold.
+
+    Uploads from every worker thread queue for a bounded number of upload slots,
+    so a large local pool can't flood the Nextcloud server.
+
+    Raises:
+        TransferError: If the upload still failed after all retries
+    """
+    session = get_session(credentials)
+    file_size = os.path.getsize(source_path)
+    threshold = float(_transfer_params['chunked_upload_threshold_mb']) * MB
+
+    with _get_upload_slots():
+        try:
+            if file_size > threshold and _uploads_url(credentials) is not None:
+                logging.debug(StructuredMessage({"event_type": "chunked_upload_start", "url_dest": url_dest, "file_size_mb": round(file_size / MB, 2)}))
+                _chunked_upload(session, credentials, source_path, url_dest, file_size)
+            else:
+                request_with_retries(session, "PUT", url_dest, body=lambda: open(source_path, "rb"), headers={'Content-Type': 'application/octet-stream'})
+        except TransferError as e:
+            if e.status_code in (404, 409):
+                # the destination folder is gone, so it must be created again next time
+                forget_remote_dir(url_dest.rsplit("/", 1)[0])
+            raise
+
+
+def _remote_dir_key(url: str) -> str:
+    return unquote(urlparse(url).path).rstrip("/")
+
+
+def is_known_remote_dir(url: str) -> bool:
+    with _known_remote_dirs_lock:
+        return _remote_dir_key(url) in _known_remote_dirs
+
+
+def remember_remote_dir(url: str) -> None:
+    with _known_remote_dirs_lock:
+        _known_remote_dirs.add(_remote_dir_key(url))
+
+
+def forget_remote_dir(url: str) -> None:
+    key = _remote_dir_key(url)
+    with _known_remote_dirs_lock:
+        # anything below a missing folder is missing too
+        stale = {d for d in _known_remote_dirs if d == key or d.startswith(key + "/")}
+        _known_remote_dirs.difference_update(stale)
+    logging.info(StructuredMessage({"event_type": "remote_folder_cache_invalidated", "url": url, "folders_forgotten": len(stale)}))
+
+
+def prime_remote_dir_cache(credentials: dict, url: str) -> int:
+    """Record every folder directly under `url` (and `url` itself) with a single PROPFIND.
+
+    Returns:
+        Number of folders found
+    """
+    session = get_session(credentials)
+    body = ('<?xml version="1.0"?><d:propfind xmlns:d="DAV:"><d:prop><d:resourcetype/></d:prop></d:propfind>').encode("utf-8")
+    response = request_with_retries(session, "PROPFIND", url, body=lambda: body, headers={"Depth": "1", "Content-Type": "application/xml"}, ok_statuses=(207,))
+
+    folders = set()
+    for item in ET.fromstring(response.content).iter("{DAV:}response"):
+        href = item.findtext("{DAV:}href")
+        if href and item.find(".//{DAV:}resourcetype/{DAV:}collection") is not None:
+            folders.add(unquote(urlparse(href).path).rstrip("/"))
+
+    with _known_remote_dirs_lock:
+        _known_remote_dirs.update(folders)
+
+    logging.info(StructuredMessage({"event_type": "remote_folder_cache_primed", "url": url, "folders_found": len(folders)}))
+
+    return len(folders)
+
+
+def make_remote_folder(credentials: dict, url_dest: str) -> int:
+    """MKCOL a remote folder, returning the status code (405 if it already exists).
+
+    Folders already known to exist are skipped without a request, and 0 is returned.
+    """
+    if is_known_remote_dir(url_dest):
+        logging.debug(StructuredMessage({"event_type": "remote_folder_known", "url": url_dest}))
+        return 0
+
+    session = get_session(credentials)
+    response = request_with_retries(session, "MKCOL", url_dest, ok_statuses=(201, 405, 409))
+    if response.status_code in (201, 405):
+        remember_remote_dir(url_dest)
+    return response.status_code
@@ -0,0 +1,124 @@
+import os
+import logging
+import threading
+import time
+from typing import Optional, Set
+
+from auto_genoflu._tools import get_input_name, get_output_name
+from auto_genoflu._scan import compile_patterns
+from auto_genoflu._logging import StructuredMessage
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # watch mode is optional, polling still works without watchdog
+    Observer = None
+    FileSystemEventHandler = object
+
+DEFAULT_WATCH_DEBOUNCE_SECONDS = 5
+DEFAULT_RECONCILE_INTERVAL_SECONDS = 3600
+
+# Events that can change whether a sample needs processing
+_RELEVANT_EVENT_TYPES = {"created", "modified", "moved", "deleted", "closed"}
+
+
+class SampleEventCollector(FileSystemEventHandler):
+    """Collect sample names affected by filesystem events on input_dir and output_dir."""
+
+    def __init__(self, config: dict):
+        super().__init__()
+        self.input_dir = os.path.abspath(config['input_dir'])
+        self.output_dir = os.path.abspath(config['output_dir'])
+        self.input_matches = compile_patterns(config['glob_expressions'])
+        self.recursive = config.get('recursive_scan', False)
+        self.pending: Set[str] = set()
+        self.last_event_time = 0.0
+        self.condition = threading.Condition()
+
+    def _sample_name(self, path: str) -> Optional[str]:
+        path = os.path.abspath(path)
+        file_dir, file_name = os.path.split(path)
+
+        in_input_dir = file_dir == self.input_dir or (self.recursive and file_dir.startswith(self.input_dir + os.sep))
+        if in_input_dir and self.input_matches(file_name):
+            return get_input_name(path)
+        if file_dir == self.output_dir and file_name.endswith(".tsv"):
+            return get_output_name(path)
+        return None
+
+    def on_any_event(self, event) -> None:
+        if event.is_directory or event.event_type not in _RELEVANT_EVENT_TYPES:
+            return
+
+        paths = [event.src_path, getattr(event, "dest_path", "")]
+        names = {self._sample_name(os.fsdecode(p)) for p in paths if p} - {None}
+        if not names:
+            return
+
+        with self.condition:
+            self.pending |= names
+            self.last_event_time = time.monotonic()
+            self.condition.notify_all()
+
+    def wait_for_samples(self, timeout: float, debounce: float) -> Set[str]:
+        """Block until events arrive and have been quiet for `debounce` seconds,
+        or until `timeout` expires. Returns the affected sample names.
+        """
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                if self.pending:
+                    quiet_until = self.last_event_time + debounce
+                    if now >= quiet_until:
+                        break
+                    self.condition.wait(min(quiet_until, deadline) - now)
+                else:
+                    self.condition.wait(deadline - now)
+
+            samples = self.pending
+            self.pending = set()
+
+        return samples
+
+
+class DirectoryWatcher:
+    """Subscribe to filesystem events on input_dir and output_dir."""
+
+    def __init__(self, config: dict):
+        self.watch_key = watch_key(config)
+        self.collector = SampleEventCollector(config)
+        self.observer = Observer()
+        self.observer.schedule(self.collector, config['input_dir'], recursive=config.get('recursive_scan', False))
+        self.observer.schedule(self.collector, config['output_dir'], recursive=False)
+        self.observer.start()
+
+        logging.info(StructuredMessage({"event_type": "directory_watcher_started", "input_dir": config['input_dir'], "output_dir": config['output_dir']}))
+
+    def wait_for_samples(self, timeout: float, debounce: float) -> Set[str]:
+        return self.collector.wait_for_samples(timeout, debounce)
+
+    def stop(self) -> None:
+        self.observer.stop()
+        self.observer.join()
+        logging.info(StructuredMessage({"event_type": "directory_watcher_stopped"}))
+
+
+def watch_key(config: dict) -> tuple:
+    """Settings that require the watcher to be restarted when they change."""
+    return (config['input_dir'], config['output_dir'], tuple(config['glob_expressions']), config.get('recursive_scan', False))
+
+
+def start_watcher(config: dict) -> Optional[DirectoryWatcher]:
+    """Start a directory watcher, or return None if watch mode is unavailable."""
+    if Observer is None:
+        logging.error(StructuredMessage({"event_type": "watch_mode_unavailable", "error": "watchdog is not installed, falling back to polling"}))
+        return None
+
+    try:
+        return DirectoryWatcher(config)
+    except OSError as e:
+        logging.error(StructuredMessage({"event_type": "watch_mode_start_failed", "error": str(e)}))
+        return None
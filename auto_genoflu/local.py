@@ -0,0 +1,88 @@
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional
+
+from auto_genoflu._failures import AnalysisFailure, task_outcomes
+from auto_genoflu._metrics import SAMPLES_PROCESSED
+from auto_genoflu._logging import StructuredMessage
+
+
+def get_max_workers(config: dict) -> int:
+    """Number of samples to run concurrently in local mode (default: CPU count)."""
+    max_workers = config.get('max_workers') or os.cpu_count() or 1
+    return max(1, int(max_workers))
+
+
+def run_local_pool(function: Callable, fasta_files: List[str], config: dict, max_workers: Optional[int] = None) -> Dict[str, AnalysisFailure]:
+    """Run `function(fasta_file, config)` for every file on a bounded worker pool.
+
+    Each GenoFLU run is an external subprocess with its own cwd, so threads are
+    enough to keep every core busy. A failure in one sample never stops the others.
+
+    Returns:
+        The failure of each FASTA file whose analysis failed
+    """
+    if max_workers is None:
+        max_workers = get_max_workers(config)
+
+    failed_files = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(function, fasta_file, config): fasta_file for fasta_file in fasta_files}
+
+        for future in as_completed(futures):
+            fasta_file = futures[future]
+            try:
+                succeeded = future.result()
+            except Exception as e:
+                logging.error(StructuredMessage({"event_type": "local_task_failed", "fasta_file": fasta_file, "error": str(e)}))
+                SAMPLES_PROCESSED.inc(result="failure")
+                succeeded = AnalysisFailure(fasta_file, "task_error", str(e))
+
+            failure = task_outcomes([fasta_file], succeeded)[fasta_file]
+            if failure is not None:
+                failed_files[fasta_file] = failure
+            else:
+                logging.info(StructuredMessage({"event_type": "analysis_complete", "fasta_file": fasta_file}))
+
+    return failed_files
+
+
+def make_batches(fasta_files: List[str], batch_size: int) -> List[List[str]]:
+    """Split fasta_files into consecutive batches of at most batch_size files."""
+    batch_size = max(1, int(batch_size))
+    return [fasta_files[i:i + batch_size] for i in range(0, len(fasta_files), batch_size)]
+
+
+def run_local_batches(function: Callable, batches: List[List[str]], config: dict, max_workers: Optional[int] = None) -> Dict[str, AnalysisFailure]:
+    """Run `function(batch, config)` for every batch on a bounded worker pool.
+
+    `function` returns the failures in the batch, so success and failure
+    are still reported per sample.
+
+    Returns:
+        The failure of each FASTA file whose analysis failed
+    """
+    if max_workers is None:
+        max_workers = get_max_workers(config)
+
+    failed_files = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(function, batch, config): batch for batch in batches}
+
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                batch_failed = future.result()
+            except Exception as e:
+                logging.error(StructuredMessage({"event_type": "local_batch_failed", "fasta_files": batch, "error": str(e)}))
+                SAMPLES_PROCESSED.inc(len(batch), result="failure")
+                batch_failed = [AnalysisFailure(fasta_file, "task_error", str(e)) for fasta_file in batch]
+
+            for fasta_file, failure in task_outcomes(batch, batch_failed).items():
+                if failure is not None:
+                    failed_files[fasta_file] = failure
+                else:
+                    logging.info(StructuredMessage({"event_type": "analysis_complete", "fasta_file": fasta_file}))
+
+    return failed_files
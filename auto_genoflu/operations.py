@@ -1,11 +1,13 @@
 #%%
 import os 
 import requests
-from requests.auth import HTTPBasicAuth
-import json
 import logging 
 import re 
 import shutil 
+import xml.etree.ElementTree as ET
+
+from auto_genoflu._transfer import upload_file, make_remote_folder, prime_remote_dir_cache, TransferError
+from auto_genoflu._logging import StructuredMessage
 
 def load_credentials(require_credentials=True):
     AUTH_USER = os.getenv('NEXTCLOUD_API_USERNAME')  # You can change this token as needed
@@ -14,7 +16,7 @@ def load_credentials(require_credentials=True):
 
     if not all([AUTH_USER, AUTH_PASSWORD, BASE_URL]):
         if require_credentials:
-            logging.error(json.dumps({"event_type": "missing_required_environment_variables", "url": BASE_URL, "user": AUTH_USER}))
+            logging.error(StructuredMessage({"event_type": "missing_required_environment_variables", "url": BASE_URL, "user": AUTH_USER}))
             raise ValueError
         else:
             return None
@@ -38,7 +40,7 @@ def move_file(source_path, dest_path, use_nextcloud=False):
     # Check if source file exists
     if not os.path.exists(source_path):
         event_type = "upload_failed_local_file_not_found" if use_nextcloud else "move_failed_local_file_not_found"
-        logging.error(json.dumps({"event_type": event_type, "source_path": source_path}))
+        logging.error(StructuredMessage({"event_type": event_type, "source_path": source_path}))
         raise FileNotFoundError
     
     # Get file size for progress reporting
@@ -54,35 +56,23 @@ def move_file(source_path, dest_path, use_nextcloud=False):
         url_dest = f"{credentials['URL']}/{dest_path}"
         
         try:
-            logging.info(json.dumps({"event_type": "upload_start", "file_size_mb": round(file_size / 1024 / 1024, 2), "dest_path": dest_path}))
-            
-            # Open the file in binary mode and stream it to avoid loading large files into memory
-            with open(source_path, 'rb') as file:
-                # PUT request with file content as body
-                response = requests.put(
-                    url_dest,
-                    auth=HTTPBasicAuth(credentials['USERNAME'], credentials['PASSWORD']),
-                    data=file,  # Stream file content
-                    headers={
-                        'Content-Type': 'application/octet-stream',
-                    }
-                )
-                
-            response.raise_for_status()  # Raise an exception for HTTP errors
+            logging.info(StructuredMessage({"event_type": "upload_start", "file_size_mb": round(file_size / 1024 / 1024, 2), "dest_path": dest_path}))
             
-            if response.status_code in [200, 201, 204]:
-                logging.info(json.dumps({"event_type": "upload_success", "dest_path": dest_path}))
-                return True
-            else:
-                logging.error(json.dumps({"event_type": "upload_failed_unexpected_response", "status_code": response.status_code}))
-                return False
+            # Streamed (or chunked for large files) over a pooled session, with retries
+            upload_file(credentials, source_path, url_dest)
+
+            logging.info(StructuredMessage({"event_type": "upload_success", "dest_path": dest_path}))
+            return True
                 
+        except TransferError as e:
+            logging.error(StructuredMessage({"event_type": "upload_failed_unexpected_response", "status_code": e.status_code, "error": str(e), "dest_path": dest_path}))
+            return False
         except requests.exceptions.RequestException as e:
-            logging.error(json.dumps({"event_type": "upload_failed_exception", "error": str(e), "dest_path": dest_path}))
+            logging.error(StructuredMessage({"event_type": "upload_failed_exception", "error": str(e), "dest_path": dest_path}))
             return False
     else:
         try:
-            logging.info(json.dumps({"event_type": "move_start", "file_size_mb": round(file_size / 1024 / 1024, 2), "dest_path": dest_path}))
+            logging.info(StructuredMessage({"event_type": "move_start", "file_size_mb": round(file_size / 1024 / 1024, 2), "dest_path": dest_path}))
             
             # Ensure destination directory exists
             dest_dir = os.path.dirname(dest_path)
@@ -92,11 +82,11 @@ def move_file(source_path, dest_path, use_nextcloud=False):
             # Move the file
             shutil.copy2(source_path, dest_path)
             
-            logging.info(json.dumps({"event_type": "move_success", "dest_path": dest_path}))
+            logging.info(StructuredMessage({"event_type": "move_success", "dest_path": dest_path}))
             return True
                 
         except Exception as e:
-            logging.error(json.dumps({"event_type": "move_failed_exception", "error": str(e), "dest_path": dest_path}))
+            logging.error(StructuredMessage({"event_type": "move_failed_exception", "error": str(e), "dest_path": dest_path}))
             return False
 
 def make_folder(dir_path, use_nextcloud=False):
@@ -120,27 +110,50 @@ def make_folder(dir_path, use_nextcloud=False):
         url_dest = f"{credentials['URL']}/{remote_folder_path}"
         
         try:
-            response = requests.request(
-                "MKCOL",
-                url_dest,
-                auth=HTTPBasicAuth(credentials['USERNAME'], credentials['PASSWORD']),
-            )
-            
-            if response.status_code in [201, 405, 409]:  # 201 Created, 405 Method Not Allowed (folder already exists)
-                logging.info(json.dumps({"event_type": "folder_creation_success", "dir_path": dir_path}))
-                return True
-            else:
-                logging.error(json.dumps({"event_type": "folder_creation_failed", "status_code": response.status_code, "dir_path": dir_path}))
-                return False
-                
+            status_code = make_remote_folder(credentials, url_dest)
+            # 201 Created, 405 Method Not Allowed (folder already exists), 0 already known to exist
+            if status_code:
+                logging.info(StructuredMessage({"event_type": "folder_creation_success", "dir_path": dir_path, "status_code": status_code}))
+            return True
+
+        except TransferError as e:
+            logging.error(StructuredMessage({"event_type": "folder_creation_failed", "status_code": e.status_code, "dir_path": dir_path}))
+            return False
         except requests.exceptions.RequestException as e:
-            logging.error(json.dumps({"event_type": "folder_creation_exception", "error": str(e), "dir_path": dir_path}))
+            logging.error(StructuredMessage({"event_type": "folder_creation_exception", "error": str(e), "dir_path": dir_path}))
             return False
     else:
         try:
             os.makedirs(dir_path, exist_ok=True)
-            logging.info(json.dumps({"event_type": "folder_creation_success", "dir_path": dir_path}))
+            logging.info(StructuredMessage({"event_type": "folder_creation_success", "dir_path": dir_path}))
             return True
         except Exception as e:
-            logging.error(json.dumps({"event_type": "folder_creation_exception", "error": str(e), "dir_path": dir_path}))
+            logging.error(StructuredMessage({"event_type": "folder_creation_exception", "error": str(e), "dir_path": dir_path}))
             return False
+
+def prime_folder_cache(dir_paths):
+    """
+    Record which Nextcloud folders already exist with a single PROPFIND on the
+    closest common parent of dir_paths, so make_folder can skip their MKCOLs.
+    
+    Args:
+        dir_paths (list): Paths of the folders make_folder will be called with
+    
+    Returns:
+        bool: True if the cache was primed, False otherwise
+    """
+    credentials = load_credentials()
+
+    remote_paths = [re.sub(f'^.+/files/', '', p).strip('/') for p in dir_paths]
+    common_parent = os.path.commonpath(remote_paths) if remote_paths else ''
+    url_dest = f"{credentials['URL']}/{common_parent}".rstrip('/')
+
+    try:
+        prime_remote_dir_cache(credentials, url_dest)
+        return True
+    except TransferError as e:
+        logging.warning(StructuredMessage({"event_type": "folder_cache_prime_failed", "status_code": e.status_code, "error": str(e), "url": url_dest}))
+        return False
+    except (requests.exceptions.RequestException, ET.ParseError) as e:
+        logging.warning(StructuredMessage({"event_type": "folder_cache_prime_failed", "error": str(e), "url": url_dest}))
+        return False
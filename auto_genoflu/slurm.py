@@ -1,8 +1,22 @@
 
-import json 
+import os
+import json
 import logging
+import sqlite3
 import submitit
 import time
+from typing import Callable, Dict, List, Optional, Union
+
+from auto_genoflu._tools import get_input_name, delete_files
+from auto_genoflu._state import record_inflight_jobs, list_inflight_jobs, remove_inflight_jobs
+from auto_genoflu._failures import AnalysisFailure, task_outcomes, update_failure_ledger
+from auto_genoflu._sizing import SizingModel, size_task
+from auto_genoflu._metrics import SAMPLES_PROCESSED, SLURM_INFLIGHT
+from auto_genoflu._logging import StructuredMessage
+
+# Executor shared between daemon cycles, and the slurm_params it was built from
+_executor = None
+_executor_settings = None
 
 def init_slurm_executor(config: dict = None) -> submitit.AutoExecutor:
     if config is None:
@@ -20,12 +34,27 @@ def init_slurm_executor(config: dict = None) -> submitit.AutoExecutor:
     )
     return executor
 
+def get_slurm_executor(config: dict) -> submitit.AutoExecutor:
+    """Like `init_slurm_executor`, but reuses the executor from earlier cycles while `slurm_params` is unchanged."""
+    global _executor, _executor_settings
+
+    settings = json.dumps(config.get('slurm_params', {}), sort_keys=True)
+    if _executor is None or settings != _executor_settings:
+        if _executor is not None:
+            logging.info(StructuredMessage({"event_type": "slurm_executor_rebuilt", "slurm_params": config.get('slurm_params', {})}))
+        _executor = init_slurm_executor(config)
+        _executor_settings = settings
+    return _executor
+
 def run_slurm_array(executor: submitit.AutoExecutor, function: callable, *function_args) -> None:
     job_list = executor.map_array(
         function,
         *function_args
     )
 
+    return wait_slurm_jobs(job_list)
+
+def wait_slurm_jobs(job_list: list) -> list:
     # wait on all jobs to complete
     failed_jobs = []
     for job in job_list:
@@ -38,6 +67,213 @@ def run_slurm_array(executor: submitit.AutoExecutor, function: callable, *functi
             failed_jobs.append(job)
     
     for job in failed_jobs:
-        logging.error(json.dumps({"event_type": "slurm_job_failed", "job_id": job.job_id, "exception": str(job.exception()), "stderr": job.stderr}))
+        logging.error(StructuredMessage({"event_type": "slurm_job_failed", "job_id": job.job_id, "exception": str(job.exception()), "stderr": job.stderr}))
     
     return job_list
+
+# Slurm states after which a job will not change any more
+TERMINAL_STATES = {"COMPLETED", "FAILED", "CANCELLED", "TIMEOUT", "OUT_OF_MEMORY", "NODE_FAIL", "PREEMPTED", "BOOT_FAIL", "DEADLINE"}
+# States reported for jobs sacct no longer knows about
+UNKNOWN_STATES = {"", "UNKNOWN"}
+DEFAULT_INFLIGHT_MAX_AGE_HOURS = 48
+DEFAULT_SAMPLE_SECONDS_ESTIMATE = 20
+
+def task_files(task: Union[str, List[str]]) -> List[str]:
+    """The FASTA files handled by one array task: a single file, or a packed bin of files."""
+    return [task] if isinstance(task, str) else list(task)
+
+def pack_samples(fasta_files: List[str], config: dict, estimate_seconds: Optional[Callable[[str], float]] = None) -> List[List[str]]:
+    """Group samples into bins so each array task runs several of them.
+
+    Bins are filled in order, either up to `slurm_params.samples_per_task` samples,
+    or until the estimated runtime would exceed `slurm_params.target_task_seconds`.
+
+    Args:
+        fasta_files: Files to pack, in the order they should run
+        config: Configuration dictionary
+        estimate_seconds: Estimated runtime of one sample
+            (default: `slurm_params.sample_seconds_estimate`, 20 s)
+
+    Returns:
+        List of bins, each a list of FASTA files
+    """
+    slurm_params = config.get('slurm_params', {})
+    samples_per_task = int(slurm_params.get("samples_per_task", 1))
+    target_task_seconds = slurm_params.get("target_task_seconds")
+
+    if target_task_seconds is None:
+        samples_per_task = max(1, samples_per_task)
+        return [fasta_files[i:i + samples_per_task] for i in range(0, len(fasta_files), samples_per_task)]
+
+    if estimate_seconds is None:
+        default_estimate = float(slurm_params.get("sample_seconds_estimate", DEFAULT_SAMPLE_SECONDS_ESTIMATE))
+        estimate_seconds = lambda fasta_file: default_estimate
+
+    bins = []
+    current_bin = []
+    current_seconds = 0.0
+    for fasta_file in fasta_files:
+        seconds = estimate_seconds(fasta_file)
+        if current_bin and current_seconds + seconds > float(target_task_seconds):
+            bins.append(current_bin)
+            current_bin = []
+            current_seconds = 0.0
+        current_bin.append(fasta_file)
+        current_seconds += seconds
+    if current_bin:
+        bins.append(current_bin)
+
+    return bins
+
+def use_adaptive_sizing(config: dict) -> bool:
+    return bool(config.get('slurm_params', {}).get("adaptive_sizing", False))
+
+def sizing_estimator(model: SizingModel, config: dict) -> Callable[[str], float]:
+    """Per-sample runtime estimate for `pack_samples`, from history where there is enough of it."""
+    default_estimate = float(config.get('slurm_params', {}).get("sample_seconds_estimate", DEFAULT_SAMPLE_SECONDS_ESTIMATE))
+
+    def estimate_seconds(fasta_file: str) -> float:
+        estimate = model.estimate_file(fasta_file)
+        return default_estimate if estimate is None else estimate[0]
+
+    return estimate_seconds
+
+def map_slurm_array(executor: submitit.AutoExecutor, function: callable, tasks: List[Union[str, List[str]]], config: dict, model: Optional[SizingModel] = None) -> list:
+    """Submit one array task per entry in tasks without waiting.
+
+    With a sizing model, every task gets its own `mem`/`time` request, and tasks
+    with the same request are submitted together as one array.
+
+    Returns:
+        Jobs in the same order as tasks
+    """
+    if model is None:
+        return executor.map_array(function, tasks, [config]*len(tasks))
+
+    groups = {}
+    for index, task in enumerate(tasks):
+        groups.setdefault(size_task(task_files(task), config, model), []).append(index)
+
+    job_list = [None] * len(tasks)
+    try:
+        for (mem, time_limit), indices in groups.items():
+            # The requested resources are recorded in each sample's provenance
+            sized_config = {**config, 'slurm_params': {**config['slurm_params'], "mem": mem, "time": time_limit}}
+            executor.update_parameters(slurm_mem=mem, slurm_time=time_limit)
+            group_jobs = executor.map_array(function, [tasks[i] for i in indices], [sized_config]*len(indices))
+            for index, job in zip(indices, group_jobs):
+                job_list[index] = job
+
+            logging.info(StructuredMessage({"event_type": "slurm_sized_array_submitted", "mem": mem, "time": time_limit, "n_tasks": len(indices)}))
+    finally:
+        # the executor is reused across cycles, so put back the configured defaults
+        executor.update_parameters(slurm_mem=config['slurm_params'].get("mem", "4G"), slurm_time=config['slurm_params'].get("time", "01:00:00"))
+
+    return job_list
+
+def use_sample_packing(config: dict) -> bool:
+    slurm_params = config.get('slurm_params', {})
+    return "target_task_seconds" in slurm_params or int(slurm_params.get("samples_per_task", 1)) > 1
+
+def failed_job_outcomes(job: submitit.SlurmJob, state: str, fasta_files: List[str]) -> Dict[str, AnalysisFailure]:
+    """Outcomes of a job that did not complete, e.g. killed for exceeding its memory or time."""
+    return {fasta_file: AnalysisFailure(fasta_file, f"slurm_{state.lower()}", f"Slurm job {job.job_id} ended in state {state}") for fasta_file in fasta_files}
+
+def report_slurm_job(job: submitit.SlurmJob, state: str, fasta_files: List[str], log_dir: str) -> Dict[str, Optional[AnalysisFailure]]:
+    """Report per-sample results of a finished job and clean up the logs of completed ones.
+
+    A task returns either the result of run_genoflu (one sample) or the failures of a packed bin.
+
+    Returns:
+        Outcome of each file, as from `task_outcomes`
+    """
+    if state != "COMPLETED":
+        for fasta_file in fasta_files:
+            logging.error(StructuredMessage({"event_type": "slurm_job_failed", "job_id": job.job_id, "state": state, "fasta_file": fasta_file}))
+        SAMPLES_PROCESSED.inc(len(fasta_files), result="failure")
+        return failed_job_outcomes(job, state, fasta_files)
+
+    try:
+        result = job.result()
+    except Exception as e:
+        logging.error(StructuredMessage({"event_type": "slurm_job_result_unavailable", "job_id": job.job_id, "fasta_files": fasta_files, "error": str(e)}))
+        SAMPLES_PROCESSED.inc(len(fasta_files), result="failure")
+        return {fasta_file: AnalysisFailure(fasta_file, "slurm_result_unavailable", str(e)) for fasta_file in fasta_files}
+
+    outcomes = task_outcomes(fasta_files, result)
+    for fasta_file in fasta_files:
+        if outcomes[fasta_file] is not None:
+            logging.error(StructuredMessage({"event_type": "slurm_sample_failed", "job_id": job.job_id, "fasta_file": fasta_file}))
+            SAMPLES_PROCESSED.inc(result="failure")
+        else:
+            logging.info(StructuredMessage({"event_type": "analysis_complete", "job_id": job.job_id, "fasta_file": fasta_file}))
+            SAMPLES_PROCESSED.inc(result="success")
+
+    delete_files(os.path.join(log_dir, f"{job.job_id}_*"))
+
+    return outcomes
+
+def submit_slurm_array(executor: submitit.AutoExecutor, function: callable, tasks: List[Union[str, List[str]]], config: dict, conn: sqlite3.Connection,
+                       model: Optional[SizingModel] = None) -> list:
+    """Submit an array without waiting for it, and record every sample as in flight.
+
+    Each task is either a single FASTA file or a packed bin of files.
+    """
+    job_list = map_slurm_array(executor, function, tasks, config, model)
+
+    submitted_at = time.time()
+    record_inflight_jobs(conn, [(get_input_name(f), f, job.job_id, submitted_at) for task, job in zip(tasks, job_list) for f in task_files(task)])
+    SLURM_INFLIGHT.set(len(list_inflight_jobs(conn)))
+
+    logging.info(StructuredMessage({"event_type": "slurm_array_submitted", "n_tasks": len(job_list), "job_ids": sorted({job.job_id.split("_")[0] for job in job_list})}))
+
+    return job_list
+
+def poll_inflight_jobs(config: dict, conn: sqlite3.Connection) -> int:
+    """Check every in-flight job with a single sacct call and finalize the finished ones.
+
+    Returns:
+        Number of samples whose jobs finished
+    """
+    inflight = list_inflight_jobs(conn)
+    if len(inflight) == 0:
+        SLURM_INFLIGHT.set(0)
+        return 0
+
+    log_dir = config['slurm_params'].get("log_dir", "slurm_logs")
+    max_age_seconds = float(config['slurm_params'].get("inflight_max_age_hours", DEFAULT_INFLIGHT_MAX_AGE_HOURS)) * 3600
+
+    # Packed bins put several samples on one job
+    jobs = {}
+    for sample_name, input_file, job_id, submitted_at in inflight:
+        jobs.setdefault(job_id, []).append((sample_name, input_file, submitted_at))
+
+    # Register everything first so one sacct call covers all jobs
+    watcher = submitit.SlurmJob.watcher
+    for job_id in jobs:
+        watcher.register_job(job_id)
+    watcher.update()
+
+    finished = []
+    outcomes = {}
+    for job_id, samples in jobs.items():
+        state = watcher.get_state(job_id, mode="cache").split(" ")[0].upper()
+        sample_names = [sample_name for sample_name, _, _ in samples]
+
+        if state in TERMINAL_STATES:
+            job = submitit.SlurmJob(folder=log_dir, job_id=job_id)
+            outcomes.update(report_slurm_job(job, state, [input_file for _, input_file, _ in samples], log_dir))
+            finished += sample_names
+        elif state in UNKNOWN_STATES and time.time() - min(submitted_at for _, _, submitted_at in samples) > max_age_seconds:
+            # Slurm has forgotten about the job; let the samples be picked up again.
+            # Live jobs stay in flight however long they queue, so a sample never runs twice.
+            logging.warning(StructuredMessage({"event_type": "slurm_job_abandoned", "job_id": job_id, "sample_names": sample_names, "state": state}))
+            finished += sample_names
+
+    remove_inflight_jobs(conn, finished)
+    update_failure_ledger(config, conn, outcomes)
+    SLURM_INFLIGHT.set(len(inflight) - len(finished))
+
+    logging.info(StructuredMessage({"event_type": "slurm_inflight_polled", "n_inflight": len(inflight), "n_finished": len(finished)}))
+
+    return len(finished)
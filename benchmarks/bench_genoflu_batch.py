@@ -0,0 +1,68 @@
+"""Measure GenoFLU throughput (samples/second) for different batch sizes.
+
+A batch size of 1 starts a fresh genoflu.py process per sample (the default path);
+larger batch sizes run the samples through one long-lived GenoFLU session.
+Requires genoflu.py on PATH.
+
+Usage:
+    python benchmarks/bench_genoflu_batch.py [--n-samples 100] [--batch-sizes 1 10 100]
+"""
+import os
+import sys
+import argparse
+import json
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from auto_genoflu._analysis import run_genoflu, run_genoflu_batch
+from auto_genoflu.local import make_batches
+
+from bench_hashing import write_fasta_corpus
+
+
+def run_benchmark(n_samples: int, batch_size: int, segment_length: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = {
+            "input_dir": os.path.join(tmp_dir, "inputs"),
+            "output_dir": os.path.join(tmp_dir, "outputs"),
+            "provenance_dir": os.path.join(tmp_dir, "logs"),
+            "work_dir": os.path.join(tmp_dir, "work"),
+            "id_threshold": 98.0,
+        }
+        for key in ["input_dir", "output_dir", "provenance_dir", "work_dir"]:
+            os.makedirs(config[key])
+        fasta_files = write_fasta_corpus(config["input_dir"], n_samples, segment_length)
+
+        start = time.perf_counter()
+        if batch_size == 1:
+            failed = [f for f in fasta_files if not run_genoflu(f, config)]
+        else:
+            failed = []
+            for batch in make_batches(fasta_files, batch_size):
+                failed += run_genoflu_batch(batch, config)
+        seconds = time.perf_counter() - start
+
+    return {
+        "batch_size": batch_size,
+        "n_samples": n_samples,
+        "n_failed": len(failed),
+        "seconds": round(seconds, 3),
+        "samples_per_second": round(n_samples / seconds, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark batched GenoFLU execution")
+    parser.add_argument("--n-samples", type=int, default=100)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--segment-length", type=int, default=1500)
+    args = parser.parse_args()
+
+    for batch_size in args.batch_sizes:
+        print(json.dumps(run_benchmark(args.n_samples, batch_size, args.segment_length)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Compare the in-process hashing engine against the legacy `shasum` subprocess path.
+
+Each engine is timed cold (the corpus evicted from the page cache first, where
+the platform supports it) and then warm, and the engines take turns going first,
+so neither benefits from the other having read the files. Median timings are reported.
+
+Usage:
+    python benchmarks/bench_hashing.py [--n-files 3000] [--segment-length 2000] [--workers 8] [--repeats 3]
+"""
+import os
+import sys
+import argparse
+import json
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from auto_genoflu._hashing import hash_files
+
+SEGMENTS = ["PB2", "PB1", "PA", "HA", "NP", "NA", "M", "NS"]
+
+
+def write_fasta_corpus(out_dir: str, n_files: int, segment_length: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    paths = []
+    for i in range(n_files):
+        path = os.path.join(out_dir, f"sample{i:06d}.fasta")
+        with open(path, "w") as f:
+            for segment in SEGMENTS:
+                seq = "".join(rng.choice("ACGT") for _ in range(segment_length))
+                f.write(f">sample{i:06d}_{segment}\n")
+                for start in range(0, len(seq), 70):
+                    f.write(seq[start:start + 70] + "\n")
+        paths.append(path)
+    return paths
+
+
+def hash_with_shasum(paths: list) -> dict:
+    return {path: subprocess.check_output(["shasum", path]).decode("utf-8").split()[0] for path in paths}
+
+
+def evict_page_cache(paths: list) -> bool:
+    """Drop the files from the page cache, so the next read comes from disk.
+
+    Returns:
+        False if the platform has no posix_fadvise, in which case nothing is evicted
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    # only clean pages can be dropped
+    os.sync()
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    return True
+
+
+def time_engines(engines: dict, paths: list, repeats: int) -> tuple:
+    """Time every engine cold, then warm, `repeats` times, alternating which engine goes first.
+
+    Returns:
+        (cold and warm seconds per repeat by engine, last digests by engine)
+    """
+    timings = {name: {"cold": [], "warm": []} for name in engines}
+    digests = {}
+    names = list(engines)
+    for repeat in range(repeats):
+        for name in (names if repeat % 2 == 0 else names[::-1]):
+            evicted = evict_page_cache(paths)
+            for mode in ["cold", "warm"]:
+                start = time.perf_counter()
+                digests[name] = engines[name](paths)
+                if mode == "cold" and not evicted:
+                    continue
+                timings[name][mode].append(time.perf_counter() - start)
+    return timings, digests
+
+
+def _median(seconds: list):
+    return round(statistics.median(seconds), 3) if seconds else None
+
+
+def _speedup(legacy_seconds, new_seconds):
+    return round(legacy_seconds / new_seconds, 1) if legacy_seconds and new_seconds else None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark hashing engines")
+    parser.add_argument("--n-files", type=int, default=3000)
+    parser.add_argument("--segment-length", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--repeats", type=int, default=3, help="Timings per engine; the engines alternate going first")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = write_fasta_corpus(tmp_dir, args.n_files, args.segment_length)
+        engines = {
+            "shasum_subprocess": hash_with_shasum,
+            "hashlib_batch": lambda paths: hash_files(paths, max_workers=args.workers),
+        }
+        timings, digests = time_engines(engines, paths, args.repeats)
+
+    results = {
+        "n_files": args.n_files,
+        "segment_length": args.segment_length,
+        "workers": args.workers,
+        "repeats": args.repeats,
+        "page_cache_evicted": hasattr(os, "posix_fadvise"),
+    }
+    for name in engines:
+        for mode in ["cold", "warm"]:
+            results[f"{name}_{mode}_seconds"] = _median(timings[name][mode])
+    for mode in ["cold", "warm"]:
+        results[f"speedup_{mode}"] = _speedup(results[f"shasum_subprocess_{mode}_seconds"], results[f"hashlib_batch_{mode}_seconds"])
+    results["digests_match"] = digests["shasum_subprocess"] == digests["hashlib_batch"]
+
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Time the main pipeline stages on a synthetic corpus with a stub GenoFLU.
+
+For each corpus size this measures:
+- `run_genoflu` on the first `--n-analysed` samples (the stub does the "analysis")
+- `find_genoflu_files_to_process` with an empty state index (cold) and again (warm)
+- `make_summary_file` with an empty summary cache (cold) and with nothing changed (warm)
+- a full steady-state `run_auto_analysis` cycle with nothing left to process
+
+No GenoFLU install or real data is needed. Results are written as one JSON document
+so runs from different releases can be compared.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--sizes 100 10000 100000] [--output results.json]
+"""
+import os
+import sys
+import argparse
+import json
+import logging
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import auto_genoflu._tools as tools
+from auto_genoflu._analysis import find_genoflu_files_to_process, run_genoflu
+from auto_genoflu._summary import SummaryCache
+from auto_genoflu.__main__ import run_auto_analysis
+
+from synthetic_corpus import write_synthetic_corpus, install_stub_genoflu, seed_completed_samples
+
+
+def _timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, round(time.perf_counter() - start, 4)
+
+
+def _version_info() -> dict:
+    try:
+        from importlib.metadata import version
+        package_version = version("auto_genoflu")
+    except Exception:
+        package_version = None
+    try:
+        git_commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode("utf-8").strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        git_commit = None
+    return {"package_version": package_version, "git_commit": git_commit}
+
+
+def run_benchmark(n_samples: int, n_analysed: int, segment_length: int, seed: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = {
+            "input_dir": os.path.join(tmp_dir, "inputs"),
+            "output_dir": os.path.join(tmp_dir, "outputs"),
+            "provenance_dir": os.path.join(tmp_dir, "logs"),
+            "work_dir": os.path.join(tmp_dir, "work"),
+            "summary_dir": os.path.join(tmp_dir, "summary"),
+            "glob_expressions": ["*.fa", "*.fasta", "*.fna"],
+            "id_threshold": 98.0,
+        }
+        for key in ["input_dir", "output_dir", "provenance_dir", "work_dir", "summary_dir"]:
+            os.makedirs(config[key])
+
+        env_dir = os.path.join(tmp_dir, "genoflu_env")
+        install_stub_genoflu(env_dir)
+        os.environ["PATH"] = os.path.join(env_dir, "bin") + os.pathsep + os.environ["PATH"]
+
+        fasta_files, corpus_seconds = _timed(write_synthetic_corpus, config["input_dir"], n_samples, segment_length, seed)
+
+        n_analysed = min(n_analysed, n_samples)
+        results, genoflu_seconds = _timed(lambda: [run_genoflu(f, config) for f in fasta_files[:n_analysed]])
+        seed_completed_samples(fasta_files[n_analysed:], config)
+
+        (_, _, cold_to_process), scan_cold_seconds = _timed(find_genoflu_files_to_process, config)
+        (_, _, warm_to_process), scan_warm_seconds = _timed(find_genoflu_files_to_process, config)
+
+        tools._SUMMARY_CACHE = SummaryCache()
+        _, summary_cold_seconds = _timed(tools.make_summary_file, config)
+        _, summary_warm_seconds = _timed(tools.make_summary_file, config)
+
+        _, cycle_seconds = _timed(run_auto_analysis, config)
+
+        os.environ["PATH"] = os.environ["PATH"].split(os.pathsep, 1)[1]
+
+    return {
+        "n_samples": n_samples,
+        "segment_length": segment_length,
+        "corpus_seconds": corpus_seconds,
+        "run_genoflu": {
+            "n_samples": n_analysed,
+            "n_failed": sum(1 for result in results if not result),
+            "seconds": genoflu_seconds,
+            "samples_per_second": round(n_analysed / genoflu_seconds, 2) if genoflu_seconds > 0 else None,
+        },
+        "find_files_cold_seconds": scan_cold_seconds,
+        "find_files_warm_seconds": scan_warm_seconds,
+        "find_files_to_process": [len(cold_to_process), len(warm_to_process)],
+        "make_summary_cold_seconds": summary_cold_seconds,
+        "make_summary_warm_seconds": summary_warm_seconds,
+        "steady_state_cycle_seconds": cycle_seconds,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark scan, analysis and summary scaling")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10000, 100000])
+    parser.add_argument("--n-analysed", type=int, default=50, help="Samples run through run_genoflu per size; the rest are seeded as already complete")
+    parser.add_argument("--segment-length", type=int, default=1500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to this JSON file as well as stdout")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    report = {
+        "benchmark": "bench_pipeline",
+        "timestamp": datetime.now().isoformat(),
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        **_version_info(),
+        "results": [],
+    }
+    for n_samples in args.sizes:
+        result = run_benchmark(n_samples, args.n_analysed, args.segment_length, args.seed)
+        print(json.dumps(result))
+        report["results"].append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Stand-in for genoflu.py used by the benchmarks.
+
+Accepts the same arguments auto_genoflu passes to GenoFLU, reads the input FASTA
+and writes `<name>_<date>_stats.tsv` and `<name>_<date>_stats.xlsx` to the
+current directory, with the same columns as a real GenoFLU run. Results are
+derived from the input so they are deterministic per sample.
+
+Set STUB_GENOFLU_SECONDS to add a fixed delay per run, simulating analysis time.
+"""
+import os
+import argparse
+import hashlib
+import time
+from datetime import datetime
+
+SEGMENTS = ["PB2", "PB1", "PA", "HA", "NP", "NA", "MP", "NS"]
+GENOTYPES = ["A3", "B3.2", "B3.13", "D1.1", "A1", "D1.2"]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", required=True)
+    parser.add_argument("-c", required=True)
+    parser.add_argument("-p", type=float, default=98.0)
+    parser.add_argument("-f", required=True)
+    parser.add_argument("-n", required=True)
+    args = parser.parse_args()
+
+    digest = hashlib.sha1()
+    n_records = 0
+    with open(args.f, "rb") as f:
+        for line in f:
+            digest.update(line)
+            if line.startswith(b">"):
+                n_records += 1
+    seed = digest.digest()
+
+    delay = float(os.environ.get("STUB_GENOFLU_SECONDS", "0"))
+    if delay > 0:
+        time.sleep(delay)
+
+    segments = SEGMENTS[:n_records]
+    # Mostly confident matches, with some samples falling in each lower confidence band
+    percents = [100.0 - (seed[i] % 40) / 4 if seed[0] % 5 == 0 else 100.0 - (seed[i] % 20) / 10 for i in range(len(segments))]
+    genotype = GENOTYPES[seed[1] % len(GENOTYPES)] if min(percents, default=0) >= args.p else "Not assigned"
+
+    columns = ["Strain", "Genotype", "Genotype Average Depth of Coverage List", f"Genotype List Used, >={args.p}%", "Genotype Percent Match List", "Genotype Mismatch List"]
+    row = [
+        args.n,
+        genotype,
+        ", ".join(f"{s}:{20 + seed[i] % 200}" for i, s in enumerate(segments)),
+        ", ".join(f"{s}:{genotype}" for s in segments),
+        ", ".join(f"{p:.2f}%" for p in percents),
+        ", ".join(f"{s}:{seed[i] % 4}" for i, s in enumerate(segments)),
+    ]
+
+    prefix = f"{args.n}_{datetime.now().strftime('%Y-%m-%d')}"
+    with open(f"{prefix}_stats.tsv", "w") as f:
+        f.write("\t".join(columns) + "\n")
+        f.write("\t".join(row) + "\n")
+    # auto_genoflu only checks that the Excel report exists
+    open(f"{prefix}_stats.xlsx", "wb").close()
+
+    print(f"{args.n}: {genotype}")
+
+
+if __name__ == "__main__":
+    main()
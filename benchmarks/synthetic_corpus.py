@@ -0,0 +1,112 @@
+"""Synthetic 8-segment influenza inputs and a stub GenoFLU install for the benchmarks.
+
+Sample names follow the three naming styles `rename_fasta_headers` recognises:
+
+- CFIA: `FLU-CFIA-24-ON-000001_L001_S1_R1.consensus.fasta`, headers `>..._PB2`
+- GISAID: `EPI_ISL_10000001.fasta`, headers `>A/chicken/...|EPI_ISL_10000001|PB2|2024-01-01|H5N1`
+- nf-flu: `R24-000001-A-S1.consensus.fasta`, headers `>R24-000001-A-S1_1_PB2`
+"""
+import os
+import sys
+import json
+import random
+import shutil
+import stat
+from datetime import datetime
+from typing import List
+
+SEGMENTS = ["PB2", "PB1", "PA", "HA", "NP", "NA", "M", "NS"]
+STYLES = ["cfia", "gisaid", "nf-flu"]
+
+# Maps every byte value onto a base, so random bytes become a random sequence in one call
+_BASES = bytes.maketrans(bytes(range(256)), b"ACGT" * 64)
+
+
+def _sample_file_name(style: str, index: int) -> str:
+    if style == "cfia":
+        return f"FLU-CFIA-24-ON-{index:06d}_L001_S1_R1.consensus.fasta"
+    if style == "gisaid":
+        return f"EPI_ISL_{10000000 + index}.fasta"
+    return f"R24-{index:06d}-A-S1.consensus.fasta"
+
+
+def _header(style: str, file_name: str, index: int, segment: str) -> str:
+    sample = file_name.split(".")[0]
+    if style == "cfia":
+        return f"{sample}_{segment}"
+    if style == "gisaid":
+        return f"A/chicken/Ontario/{index}/2024|{sample}|{segment}|2024-01-01|H5N1"
+    return f"{sample}_{SEGMENTS.index(segment) + 1}_{segment}"
+
+
+def write_synthetic_corpus(out_dir: str, n_samples: int, segment_length: int = 1500, seed: int = 0, styles: List[str] = STYLES) -> List[str]:
+    """Write n_samples 8-segment FASTAs, cycling through the naming styles.
+
+    Returns:
+        Paths of the FASTA files written
+    """
+    rng = random.Random(seed)
+    paths = []
+    for index in range(n_samples):
+        style = styles[index % len(styles)]
+        file_name = _sample_file_name(style, index)
+        path = os.path.join(out_dir, file_name)
+        with open(path, "wb") as f:
+            for segment in SEGMENTS:
+                # same bytes as rng.randbytes, which needs Python 3.9
+                seq = rng.getrandbits(8 * segment_length).to_bytes(segment_length, "little").translate(_BASES) if segment_length else b""
+                f.write(f">{_header(style, file_name, index, segment)}\n".encode("utf-8"))
+                for start in range(0, len(seq), 70):
+                    f.write(seq[start:start + 70] + b"\n")
+        paths.append(path)
+    return paths
+
+
+def install_stub_genoflu(env_dir: str) -> str:
+    """Lay out a fake GenoFLU environment (`bin/genoflu.py`, `dependencies/`) under env_dir.
+
+    Put `<env_dir>/bin` first on PATH for auto_genoflu to find it.
+
+    Returns:
+        Path of the installed genoflu.py
+    """
+    bin_dir = os.path.join(env_dir, "bin")
+    os.makedirs(bin_dir, exist_ok=True)
+    os.makedirs(os.path.join(env_dir, "dependencies", "fastas"), exist_ok=True)
+    open(os.path.join(env_dir, "dependencies", "genotype_key.xlsx"), "wb").close()
+
+    script_path = os.path.join(bin_dir, "genoflu.py")
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_genoflu.py")) as src, open(script_path, "w") as dest:
+        dest.write(f"#!{sys.executable}\n")
+        shutil.copyfileobj(src, dest)
+    os.chmod(script_path, os.stat(script_path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+    return script_path
+
+
+def seed_completed_samples(fasta_files: List[str], config: dict) -> None:
+    """Write outputs and provenance as if every sample had already been analysed.
+
+    Builds a steady-state tree far faster than running the stub for every sample.
+    """
+    from auto_genoflu._hashing import hash_file
+    from auto_genoflu._tools import get_input_name
+
+    columns = ["Strain", "Genotype", "Genotype Average Depth of Coverage List", "Genotype List Used, >=98.0%", "Genotype Percent Match List", "Genotype Mismatch List"]
+    for index, fasta_file in enumerate(fasta_files):
+        sample_name = get_input_name(fasta_file)
+        percent = 100.0 - (index % 40) / 4
+        output_path = os.path.join(config['output_dir'], f"{sample_name}__genoflu.tsv")
+        with open(output_path, "w") as f:
+            f.write("\t".join(columns) + "\n")
+            f.write("\t".join([sample_name, "B3.13", "PB2:100", "PB2:B3.13", ", ".join([f"{percent:.2f}%"] * 8), "PB2:0"]) + "\n")
+
+        provenance = {
+            "timestamp_analysis_complete": datetime.now().isoformat(),
+            "input_file": fasta_file,
+            "input_hash": hash_file(fasta_file),
+            "output_file": output_path,
+            "output_hash": hash_file(output_path),
+        }
+        with open(os.path.join(config['provenance_dir'], f"{sample_name}__genoflu_complete.json"), "w") as f:
+            json.dump(provenance, f)
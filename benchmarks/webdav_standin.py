@@ -0,0 +1,254 @@
+"""A local WebDAV stand-in for Nextcloud, to exercise the transfer layer without a server.
+
+Serves a directory over the subset of WebDAV that `auto_genoflu._transfer` uses
+(PUT, MKCOL, MOVE, DELETE and Depth 1 PROPFIND), including Nextcloud's chunked
+upload (v2) assembly on MOVE of `<upload>/.file`. The first attempts of every
+request can be answered with a 503, to exercise the retries.
+
+By default the script runs a self-check of plain, chunked and failed uploads and
+of folder priming, and prints the results. With --serve it only serves, so the
+daemon can be pointed at it: set the credentials URL to
+`http://127.0.0.1:<port>/remote.php/dav/files/<user>`.
+
+Usage:
+    python benchmarks/webdav_standin.py [--failures-per-request 1] [--file-size-mb 2.5]
+    python benchmarks/webdav_standin.py --serve [--port 8080] [--root DIR]
+"""
+import os
+import sys
+import argparse
+import json
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlparse
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from auto_genoflu._transfer import TransferError, configure_transfers, upload_file, make_remote_folder, prime_remote_dir_cache, MB
+
+USERNAME = "genoflu"
+
+
+class WebDAVStandIn(ThreadingHTTPServer):
+    """Serves `root` as a WebDAV share; the first `failures_per_request` attempts
+    of each (method, path) get a 503."""
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple, root: str, failures_per_request: int = 0):
+        super().__init__(address, _Handler)
+        self.root = root
+        self.failures_per_request = failures_per_request
+        self.attempts = {}
+        self.requests_failed = 0
+        self.lock = threading.Lock()
+
+    def should_fail(self, method: str, path: str) -> bool:
+        with self.lock:
+            attempt = self.attempts.get((method, path), 0)
+            self.attempts[(method, path)] = attempt + 1
+            if attempt < self.failures_per_request:
+                self.requests_failed += 1
+                return True
+            return False
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _local_path(self, url: str) -> str:
+        return os.path.join(self.server.root, unquote(urlparse(url).path).lstrip("/"))
+
+    def _read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            body = b""
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return body
+                body += self.rfile.read(size)
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _respond(self, status: int, body: bytes = b"", content_type: str = "text/plain") -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method: str) -> None:
+        body = self._read_body()
+        if self.server.should_fail(method, self.path):
+            self._respond(503, b"injected failure")
+            return
+
+        path = self._local_path(self.path)
+        if method == "PUT":
+            if not os.path.isdir(os.path.dirname(path)):
+                self._respond(409)
+                return
+            with open(path, "wb") as f:
+                f.write(body)
+            self._respond(201)
+        elif method == "MKCOL":
+            if os.path.exists(path):
+                self._respond(405)
+            elif not os.path.isdir(os.path.dirname(path)):
+                self._respond(409)
+            else:
+                os.mkdir(path)
+                self._respond(201)
+        elif method == "MOVE":
+            dest_path = self._local_path(self.headers["Destination"])
+            if not os.path.isdir(os.path.dirname(dest_path)):
+                self._respond(409)
+            elif os.path.basename(path) == ".file":
+                # chunked upload: assemble the chunks in name order, then drop the upload folder
+                upload_dir = os.path.dirname(path)
+                with open(dest_path, "wb") as out:
+                    for name in sorted(os.listdir(upload_dir)):
+                        with open(os.path.join(upload_dir, name), "rb") as chunk:
+                            shutil.copyfileobj(chunk, out)
+                if os.path.getsize(dest_path) != int(self.headers.get("OC-Total-Length", os.path.getsize(dest_path))):
+                    os.remove(dest_path)
+                    self._respond(400, b"total length mismatch")
+                    return
+                shutil.rmtree(upload_dir)
+                self._respond(201)
+            elif os.path.exists(path):
+                shutil.move(path, dest_path)
+                self._respond(201)
+            else:
+                self._respond(404)
+        elif method == "DELETE":
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+            else:
+                self._respond(404)
+                return
+            self._respond(204)
+        elif method == "PROPFIND":
+            if not os.path.exists(path):
+                self._respond(404)
+                return
+            entries = [path] + ([os.path.join(path, name) for name in sorted(os.listdir(path))] if os.path.isdir(path) else [])
+            responses = "".join(
+                f"<d:response><d:href>{escape(quote('/' + os.path.relpath(entry, self.server.root)))}{'/' if os.path.isdir(entry) else ''}</d:href>"
+                f"<d:propstat><d:prop><d:resourcetype>{'<d:collection/>' if os.path.isdir(entry) else ''}</d:resourcetype></d:prop>"
+                f"<d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>"
+                for entry in entries
+            )
+            self._respond(207, f'<?xml version="1.0"?><d:multistatus xmlns:d="DAV:">{responses}</d:multistatus>'.encode("utf-8"), "application/xml")
+        else:
+            self._respond(405)
+
+    def do_PUT(self) -> None:
+        self._handle("PUT")
+
+    def do_MKCOL(self) -> None:
+        self._handle("MKCOL")
+
+    def do_MOVE(self) -> None:
+        self._handle("MOVE")
+
+    def do_DELETE(self) -> None:
+        self._handle("DELETE")
+
+    def do_PROPFIND(self) -> None:
+        self._handle("PROPFIND")
+
+
+def start_standin(root: str, port: int = 0, failures_per_request: int = 0) -> WebDAVStandIn:
+    """Start a stand-in serving root in a background thread, with the Nextcloud files and uploads folders created."""
+    for folder in ["files", "uploads"]:
+        os.makedirs(os.path.join(root, "remote.php", "dav", folder, USERNAME), exist_ok=True)
+    server = WebDAVStandIn(("127.0.0.1", port), root, failures_per_request)
+    threading.Thread(target=server.serve_forever, name="webdav-standin", daemon=True).start()
+    return server
+
+
+def run_checks(failures_per_request: int, file_size_mb: float) -> dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = os.path.join(tmp_dir, "share")
+        server = start_standin(root, failures_per_request=failures_per_request)
+        credentials = {"USERNAME": USERNAME, "PASSWORD": "secret", "URL": f"http://127.0.0.1:{server.server_address[1]}/remote.php/dav/files/{USERNAME}"}
+        remote_files = os.path.join(root, "remote.php", "dav", "files", USERNAME)
+        configure_transfers({"nextcloud_params": {"max_retries": failures_per_request + 1, "backoff_seconds": 0.01,
+                                                  "chunked_upload_threshold_mb": 1, "chunk_size_mb": 0.25}})
+
+        small_file = os.path.join(tmp_dir, "small.tsv")
+        with open(small_file, "wb") as f:
+            f.write(os.urandom(64 * 1024))
+        large_file = os.path.join(tmp_dir, "large.tsv")
+        with open(large_file, "wb") as f:
+            f.write(os.urandom(int(file_size_mb * MB)))
+
+        start = time.perf_counter()
+        mkcol_status = make_remote_folder(credentials, f"{credentials['URL']}/outputs")
+        upload_file(credentials, small_file, f"{credentials['URL']}/outputs/small.tsv")
+        upload_file(credentials, large_file, f"{credentials['URL']}/outputs/large.tsv")
+        try:
+            upload_file(credentials, small_file, f"{credentials['URL']}/missing/small.tsv")
+            missing_folder_status = None
+        except TransferError as e:
+            missing_folder_status = e.status_code
+        folders_primed = prime_remote_dir_cache(credentials, f"{credentials['URL']}/")
+        seconds = time.perf_counter() - start
+
+        def same_content(local_path: str, remote_name: str) -> bool:
+            remote_path = os.path.join(remote_files, "outputs", remote_name)
+            with open(local_path, "rb") as local, open(remote_path, "rb") as remote:
+                return local.read() == remote.read()
+
+        results = {
+            "failures_per_request": failures_per_request,
+            "requests_failed": server.requests_failed,
+            "mkcol_status": mkcol_status,
+            "plain_upload_identical": same_content(small_file, "small.tsv"),
+            "chunked_upload_identical": same_content(large_file, "large.tsv"),
+            "chunk_uploads_left": len(os.listdir(os.path.join(root, "remote.php", "dav", "uploads", USERNAME))),
+            "missing_folder_status": missing_folder_status,
+            "folders_primed": folders_primed,
+            "seconds": round(seconds, 3),
+        }
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local WebDAV stand-in for the Nextcloud transfer layer")
+    parser.add_argument("--serve", action="store_true", help="Only serve, until interrupted")
+    parser.add_argument("--port", type=int, default=8080, help="Port for --serve")
+    parser.add_argument("--root", default=None, help="Directory to serve with --serve (default: a temporary directory)")
+    parser.add_argument("--failures-per-request", type=int, default=1, help="503s returned before each request succeeds")
+    parser.add_argument("--file-size-mb", type=float, default=2.5, help="Size of the file sent with chunked upload")
+    args = parser.parse_args()
+
+    if not args.serve:
+        print(json.dumps(run_checks(args.failures_per_request, args.file_size_mb)))
+        return
+
+    root = args.root or tempfile.mkdtemp(prefix="webdav-standin-")
+    server = start_standin(root, port=args.port, failures_per_request=args.failures_per_request)
+    print(json.dumps({"url": f"http://127.0.0.1:{args.port}/remote.php/dav/files/{USERNAME}", "root": root}))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()